@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
 from utils.utils_audio import write_wav
 
 class Trainer:
@@ -31,6 +32,8 @@ class Trainer:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -101,7 +104,9 @@ class Trainer:
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -204,4 +209,4 @@ class Trainer:
         
         package['epoch'] = epoch + 1
         
-        torch.save(package, model_path)
\ No newline at end of file
+        self.checkpoint_writer.save(package, model_path)
\ No newline at end of file
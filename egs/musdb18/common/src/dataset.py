@@ -4,6 +4,7 @@ import torch
 import torchaudio
 
 from utils.utils_audio import build_window
+from utils.utils_dataset import build_packed_audio, FeatureCache
 
 __sources__ = ['bass', 'drums', 'other', 'vocals']
 
@@ -71,11 +72,11 @@ class WaveDataset(MUSDB18Dataset):
         samples = data['samples']
 
         if set(self.sources) == set(__sources__):
-            mixture, _ = torchaudio.load(paths['mixture'], frame_offset=start, num_frames=samples)
+            mixture = self._load_audio(paths['mixture'], frame_offset=start, num_frames=samples)
         else:
             sources = []
             for _source in self.sources:
-                source, _ = torchaudio.load(paths[_source], frame_offset=start, num_frames=samples)
+                source = self._load_audio(paths[_source], frame_offset=start, num_frames=samples)
                 sources.append(source.unsqueeze(dim=0))
             sources = torch.cat(sources, dim=0)
             mixture = sources.sum(dim=0)
@@ -83,17 +84,30 @@ class WaveDataset(MUSDB18Dataset):
         if type(self.target) is list:
             target = []
             for _target in self.target:
-                source, _ = torchaudio.load(paths[_target], frame_offset=start, num_frames=samples)
+                source = self._load_audio(paths[_target], frame_offset=start, num_frames=samples)
                 target.append(source.unsqueeze(dim=0))
             target = torch.cat(target, dim=0)
             mixture = mixture.unsqueeze(dim=0)
         else:
-            target, _ = torchaudio.load(paths[self.target], frame_offset=start, num_frames=samples)
+            target = self._load_audio(paths[self.target], frame_offset=start, num_frames=samples)
 
         return mixture, target, name
 
     def __len__(self):
         return len(self.json_data)
+    
+    def _load_audio(self, path, frame_offset=0, num_frames=-1):
+        """
+        Args:
+            path <str>: Path to audio file
+            frame_offset <int>: Start sample
+            num_frames <int>: Number of samples. If -1, audio is loaded until the end.
+        Returns:
+            wave (n_mics, num_frames) <torch.Tensor>
+        """
+        wave, _ = torchaudio.load(path, frame_offset=frame_offset, num_frames=num_frames)
+
+        return wave
 
 class WaveTrainDataset(WaveDataset):
     def __init__(self, musdb18_root, sr=SAMPLE_RATE_MUSDB18, samples=4*SAMPLE_RATE_MUSDB18, overlap=None, sources=__sources__, target=None, threshold=THRESHOLD_POWER):
@@ -272,6 +286,36 @@ class WaveTestDataset(WaveDataset):
 
             self.json_data.append(data)
 
+class PackedWaveTrainDataset(WaveTrainDataset):
+    """
+    Same as `WaveTrainDataset`, but audio is loaded from memory-mapped array packed in `pack_dir`.
+    The array is packed at the first time.
+    """
+    def __init__(self, musdb18_root, pack_dir, sr=SAMPLE_RATE_MUSDB18, samples=4*SAMPLE_RATE_MUSDB18, overlap=None, sources=__sources__, target=None, threshold=THRESHOLD_POWER, dtype='float32'):
+        super().__init__(musdb18_root, sr=sr, samples=samples, overlap=overlap, sources=sources, target=target, threshold=threshold)
+
+        self.packed_audio = build_packed_audio(search_paths(self.tracks), pack_dir, root=self.musdb18_root, dtype=dtype)
+    
+    def _load_audio(self, path, frame_offset=0, num_frames=-1):
+        wave, _ = self.packed_audio.load(path, frame_offset=frame_offset, num_frames=num_frames)
+
+        return wave
+
+class PackedWaveEvalDataset(WaveEvalDataset):
+    """
+    Same as `WaveEvalDataset`, but audio is loaded from memory-mapped array packed in `pack_dir`.
+    The array is packed at the first time.
+    """
+    def __init__(self, musdb18_root, pack_dir, sr=SAMPLE_RATE_MUSDB18, max_samples=4*SAMPLE_RATE_MUSDB18, sources=__sources__, target=None, dtype='float32'):
+        super().__init__(musdb18_root, sr=sr, max_samples=max_samples, sources=sources, target=target)
+
+        self.packed_audio = build_packed_audio(search_paths(self.tracks), pack_dir, root=self.musdb18_root, dtype=dtype)
+    
+    def _load_audio(self, path, frame_offset=0, num_frames=-1):
+        wave, _ = self.packed_audio.load(path, frame_offset=frame_offset, num_frames=num_frames)
+
+        return wave
+
 class SpectrogramDataset(WaveDataset):
     def __init__(self, musdb18_root, fft_size, hop_size=None, window_fn='hann', normalize=False, sr=SAMPLE_RATE_MUSDB18, sources=__sources__, target=None):
         super().__init__(musdb18_root, sr=sr, sources=sources, target=target)
@@ -289,8 +333,22 @@ class SpectrogramDataset(WaveDataset):
         else:
             self.window = None
         
+        self.window_fn = window_fn
         self.normalize = normalize
 
+        self.feature_cache = None
+    
+    def enable_feature_cache(self, cache_dir, max_bytes=None, dtype='complex64', n_shards=16):
+        """
+        Spectrograms are cached on disk, because segments are deterministic.
+        Args:
+            cache_dir <str>: Directory of cache
+            max_bytes <int>: Size cap in bytes. Least recently used spectrograms are evicted.
+            dtype <str>: 'complex64' or 'float16' (magnitude and phase)
+            n_shards <int>: Number of sub-directories
+        """
+        self.feature_cache = FeatureCache(cache_dir, max_bytes=max_bytes, dtype=dtype, n_shards=n_shards)
+
     def _is_active(self, input, threshold=1e-5):
         n_dims = input.dim()
 
@@ -314,6 +372,44 @@ class SpectrogramDataset(WaveDataset):
             T (), <int>: Number of samples in time-domain
             name <str>: Artist and title of track
         """
+        if self.feature_cache is None:
+            return self._compute_spectrogram(idx)
+        
+        data = self.json_data[idx]
+        track = self.tracks[data['trackID']]
+        paths = track['path']
+        start, samples = data['start'], data['samples']
+
+        targets = self.target if type(self.target) is list else [self.target]
+
+        if set(self.sources) == set(__sources__):
+            mixture_paths = [paths['mixture']]
+        else:
+            mixture_paths = [paths[_source] for _source in self.sources]
+
+        key = [self.fft_size, self.hop_size, self.window_fn, self.normalize, start, samples]
+        key += [tuple(mixture_paths), tuple([paths[_target] for _target in targets])]
+        key = tuple(key)
+
+        feature = self.feature_cache.get(key)
+
+        if feature is None:
+            mixture, target, T, name = self._compute_spectrogram(idx)
+            self.feature_cache.put(key, torch.cat([mixture.reshape(-1, *mixture.size()[-2:]), target.reshape(-1, *target.size()[-2:])], dim=0))
+        else:
+            n_mics = feature.size(0) // (len(targets) + 1)
+            mixture, target = torch.split(feature, [n_mics, feature.size(0) - n_mics], dim=0)
+
+            if type(self.target) is list:
+                mixture = mixture.unsqueeze(dim=0) # (1, n_mics, n_bins, n_frames)
+                target = target.reshape(len(targets), n_mics, *target.size()[-2:]) # (len(target), n_mics, n_bins, n_frames)
+            
+            T = samples
+            name = track['name']
+        
+        return mixture, target, T, name
+    
+    def _compute_spectrogram(self, idx):
         mixture, target, name = super().__getitem__(idx)
         
         n_dims = mixture.dim()
@@ -575,6 +671,18 @@ def test_collate_fn(batch):
     
     return batched_mixture, batched_sources, batched_segment_ID
 
+def search_paths(tracks):
+    """
+    Returns:
+        paths <list<str>>: Paths of mixtures and sources included in `tracks`.
+    """
+    paths = []
+
+    for track in tracks:
+        paths += list(track['path'].values())
+
+    return paths
+
 def assert_sample_rate(sr):
     assert sr == SAMPLE_RATE_MUSDB18, "sample rate is expected {}, but given {}".format(SAMPLE_RATE_MUSDB18, sr)
 
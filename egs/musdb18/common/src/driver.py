@@ -1,5 +1,7 @@
 import os
 import time
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import musdb
 import museval
@@ -8,6 +10,8 @@ import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
+from utils.utils_precision import MixedPrecision, to_fp32
 from algorithm.frequency_mask import multichannel_wiener_filter
 
 BITS_PER_SAMPLE_MUSDB18 = 16
@@ -37,12 +41,16 @@ class TrainerBase:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
         self.valid_loss = torch.empty(self.epochs)
         
         self.use_cuda = args.use_cuda
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
+        self.speedup = None
         
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
@@ -62,6 +70,9 @@ class TrainerBase:
                 self.model.load_state_dict(config['state_dict'])
             
             self.optimizer.load_state_dict(config['optim_dict'])
+            
+            if 'scaler_dict' in config:
+                self.mixed_precision.load_state_dict(config['scaler_dict'])
         else:
             model_path = os.path.join(self.model_dir, "best.pth")
             
@@ -83,7 +94,12 @@ class TrainerBase:
             train_loss, valid_loss = self.run_one_epoch(epoch)
             end = time.time()
             
-            print("[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch + 1, self.epochs, train_loss, valid_loss, end - start), flush=True)
+            s = "[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch + 1, self.epochs, train_loss, valid_loss, end - start)
+            
+            if self.speedup is not None:
+                s += ", {}: x{:.2f} faster than fp32".format(self.mixed_precision.precision, self.speedup)
+            
+            print(s, flush=True)
             
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
@@ -114,7 +130,9 @@ class TrainerBase:
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -139,16 +157,22 @@ class TrainerBase:
                 mixture = mixture.cuda()
                 sources = sources.cuda()
             
-            estimated_sources = self.model(mixture)
-            loss = self.criterion(estimated_sources, sources)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.criterion(to_fp32(self.model(mixture)), sources))
+            
+            with self.mixed_precision.autocast():
+                estimated_sources = self.model(mixture)
+            
+            loss = self.criterion(to_fp32(estimated_sources), sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -173,7 +197,11 @@ class TrainerBase:
                 if self.use_cuda:
                     mixture = mixture.cuda()
                     sources = sources.cuda()
-                estimated_sources = self.model(mixture)
+                
+                with self.mixed_precision.autocast():
+                    estimated_sources = self.model(mixture)
+                
+                estimated_sources = to_fp32(estimated_sources)
                 loss = self.criterion(estimated_sources, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
@@ -207,6 +235,7 @@ class TrainerBase:
             config['state_dict'] = self.model.state_dict()
             
         config['optim_dict'] = self.optimizer.state_dict()
+        config['scaler_dict'] = self.mixed_precision.state_dict()
         
         config['best_loss'] = self.best_loss
         config['no_improvement'] = self.no_improvement
@@ -216,7 +245,7 @@ class TrainerBase:
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class TesterBase:
     def __init__(self, model, loader, criterion, args):
@@ -239,6 +268,7 @@ class TesterBase:
             os.makedirs(self.out_dir, exist_ok=True)
         
         self.use_cuda = args.use_cuda
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
         
         config = torch.load(args.model_path, map_location=lambda storage, loc: storage)
         
@@ -285,6 +315,135 @@ class EvaluaterBase:
 
         return scores
 
+def evaluate_tracks(musdb18_root, estimates_dir, sources, json_dir=None, n_workers=1, subsets='test'):
+    """
+    Evaluate estimated tracks by museval on process pool.
+    Scores of each track are saved to `json_dir` as soon as the track is finished,
+    and tracks whose json already exists are skipped, so that interrupted evaluation can be resumed.
+    Args:
+        musdb18_root <str>: Root directory of MUSDB18
+        estimates_dir <str>: Directory which includes <track name>/<target>.wav
+        sources <list<str>>: Targets. 'accompaniment' is computed as sum of targets except for 'vocals'.
+        json_dir <str>: Directory of scores, which are saved as <json_dir>/<subsets>/<track name>.json
+        n_workers <int>: Number of processes. If 0, tracks are evaluated in the main process.
+    Returns:
+        results <museval.EvalStore>: Scores of all tracks in order of `musdb.DB`
+    """
+    mus = musdb.DB(root=musdb18_root, subsets=subsets)
+    names = [track.name for track in mus.tracks]
+    targets = list(sources) + ['accompaniment']
+
+    scores = {}
+
+    if json_dir is not None:
+        for name in names:
+            json_path = os.path.join(json_dir, subsets, "{}.json".format(name))
+            track_scores = _load_track_scores(json_path, targets)
+
+            if track_scores is not None:
+                scores[name] = track_scores
+        
+        if len(scores) > 0:
+            print("Skip {} tracks already evaluated in {}.".format(len(scores), json_dir), flush=True)
+
+    remaining_names = [name for name in names if name not in scores]
+
+    if n_workers > 0:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_evaluation_worker, initargs=(musdb18_root, subsets)) as executor:
+            futures = [
+                executor.submit(_evaluate_track, name, estimates_dir, sources, json_dir) for name in remaining_names
+            ]
+
+            for future in as_completed(futures):
+                name, track_scores = future.result()
+                scores[name] = track_scores
+
+                print(name)
+                print(track_scores, flush=True)
+    else:
+        _init_evaluation_worker(musdb18_root, subsets, mus=mus)
+
+        for name in remaining_names:
+            name, track_scores = _evaluate_track(name, estimates_dir, sources, json_dir)
+            scores[name] = track_scores
+
+            print(name)
+            print(track_scores, flush=True)
+
+    results = museval.EvalStore(frames_agg='median', tracks_agg='median')
+
+    for name in names:
+        results.add_track(scores[name])
+
+    return results
+
+_evaluation_tracks = None
+
+def _init_evaluation_worker(musdb18_root, subsets, mus=None):
+    global _evaluation_tracks
+
+    if mus is None:
+        mus = musdb.DB(root=musdb18_root, subsets=subsets)
+
+    _evaluation_tracks = {
+        track.name: track for track in mus.tracks
+    }
+
+def _evaluate_track(name, estimates_dir, sources, json_dir=None):
+    track = _evaluation_tracks[name]
+
+    estimates = {}
+    estimated_accompaniment = 0
+
+    for target in sources:
+        estimated_path = os.path.join(estimates_dir, name, "{}.wav".format(target))
+        estimated, _ = torchaudio.load(estimated_path)
+        estimated = estimated.numpy().transpose(1, 0)
+        estimates[target] = estimated
+        if target != 'vocals':
+            estimated_accompaniment += estimated
+
+    estimates['accompaniment'] = estimated_accompaniment
+
+    # Evaluate using museval
+    scores = museval.eval_mus_track(track, estimates)
+
+    if json_dir is not None:
+        # Write to temporary file and rename it, so that crash never leaves broken json behind.
+        json_path = os.path.join(json_dir, track.subset, "{}.json".format(name))
+        tmp_path = "{}.{}.tmp".format(json_path, os.getpid())
+        os.makedirs(os.path.dirname(json_path), exist_ok=True)
+
+        with open(tmp_path, 'w') as f:
+            f.write(scores.json)
+        
+        os.replace(tmp_path, json_path)
+
+    return name, scores
+
+def _load_track_scores(json_path, targets):
+    """
+    Returns:
+        scores <pandas.DataFrame>: Returns None if json doesn't exist, is broken, or lacks any of `targets`.
+    """
+    if not os.path.exists(json_path):
+        return None
+
+    try:
+        with open(json_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    evaluated_targets = [target['name'] for target in data.get('targets', [])]
+
+    if not set(targets) <= set(evaluated_targets):
+        return None
+
+    name = os.path.splitext(os.path.basename(json_path))[0]
+
+    return museval.aggregate.json2df(data, name)
+
 def apply_multichannel_wiener_filter_norbert(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, eps=EPS):
     """
     Args:
@@ -320,7 +479,7 @@ def apply_multichannel_wiener_filter_norbert(mixture, estimated_sources_amplitud
 
     return estimated_sources
 
-def apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, eps=EPS):
+def apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, chunk_size=None, n_threads=1, eps=EPS):
     """
     Multichannel Wiener filter.
     Implementation is based on norbert package.
@@ -329,6 +488,8 @@ def apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude,
         estimated_sources_amplitude <torch.Tensor>: (n_sources, n_channels, n_bins, n_frames) or (batch_size, n_sources, n_channels, n_bins, n_frames)
         iteration <int>: Iteration of EM algorithm updates
         channels_first <bool>: Only supports True
+        chunk_size <int>: Number of frames processed at once. If None, all frames are processed at once.
+        n_threads <int>: Number of threads, each of which processes a band of frequency bins.
         eps <float>: small value for numerical stability
     """
-    return multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=iteration, channels_first=channels_first, eps=eps)
+    return multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=iteration, channels_first=channels_first, chunk_size=chunk_size, n_threads=n_threads, eps=eps)
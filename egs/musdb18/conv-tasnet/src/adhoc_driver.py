@@ -4,6 +4,8 @@ import torch
 import torchaudio
 import torch.nn as nn
 
+from utils.utils_precision import to_fp32
+from utils.utils_checkpoint import CheckpointWriter
 from driver import TrainerBase, TesterBase
 
 BITS_PER_SAMPLE_MUSDB18 = 16
@@ -29,16 +31,23 @@ class AdhocTrainer(TrainerBase):
             mean, std = mixture.mean(dim=-1, keepdim=True), mixture.std(dim=-1, keepdim=True)
             standardized_mixture = (mixture - mean) / (std + EPS)
             standardized_sources = (sources - mean) / (std + EPS)
-            standardized_estimated_sources = self.model(standardized_mixture)
-            loss = self.criterion(standardized_estimated_sources, standardized_sources)
+            
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.criterion(to_fp32(self.model(standardized_mixture)), standardized_sources))
+            
+            with self.mixed_precision.autocast():
+                standardized_estimated_sources = self.model(standardized_mixture)
+            
+            loss = self.criterion(to_fp32(standardized_estimated_sources), standardized_sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -66,7 +75,11 @@ class AdhocTrainer(TrainerBase):
                 mean, std = mixture.mean(dim=-1, keepdim=True), mixture.std(dim=-1, keepdim=True)
                 standardized_mixture = (mixture - mean) / (std + EPS)
                 standardized_sources = (sources - mean) / (std + EPS)
-                standardized_estimated_sources = self.model(standardized_mixture)
+                
+                with self.mixed_precision.autocast():
+                    standardized_estimated_sources = self.model(standardized_mixture)
+                
+                standardized_estimated_sources = to_fp32(standardized_estimated_sources)
                 loss = self.criterion(standardized_estimated_sources, standardized_sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
@@ -102,6 +115,7 @@ class AdhocTrainer(TrainerBase):
             config['state_dict'] = self.model.state_dict()
             
         config['optim_dict'] = self.optimizer.state_dict()
+        config['scaler_dict'] = self.mixed_precision.state_dict()
         
         config['best_loss'] = self.best_loss
         config['no_improvement'] = self.no_improvement
@@ -112,7 +126,7 @@ class AdhocTrainer(TrainerBase):
         config['epoch'] = epoch + 1
         config['sr'] = self.train_loader.dataset.sr
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class Tester(TesterBase):
     def __init__(self, model, loader, criterion, args):
@@ -141,6 +155,8 @@ class SingleTargetTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -6,6 +6,7 @@ import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
 from driver import TrainerBase
 
 SAMPLE_RATE_MUSDB18 = 44100
@@ -41,6 +42,8 @@ class AdhocTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -114,7 +117,9 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch_train(self, epoch):
         # Override
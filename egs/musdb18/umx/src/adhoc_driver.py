@@ -1,14 +1,15 @@
 import os
 import time
 
-import musdb
-import museval
 import torch
 import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
+from utils.utils_precision import MixedPrecision, to_fp32
 from driver import apply_multichannel_wiener_filter_norbert, apply_multichannel_wiener_filter_torch
+from driver import evaluate_tracks
 from driver import TrainerBase, TesterBase
 
 BITS_PER_SAMPLE_MUSDB18 = 16
@@ -43,6 +44,8 @@ class AdhocTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -114,7 +117,9 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -241,7 +246,7 @@ class AdhocTrainer(TrainerBase):
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class AdhocTester(TesterBase):
     def __init__(self, model, loader, criterion, args):
@@ -273,6 +278,11 @@ class AdhocTester(TesterBase):
         
         self.use_cuda = args.use_cuda
         self.use_norbert = args.use_norbert
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
+
+        self.patch_batch_size = args.patch_batch_size if args.patch_batch_size > 0 else None
+        self.n_workers = args.n_workers
+        self.n_threads = args.n_threads
 
         is_data_parallel = isinstance(self.model, nn.DataParallel)
         
@@ -320,22 +330,12 @@ class AdhocTester(TesterBase):
                 mixture_amplitude = torch.abs(mixture)
                 sources_amplitude = torch.abs(sources)
                 
-                estimated_sources_amplitude = {
-                    target: [] for target in self.sources
-                }
-
-                # Serial operation
-                for _mixture_amplitude in mixture_amplitude:
-                    # _mixture_amplitude: (1, n_mics, n_bins, n_frames)
-                    for target in self.sources:
-                        _estimated_sources_amplitude = self.model(_mixture_amplitude, target=target)
-                        estimated_sources_amplitude[target].append(_estimated_sources_amplitude)
+                # Batched operation over patches and targets
+                with self.mixed_precision.autocast():
+                    estimated_sources_amplitude = self.model(mixture_amplitude.squeeze(dim=1), target=self.sources, batch_size=self.patch_batch_size, n_threads=self.n_threads) # (batch_size, n_sources, n_mics, n_bins, n_frames)
                 
-                estimated_sources_amplitude = [
-                    torch.cat(estimated_sources_amplitude[target], dim=0).unsqueeze(dim=0) for target in self.sources
-                ]
-                estimated_sources_amplitude = torch.cat(estimated_sources_amplitude, dim=0) # (n_sources, batch_size, n_mics, n_bins, n_frames)
-                estimated_sources_amplitude = estimated_sources_amplitude.permute(0, 2, 3, 1, 4)
+                estimated_sources_amplitude = to_fp32(estimated_sources_amplitude)
+                estimated_sources_amplitude = estimated_sources_amplitude.permute(1, 2, 3, 0, 4)
                 estimated_sources_amplitude = estimated_sources_amplitude.reshape(n_sources, n_mics, n_bins, batch_size * n_frames) # (n_sources, n_mics, n_bins, T_pad)
 
                 mixture = mixture.permute(1, 2, 3, 0, 4).reshape(1, n_mics, n_bins, batch_size * n_frames) # (1, n_mics, n_bins, T_pad)
@@ -382,32 +382,7 @@ class AdhocTester(TesterBase):
         print(s, flush=True)
     
     def evaluate_all(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test')
-        
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
-
-        for track in mus.tracks:
-            name = track.name
-            
-            estimates = {}
-            estimated_accompaniment = 0
-
-            for target in self.sources:
-                estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-                estimated, _ = torchaudio.load(estimated_path)
-                estimated = estimated.numpy().transpose(1, 0)
-                estimates[target] = estimated
-                if target != 'vocals':
-                    estimated_accompaniment += estimated
-
-            estimates['accompaniment'] = estimated_accompaniment
-
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
-            results.add_track(scores)
-
-            print(name)
-            print(scores, flush=True)
+        results = evaluate_tracks(self.musdb18_root, self.estimates_dir, sources=self.sources, json_dir=self.json_dir, n_workers=self.n_workers)
 
         print(results)
 
@@ -28,8 +28,11 @@ parser.add_argument('--estimates_dir', type=str, default=None, help='Estimated s
 parser.add_argument('--json_dir', type=str, default=None, help='Json directory')
 parser.add_argument('--estimate_all', type=int, default=1, help='Estimates all songs. GPU is required if use_cuda=1.')
 parser.add_argument('--evaluate_all', type=int, default=1, help='Evaluates all estimations. GPU is NOT required.')
+parser.add_argument('--n_workers', type=int, default=1, help='Number of processes to evaluate tracks concurrently. If 0, tracks are evaluated in the main process.')
 parser.add_argument('--use_norbert', type=int, default=0, help='Use norbert.wiener for multichannel wiener filetering. 0: Not use norbert, 1: Use norbert (you have to install norbert)')
+parser.add_argument('--patch_batch_size', type=int, default=4, help='Number of patches fed to the model at once. If 0, all patches of a song are fed at once.')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'], help='Precision of forward computation. bf16 is available on both CPU and GPU, fp16 only on GPU.')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
 def main(args):
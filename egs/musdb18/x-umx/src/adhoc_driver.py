@@ -1,14 +1,15 @@
 import os
 import time
 
-import musdb
-import museval
 import torch
 import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
+from utils.utils_precision import MixedPrecision, to_fp32
 from driver import apply_multichannel_wiener_filter_norbert, apply_multichannel_wiener_filter_torch
+from driver import evaluate_tracks
 from driver import TrainerBase, TesterBase
 
 BITS_PER_SAMPLE_MUSDB18 = 16
@@ -44,6 +45,8 @@ class AdhocTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs, len(self.sources))
@@ -126,7 +129,9 @@ class AdhocTrainer(TrainerBase):
             
             for source_idx, target in enumerate(self.sources):
                 save_path = os.path.join(self.loss_dir, "{}.png".format(target))
-                draw_loss_curve(train_loss=self.train_loss[:epoch + 1, source_idx], valid_loss=self.valid_loss[:epoch + 1, source_idx], save_path=save_path)
+                self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1, source_idx], valid_loss=self.valid_loss[:epoch + 1, source_idx], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -268,7 +273,7 @@ class AdhocTrainer(TrainerBase):
         
         package['epoch'] = epoch + 1
         
-        torch.save(package, model_path)
+        self.checkpoint_writer.save(package, model_path)
 
 class AdhocTester(TesterBase):
     def __init__(self, model, loader, criterion, args):
@@ -300,6 +305,10 @@ class AdhocTester(TesterBase):
         
         self.use_cuda = args.use_cuda
         self.use_norbert = args.use_norbert
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
+
+        self.patch_batch_size = args.patch_batch_size if args.patch_batch_size > 0 else None
+        self.n_workers = args.n_workers
 
         package = torch.load(self.model_path, map_location=lambda storage, loc: storage)
         if isinstance(self.model, nn.DataParallel):
@@ -345,12 +354,13 @@ class AdhocTester(TesterBase):
                 
                 estimated_sources_amplitude = []
 
-                # Serial operation
-                for _mixture_amplitude in mixture_amplitude:
-                    # _mixture_amplitude: (1, n_mics, n_bins, n_frames)
-                    _mixture_amplitude = _mixture_amplitude.unsqueeze(dim=0)
-                    _estimated_sources_amplitude = self.model(_mixture_amplitude)
-                    estimated_sources_amplitude.append(_estimated_sources_amplitude)
+                # Batched operation over patches
+                for _mixture_amplitude in torch.split(mixture_amplitude, self.patch_batch_size or batch_size, dim=0):
+                    # _mixture_amplitude: (patch_batch_size, 1, n_mics, n_bins, n_frames)
+                    with self.mixed_precision.autocast():
+                        _estimated_sources_amplitude = self.model(_mixture_amplitude)
+                    
+                    estimated_sources_amplitude.append(to_fp32(_estimated_sources_amplitude))
                 
                 estimated_sources_amplitude = torch.cat(estimated_sources_amplitude, dim=0) # (batch_size, n_sources, n_mics, n_bins, n_frames)
                 estimated_sources_amplitude = estimated_sources_amplitude.permute(1, 2, 3, 0, 4)
@@ -400,32 +410,7 @@ class AdhocTester(TesterBase):
         print(s, flush=True)
     
     def evaluate_all(self):
-        mus = musdb.DB(root=self.musdb18_root, subsets='test')
-        
-        results = museval.EvalStore(frames_agg='median', tracks_agg='median')
-
-        for track in mus.tracks:
-            name = track.name
-            
-            estimates = {}
-            estimated_accompaniment = 0
-
-            for target in self.sources:
-                estimated_path = os.path.join(self.estimates_dir, name, "{}.wav".format(target))
-                estimated, _ = torchaudio.load(estimated_path)
-                estimated = estimated.numpy().transpose(1, 0)
-                estimates[target] = estimated
-                if target != 'vocals':
-                    estimated_accompaniment += estimated
-
-            estimates['accompaniment'] = estimated_accompaniment
-
-            # Evaluate using museval
-            scores = museval.eval_mus_track(track, estimates, output_dir=self.json_dir)
-            results.add_track(scores)
-
-            print(name)
-            print(scores, flush=True)
+        results = evaluate_tracks(self.musdb18_root, self.estimates_dir, sources=self.sources, json_dir=self.json_dir, n_workers=self.n_workers)
 
         print(results)
 
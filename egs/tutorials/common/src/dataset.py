@@ -3,8 +3,11 @@ import json
 
 import torch
 import torchaudio
+import torch.nn as nn
 
+from utils.utils_dataset import FeatureCache, SourcePool, DynamicMixingDataset
 from algorithm.frequency_mask import ideal_binary_mask, ideal_ratio_mask, wiener_filter_mask
+from algorithm.frequency_mask import compute_ideal_binary_mask, compute_ideal_ratio_mask, compute_wiener_filter_mask
 
 EPS=1e-12
 
@@ -87,6 +90,47 @@ class WaveTestDataset(WaveDataset):
         
         return mixture, sources, segment_IDs
 
+class DynamicMixingWaveTrainDataset(DynamicMixingDataset):
+    """
+    Same output as `WaveTrainDataset`, but new mixtures are synthesized from utterances in `json_path` every time.
+    Each LibriSpeech utterance is loaded only once into memory. Its speaker ID is the first field of utterance ID, e.g. 103 of 103-1240-0000.
+    """
+    def __init__(self, wav_root, json_path, samples=None, max_gain=2.5, n_mixtures=None):
+        """
+        Args:
+            samples <int>: Length of mixture. If None, length of the first segment in `json_path` is used.
+            n_mixtures <int>: Number of mixtures per epoch. If None, number of mixtures in `json_path` is used.
+        """
+        wav_root = os.path.abspath(wav_root)
+
+        with open(os.path.abspath(json_path)) as f:
+            json_data = json.load(f)
+
+        paths, speaker_IDs = {}, {}
+
+        for data in json_data:
+            for source_data in data['sources'].values():
+                path = source_data['path']
+
+                if path in paths:
+                    continue
+
+                paths[path] = path
+                speaker_IDs[path] = source_data['utterance-ID'].split('-')[0]
+
+        n_sources = len(json_data[0]['sources'])
+        source_data = next(iter(json_data[0]['sources'].values()))
+
+        if samples is None:
+            samples = source_data['end'] - source_data['start']
+
+        if n_mixtures is None:
+            n_mixtures = len(json_data)
+
+        source_pool = SourcePool(list(paths.values()), speaker_IDs=list(speaker_IDs.values()), root=wav_root)
+
+        super().__init__(source_pool, n_mixtures, samples=samples, n_sources=n_sources, max_gain=max_gain)
+
 class SpectrogramDataset(WaveDataset):
     def __init__(self, wav_root, json_path, fft_size, hop_size=None, window_fn='hann', normalize=False):
         super().__init__(wav_root, json_path)
@@ -107,7 +151,21 @@ class SpectrogramDataset(WaveDataset):
         else:
             self.window = None
         
+        self.window_fn = window_fn
         self.normalize = normalize
+
+        self.feature_cache = None
+    
+    def enable_feature_cache(self, cache_dir, max_bytes=None, dtype='complex64', n_shards=16):
+        """
+        Spectrograms are cached on disk, because segments are deterministic.
+        Args:
+            cache_dir <str>: Directory of cache
+            max_bytes <int>: Size cap in bytes. Least recently used spectrograms are evicted.
+            dtype <str>: 'complex64' or 'float16' (magnitude and phase)
+            n_shards <int>: Number of sub-directories
+        """
+        self.feature_cache = FeatureCache(cache_dir, max_bytes=max_bytes, dtype=dtype, n_shards=n_shards)
         
     def __getitem__(self, idx):
         """
@@ -117,6 +175,33 @@ class SpectrogramDataset(WaveDataset):
             T (), <int>: Number of samples in time-domain
             segment_IDs (n_sources,) <list<str>>
         """
+        if self.feature_cache is None:
+            return self._compute_spectrogram(idx)
+        
+        data = self.json_data[idx]['sources']
+
+        key = [self.wav_root, self.fft_size, self.hop_size, self.window_fn, self.normalize]
+        key += [(source_data['path'], source_data['start'], source_data['end']) for source_data in data.values()]
+        key = tuple(key)
+
+        feature = self.feature_cache.get(key)
+
+        if feature is None:
+            mixture, sources, T, segment_IDs = self._compute_spectrogram(idx)
+            self.feature_cache.put(key, torch.cat([mixture, sources], dim=0))
+        else:
+            mixture, sources = torch.split(feature, [1, feature.size(0) - 1], dim=0)
+            segment_IDs = []
+
+            for source_data in data.values():
+                start, end = source_data['start'], source_data['end']
+                segment_IDs.append("{}_{}-{}".format(source_data['utterance-ID'], start, end))
+            
+            T = end - start
+        
+        return mixture, sources, T, segment_IDs
+    
+    def _compute_spectrogram(self, idx):
         mixture, sources, segment_IDs = super().__getitem__(idx)
         
         T = mixture.size(-1)
@@ -270,6 +355,142 @@ class ThresholdWeightSpectrogramTrainDataset(ThresholdWeightSpectrogramDataset):
         
         return mixture, sources, threshold_weight
 
+"""
+    Feature pipeline
+    Workers of DataLoader return waveforms by `WaveTrainDataset` or `WaveEvalDataset`,
+    and following modules compute features of whole batch on the training device.
+"""
+
+class SpectrogramTransform(nn.Module):
+    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False):
+        super().__init__()
+        
+        if hop_size is None:
+            hop_size = fft_size // 2
+        
+        self.fft_size, self.hop_size = fft_size, hop_size
+        self.n_bins = fft_size // 2 + 1
+
+        if window_fn:
+            if window_fn == 'hann':
+                window = torch.hann_window(fft_size, periodic=True)
+            elif window_fn == 'hamming':
+                window = torch.hamming_window(fft_size, periodic=True)
+            else:
+                raise ValueError("Invalid argument.")
+        else:
+            window = None
+        
+        self.register_buffer('window', window)
+        self.normalize = normalize
+    
+    def forward(self, mixture, sources):
+        """
+        Args:
+            mixture (batch_size, 1, T) <torch.Tensor>
+            sources (batch_size, n_sources, T) <torch.Tensor>
+        Returns:
+            mixture (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+            sources (batch_size, n_sources, n_bins, n_frames) <torch.Tensor>
+        """
+        mixture = self.stft(mixture)
+        sources = self.stft(sources)
+
+        return mixture, sources
+    
+    def stft(self, input):
+        """
+        Args:
+            input (*, T) <torch.Tensor>
+        Returns:
+            output (*, n_bins, n_frames) <torch.Tensor>: Complex tensor
+        """
+        channels = input.size()[:-1]
+        input = input.reshape(-1, input.size(-1))
+        output = torch.stft(input, n_fft=self.fft_size, hop_length=self.hop_size, window=self.window, normalized=self.normalize, return_complex=True)
+        output = output.reshape(*channels, *output.size()[-2:])
+
+        return output
+
+class IdealMaskSpectrogramTransform(SpectrogramTransform):
+    """
+    Batched version of `IdealMaskSpectrogramDataset`.
+    """
+    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False, mask_type='ibm', threshold=40, eps=EPS):
+        super().__init__(fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize)
+
+        if mask_type == 'ibm':
+            self.generate_mask = compute_ideal_binary_mask
+        elif mask_type == 'irm':
+            self.generate_mask = compute_ideal_ratio_mask
+        elif mask_type == 'wfm':
+            self.generate_mask = compute_wiener_filter_mask
+        else:
+            raise NotImplementedError("Not support mask {}".format(mask_type))
+        
+        self.threshold = threshold
+        self.eps = eps
+    
+    def forward(self, mixture, sources):
+        """
+        Args:
+            mixture (batch_size, 1, T) <torch.Tensor>
+            sources (batch_size, n_sources, T) <torch.Tensor>
+        Returns:
+            mixture (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+            sources (batch_size, n_sources, n_bins, n_frames) <torch.Tensor>
+            ideal_mask (batch_size, n_sources, n_bins, n_frames) <torch.Tensor>
+            threshold_weight (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+        """
+        mixture, sources = super().forward(mixture, sources)
+        ideal_mask = self.generate_mask(torch.abs(sources))
+        threshold_weight = compute_threshold_weight(torch.abs(mixture), threshold=self.threshold, eps=self.eps)
+
+        return mixture, sources, ideal_mask, threshold_weight
+
+class ThresholdWeightSpectrogramTransform(SpectrogramTransform):
+    """
+    Batched version of `ThresholdWeightSpectrogramDataset`.
+    """
+    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False, threshold=40, eps=EPS):
+        super().__init__(fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize)
+        
+        self.threshold = threshold
+        self.eps = eps
+    
+    def forward(self, mixture, sources):
+        """
+        Args:
+            mixture (batch_size, 1, T) <torch.Tensor>
+            sources (batch_size, n_sources, T) <torch.Tensor>
+        Returns:
+            mixture (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+            sources (batch_size, n_sources, n_bins, n_frames) <torch.Tensor>
+            threshold_weight (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+        """
+        mixture, sources = super().forward(mixture, sources)
+        threshold_weight = compute_threshold_weight(torch.abs(mixture), threshold=self.threshold, eps=self.eps)
+
+        return mixture, sources, threshold_weight
+
+def compute_threshold_weight(mixture_amplitude, threshold=40, eps=EPS):
+    """
+    Args:
+        mixture_amplitude (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+        threshold <float>: Bins whose amplitude is less than `threshold` [dB] below the maximum of each data are weighted 0.
+    Returns:
+        threshold_weight (batch_size, 1, n_bins, n_frames) <torch.Tensor>
+    """
+    batch_size = mixture_amplitude.size(0)
+
+    log_amplitude = 20 * torch.log10(mixture_amplitude + eps)
+    max_log_amplitude, _ = torch.max(log_amplitude.reshape(batch_size, -1), dim=1)
+    max_log_amplitude = max_log_amplitude.view(batch_size, *([1] * (mixture_amplitude.dim() - 1)))
+    threshold = 10**((max_log_amplitude - threshold) / 20)
+    threshold_weight = (mixture_amplitude > threshold).to(mixture_amplitude.dtype)
+
+    return threshold_weight
+
 class TrainDataLoader(torch.utils.data.DataLoader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
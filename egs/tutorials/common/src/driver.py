@@ -11,6 +11,8 @@ import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
+from utils.utils_precision import MixedPrecision, to_fp32
 from criterion.pit import pit
 
 BITS_PER_SAMPLE_LIBRISPEECH = 16
@@ -40,12 +42,16 @@ class Trainer:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
         self.valid_loss = torch.empty(self.epochs)
         
         self.use_cuda = args.use_cuda
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
+        self.speedup = None
         
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
@@ -64,6 +70,9 @@ class Trainer:
                 self.model.load_state_dict(config['state_dict'])
             
             self.optimizer.load_state_dict(config['optim_dict'])
+            
+            if 'scaler_dict' in config:
+                self.mixed_precision.load_state_dict(config['scaler_dict'])
         else:
             model_path = os.path.join(self.model_dir, "best.pth")
             
@@ -84,7 +93,12 @@ class Trainer:
             train_loss, valid_loss = self.run_one_epoch(epoch)
             end = time.time()
             
-            print("[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch + 1, self.epochs, train_loss, valid_loss, end - start), flush=True)
+            s = "[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch + 1, self.epochs, train_loss, valid_loss, end - start)
+            
+            if self.speedup is not None:
+                s += ", {}: x{:.2f} faster than fp32".format(self.mixed_precision.precision, self.speedup)
+            
+            print(s, flush=True)
             
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
@@ -110,7 +124,9 @@ class Trainer:
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -135,16 +151,22 @@ class Trainer:
                 mixture = mixture.cuda()
                 sources = sources.cuda()
             
-            estimated_sources = self.model(mixture)
-            loss, _ = self.pit_criterion(estimated_sources, sources)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.pit_criterion(to_fp32(self.model(mixture)), sources)[0])
+            
+            with self.mixed_precision.autocast():
+                estimated_sources = self.model(mixture)
+            
+            loss, _ = self.pit_criterion(to_fp32(estimated_sources), sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -169,7 +191,11 @@ class Trainer:
                 if self.use_cuda:
                     mixture = mixture.cuda()
                     sources = sources.cuda()
-                output = self.model(mixture)
+                
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture)
+                
+                output = to_fp32(output)
                 loss, _ = self.pit_criterion(output, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
@@ -206,6 +232,7 @@ class Trainer:
             config['state_dict'] = self.model.state_dict()
             
         config['optim_dict'] = self.optimizer.state_dict()
+        config['scaler_dict'] = self.mixed_precision.state_dict()
         
         config['best_loss'] = self.best_loss
         config['no_improvement'] = self.no_improvement
@@ -215,7 +242,7 @@ class Trainer:
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class Tester:
     def __init__(self, model, loader, pit_criterion, args):
@@ -238,6 +265,7 @@ class Tester:
             os.makedirs(self.out_dir, exist_ok=True)
         
         self.use_cuda = args.use_cuda
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
         
         config = torch.load(args.model_path, map_location=lambda storage, loc: storage)
         
@@ -274,7 +302,10 @@ class Tester:
                 loss_mixture, _ = self.pit_criterion(mixture, sources, batch_mean=False)
                 loss_mixture = loss_mixture.sum(dim=0)
                 
-                output = self.model(mixture)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture)
+                
+                output = to_fp32(output)
                 loss, perm_idx = self.pit_criterion(output, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 loss_improvement = loss_mixture.item() - loss.item()
@@ -381,13 +412,18 @@ class Tester:
         print("Evaluation of PESQ returns error {} times".format(n_pesq_error))
 
 class AttractorTrainer(Trainer):
-    def __init__(self, model, loader, criterion, optimizer, args):
+    def __init__(self, model, loader, criterion, optimizer, args, transform=None):
+        """
+        Args:
+            transform <nn.Module>: If given, loaders yield (mixture, sources) in time domain and `transform` computes features of each batch on the training device.
+        """
         self.train_loader, self.valid_loader = loader['train'], loader['valid']
         
         self.model = model
         
         self.criterion = criterion
         self.optimizer = optimizer
+        self.transform = transform
         
         self._reset(args)
     
@@ -408,9 +444,31 @@ class AttractorTrainer(Trainer):
         else:
             self.window = None
         
-        self.normalize = self.train_loader.dataset.normalize
+        if self.transform is None:
+            self.normalize = self.train_loader.dataset.normalize
+
+            assert self.normalize == self.valid_loader.dataset.normalize, "Nomalization of STFT is different between `train_loader.dataset` and `valid_loader.dataset`."
+        else:
+            self.normalize = self.transform.normalize
 
-        assert self.normalize == self.valid_loader.dataset.normalize, "Nomalization of STFT is different between `train_loader.dataset` and `valid_loader.dataset`."
+            if self.use_cuda:
+                self.transform.cuda()
+    
+    def prepare_batch(self, batch):
+        """
+        Args:
+            batch <list<torch.Tensor>>: Features, or (mixture, sources) in time domain if `self.transform` is given.
+        Returns:
+            batch <tuple<torch.Tensor>>: Features on the training device
+        """
+        if self.use_cuda:
+            batch = [data.cuda() for data in batch]
+        
+        if self.transform is not None:
+            with torch.no_grad():
+                batch = self.transform(*batch)
+        
+        return tuple(batch)
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -422,26 +480,28 @@ class AttractorTrainer(Trainer):
         train_loss = 0
         n_train_batch = len(self.train_loader)
         
-        for idx, (mixture, sources, assignment, threshold_weight) in enumerate(self.train_loader):
-            if self.use_cuda:
-                mixture = mixture.cuda()
-                sources = sources.cuda()
-                assignment = assignment.cuda()
-                threshold_weight = threshold_weight.cuda()
+        for idx, batch in enumerate(self.train_loader):
+            mixture, sources, assignment, threshold_weight = self.prepare_batch(batch)
             
             mixture_amplitude = torch.abs(mixture)
             sources_amplitude = torch.abs(sources)
             
-            estimated_sources_amplitude = self.model(mixture_amplitude, assignment=assignment, threshold_weight=threshold_weight, n_sources=sources.size(1))
-            loss = self.criterion(estimated_sources_amplitude, sources_amplitude)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.criterion(to_fp32(self.model(mixture_amplitude, assignment=assignment, threshold_weight=threshold_weight, n_sources=sources.size(1))), sources_amplitude))
+            
+            with self.mixed_precision.autocast():
+                estimated_sources_amplitude = self.model(mixture_amplitude, assignment=assignment, threshold_weight=threshold_weight, n_sources=sources.size(1))
+            
+            loss = self.criterion(to_fp32(estimated_sources_amplitude), sources_amplitude)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -465,23 +525,22 @@ class AttractorTrainer(Trainer):
         n_valid = len(self.valid_loader.dataset)
         
         with torch.no_grad():
-            for idx, (mixture, sources, assignment, threshold_weight) in enumerate(self.valid_loader):
+            for idx, batch in enumerate(self.valid_loader):
                 """
                 mixture (batch_size, 1, 2*n_bins, n_frames)
                 sources (batch_size, n_sources, 2*n_bins, n_frames)
                 assignment (batch_size, n_sources, n_bins, n_frames)
                 threshold_weight (batch_size, n_bins, n_bins)
                 """
-                if self.use_cuda:
-                    mixture = mixture.cuda()
-                    sources = sources.cuda()
-                    threshold_weight = threshold_weight.cuda()
-                    assignment = assignment.cuda()
+                mixture, sources, assignment, threshold_weight = self.prepare_batch(batch)
                 
                 mixture_amplitude = torch.abs(mixture)
                 sources_amplitude = torch.abs(sources)
                 
-                output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                
+                output = to_fp32(output)
                 # At the test phase, assignment may be unknown.
                 loss, _ = pit(self.criterion, output, sources_amplitude, batch_mean=False)
                 loss = loss.sum(dim=0)
@@ -583,7 +642,10 @@ class AttractorTester(Tester):
                 mixture_amplitude = torch.abs(mixture) # -> (1, 1, n_bins, n_frames)
                 sources_amplitude = torch.abs(sources)
                 
-                output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                
+                output = to_fp32(output)
                 loss, perm_idx = self.pit_criterion(output, sources_amplitude, batch_mean=False)
                 loss = loss.sum(dim=0)
                 
@@ -696,8 +758,8 @@ class AttractorTester(Tester):
         print("Evaluation of PESQ returns error {} times".format(n_pesq_error))
 
 class AnchoredAttractorTrainer(AttractorTrainer):
-    def __init__(self, model, loader, criterion, optimizer, args):
-        super().__init__(model, loader, criterion, optimizer, args)
+    def __init__(self, model, loader, criterion, optimizer, args, transform=None):
+        super().__init__(model, loader, criterion, optimizer, args, transform=transform)
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -709,25 +771,28 @@ class AnchoredAttractorTrainer(AttractorTrainer):
         train_loss = 0
         n_train_batch = len(self.train_loader)
         
-        for idx, (mixture, sources, threshold_weight) in enumerate(self.train_loader):
-            if self.use_cuda:
-                mixture = mixture.cuda()
-                sources = sources.cuda()
-                threshold_weight = threshold_weight.cuda()
+        for idx, batch in enumerate(self.train_loader):
+            mixture, sources, threshold_weight = self.prepare_batch(batch)
             
             mixture_amplitude = torch.abs(mixture)
             sources_amplitude = torch.abs(sources)
             
-            estimated_sources_amplitude = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=sources.size(1))
-            loss = self.criterion(estimated_sources_amplitude, sources_amplitude)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.criterion(to_fp32(self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=sources.size(1))), sources_amplitude))
+            
+            with self.mixed_precision.autocast():
+                estimated_sources_amplitude = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=sources.size(1))
+            
+            loss = self.criterion(to_fp32(estimated_sources_amplitude), sources_amplitude)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
         
             train_loss += loss.item()
             
@@ -751,21 +816,21 @@ class AnchoredAttractorTrainer(AttractorTrainer):
         n_valid = len(self.valid_loader.dataset)
         
         with torch.no_grad():
-            for idx, (mixture, sources, threshold_weight) in enumerate(self.valid_loader):
+            for idx, batch in enumerate(self.valid_loader):
                 """
                     mixture (batch_size, 1, n_bins, n_frames)
                     sources (batch_size, n_sources, n_bins, n_frames)
                     threshold_weight (batch_size, n_bins, n_frames)
                 """
-                if self.use_cuda:
-                    mixture = mixture.cuda()
-                    sources = sources.cuda()
-                    threshold_weight = threshold_weight.cuda()
+                mixture, sources, threshold_weight = self.prepare_batch(batch)
                 
                 mixture_amplitude = torch.abs(mixture)
                 sources_amplitude = torch.abs(sources)
                 
-                output = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=n_sources)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=n_sources)
+                
+                output = to_fp32(output)
                 # At the test phase, assignment may be unknown.
                 loss, _ = pit(self.criterion, output, sources_amplitude, batch_mean=False)
                 loss = loss.sum(dim=0)
@@ -825,10 +890,14 @@ class ORPITTrainer(Trainer):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         self.train_loss = torch.empty(self.epochs)
         
         self.use_cuda = args.use_cuda
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
+        self.speedup = None
         
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
@@ -842,6 +911,9 @@ class ORPITTrainer(Trainer):
                 self.model.load_state_dict(config['state_dict'])
             
             self.optimizer.load_state_dict(config['optim_dict'])
+            
+            if 'scaler_dict' in config:
+                self.mixed_precision.load_state_dict(config['scaler_dict'])
         else:
             # TODO: redundant? last.pth never exists
             model_path = os.path.join(self.model_dir, "last.pth")
@@ -868,7 +940,9 @@ class ORPITTrainer(Trainer):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -934,8 +1008,9 @@ class ORPITTrainer(Trainer):
             config['state_dict'] = self.model.state_dict()
             
         config['optim_dict'] = self.optimizer.state_dict()
+        config['scaler_dict'] = self.mixed_precision.state_dict()
         
         config['epoch'] = epoch + 1
         config['train_loss'] = self.train_loss
         
-        torch.save(config, model_path)
\ No newline at end of file
+        self.checkpoint_writer.save(config, model_path)
\ No newline at end of file
@@ -72,10 +72,12 @@ model_path="${save_dir}/model/${model_choice}.pth"
 
 num_chunk=256
 duration=5
+streaming=0 # streaming=1 is available if causal=1
 
 demo.py \
 --sr ${sr} \
 --num_chunk ${num_chunk} \
 --duration ${duration} \
+--streaming ${streaming} \
 --model_path "${model_path}" \
 --save_dir "./results"
@@ -17,6 +17,7 @@ parser.add_argument('--sr', type=int, default=16000, help='Sampling rate')
 parser.add_argument('--num_chunk', type=int, default=256, help='Number of chunks')
 parser.add_argument('--duration', type=int, default=10, help='Duration [sec]')
 parser.add_argument('--model_path', type=str, default='./best.pth', help='Path for model')
+parser.add_argument('--streaming', type=int, default=0, help='Separate each chunk while recording. Only causal model is supported.')
 parser.add_argument('--save_dir', type=str, default='./results', help='Directory to save estimation.')
 
 FORMAT = pyaudio.paInt16
@@ -24,7 +25,10 @@ NUM_CHANNEL = 1
 DEVICE_INDEX = 0
 
 def main(args):
-    process_offline(args.sr, args.num_chunk, duration=args.duration, model_path=args.model_path, save_dir=args.save_dir)
+    if args.streaming:
+        process_online(args.sr, args.num_chunk, duration=args.duration, model_path=args.model_path, save_dir=args.save_dir)
+    else:
+        process_offline(args.sr, args.num_chunk, duration=args.duration, model_path=args.model_path, save_dir=args.save_dir)
 
 def process_offline(sr, num_chunk, duration=5, model_path=None, save_dir="results"):
     num_loop = int(duration * sr / num_chunk)
@@ -78,6 +82,64 @@ def process_offline(sr, num_chunk, duration=5, model_path=None, save_dir="result
         save_path = os.path.join(save_dir, "estimated-{}.wav".format(idx))
         torchaudio.save(save_path, estimated_source.unsqueeze(dim=0), sample_rate=sr)
     
+def process_online(sr, num_chunk, duration=5, model_path=None, save_dir="results"):
+    num_loop = int(duration * sr / num_chunk)
+    sequence, estimated_sequence = [], []
+
+    # Separate by DNN
+    model = load_model(model_path)
+    model.eval()
+
+    assert model.causal, "Only causal model supports streaming."
+    assert num_chunk % model.stride == 0, "num_chunk is expected divisible by stride {}.".format(model.stride)
+
+    state = model.init_state(batch_size=1)
+    
+    P = pyaudio.PyAudio()
+    
+    # Record and separate
+    stream = P.open(format=FORMAT, channels=NUM_CHANNEL, rate=sr, input_device_index=DEVICE_INDEX, frames_per_buffer=num_chunk, input=True, output=False)
+    
+    with torch.no_grad():
+        for i in range(num_loop):
+            input = stream.read(num_chunk)
+            sequence.append(input)
+
+            mixture = np.frombuffer(input, dtype=np.int16) / 32768
+            mixture = torch.Tensor(mixture).float()
+            estimated_sources, state = model.forward_chunk(mixture.unsqueeze(dim=0).unsqueeze(dim=0), state)
+            estimated_sequence.append(estimated_sources.squeeze(dim=0).detach().cpu())
+
+            time = int(i * num_chunk / sr)
+            show_progress_bar(time, duration)
+    
+    show_progress_bar(duration, duration)
+    print()
+    
+    stream.stop_stream()
+    stream.close()
+    P.terminate()
+    
+    print("Stop recording")
+    
+    os.makedirs(save_dir, exist_ok=True)
+    
+    # Save
+    signal = b"".join(sequence)
+    signal = np.frombuffer(signal, dtype=np.int16)
+    signal = signal / 32768
+    
+    save_path = os.path.join(save_dir, "mixture.wav")
+    mixture = torch.Tensor(signal).float()
+    torchaudio.save(save_path, mixture.unsqueeze(dim=0), sample_rate=sr)
+
+    # Estimated sources are delayed by kernel_size - stride samples.
+    estimated_sources = torch.cat(estimated_sequence, dim=1)
+    
+    for idx, estimated_source in enumerate(estimated_sources):
+        save_path = os.path.join(save_dir, "estimated-{}.wav".format(idx))
+        torchaudio.save(save_path, estimated_source.unsqueeze(dim=0), sample_rate=sr)
+
 def show_progress_bar(time, duration):
     rest = duration-time
     progress_bar = ">"*time + "-"*rest
@@ -14,7 +14,7 @@ NUM_CHANNELS_MUSDB18 = 2
 BITS_PER_SAMPLE_MUSDB18 = 16
 EPS = 1e-12
 
-def separate_by_d3net(model_paths, file_paths, out_dirs):
+def separate_by_d3net(model_paths, file_paths, out_dirs, patch_batch_size=4, n_threads=1):
     patch_size = 256
     fft_size, hop_size = 4096, 1024
     window = torch.hann_window(fft_size)
@@ -63,29 +63,18 @@ def separate_by_d3net(model_paths, file_paths, out_dirs):
             
             mixture_amplitude = torch.abs(mixture)
             
-            estimated_sources_amplitude = {
-                target: [] for target in __sources__
-            }
-
-            # Serial operation
-            for _mixture_amplitude in mixture_amplitude:
-                # _mixture_amplitude: (1, n_mics, n_bins, n_frames)
-                if n_mics == 1:
-                    _mixture_amplitude = torch.tile(_mixture_amplitude, (1, NUM_CHANNELS_MUSDB18, 1, 1))
-                
-                for target in __sources__:
-                    _estimated_sources_amplitude = model(_mixture_amplitude, target=target)
-
-                    if n_mics == 1:
-                        _estimated_sources_amplitude = _estimated_sources_amplitude.mean(dim=1, keepdim=True)
-                    
-                    estimated_sources_amplitude[target].append(_estimated_sources_amplitude)
-        
-            estimated_sources_amplitude = [
-                torch.cat(estimated_sources_amplitude[target], dim=0).unsqueeze(dim=0) for target in __sources__
-            ]
-            estimated_sources_amplitude = torch.cat(estimated_sources_amplitude, dim=0) # (n_sources, batch_size, n_mics, n_bins, n_frames)
-            estimated_sources_amplitude = estimated_sources_amplitude.permute(0, 2, 3, 1, 4)
+            # Batched operation over patches and targets
+            mixture_amplitude = mixture_amplitude.squeeze(dim=1) # (batch_size, n_mics, n_bins, n_frames)
+
+            if n_mics == 1:
+                mixture_amplitude = torch.tile(mixture_amplitude, (1, NUM_CHANNELS_MUSDB18, 1, 1))
+            
+            estimated_sources_amplitude = model(mixture_amplitude, target=__sources__, batch_size=patch_batch_size, n_threads=n_threads) # (batch_size, n_sources, NUM_CHANNELS_MUSDB18, n_bins, n_frames)
+
+            if n_mics == 1:
+                estimated_sources_amplitude = estimated_sources_amplitude.mean(dim=2, keepdim=True)
+            
+            estimated_sources_amplitude = estimated_sources_amplitude.permute(1, 2, 3, 0, 4)
             estimated_sources_amplitude = estimated_sources_amplitude.reshape(n_sources, n_mics, n_bins, batch_size * n_frames) # (n_sources, n_mics, n_bins, batch_size * n_frames)
 
             mixture = mixture.permute(1, 2, 3, 0, 4).reshape(1, n_mics, n_bins, batch_size * n_frames) # (1, n_mics, n_bins, batch_size * n_frames)
@@ -155,7 +144,7 @@ def load_experiment_config(config_paths):
 
     return config
 
-def apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, eps=EPS):
+def apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, chunk_size=None, n_threads=1, eps=EPS):
     """
     Multichannel Wiener filter.
     Implementation is based on norbert package.
@@ -164,6 +153,8 @@ def apply_multichannel_wiener_filter_torch(mixture, estimated_sources_amplitude,
         estimated_sources_amplitude <torch.Tensor>: (n_sources, n_channels, n_bins, n_frames) or (batch_size, n_sources, n_channels, n_bins, n_frames)
         iteration <int>: Iteration of EM algorithm updates
         channels_first <bool>: Only supports True
+        chunk_size <int>: Number of frames processed at once. If None, all frames are processed at once.
+        n_threads <int>: Number of threads, each of which processes a band of frequency bins.
         eps <float>: small value for numerical stability
     """
-    return multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=iteration, channels_first=channels_first, eps=eps)
\ No newline at end of file
+    return multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=iteration, channels_first=channels_first, chunk_size=chunk_size, n_threads=n_threads, eps=eps)
\ No newline at end of file
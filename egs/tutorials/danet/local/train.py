@@ -6,7 +6,8 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
-from dataset import IdealMaskSpectrogramTrainDataset, IdealMaskSpectrogramEvalDataset, TrainDataLoader, EvalDataLoader
+from dataset import WaveTrainDataset, WaveEvalDataset, IdealMaskSpectrogramTrainDataset, IdealMaskSpectrogramEvalDataset, TrainDataLoader, EvalDataLoader
+from dataset import IdealMaskSpectrogramTransform
 from driver import AttractorTrainer
 from models.danet import DANet
 from criterion.distance import L2Loss
@@ -20,6 +21,7 @@ parser.add_argument('--sr', type=int, default=10, help='Sampling rate')
 parser.add_argument('--window_fn', type=str, default='hamming', help='Window function')
 parser.add_argument('--ideal_mask', type=str, default='ibm', choices=['ibm', 'irm', 'wfm'], help='Ideal mask for assignment')
 parser.add_argument('--threshold', type=float, default=40, help='Wight threshold. Default: 40 ')
+parser.add_argument('--feature_pipeline', type=int, default=0, help='0: Compute features in DataLoader workers, 1: Compute features of each batch on the training device')
 
 # Model configuration
 parser.add_argument('--fft_size', type=int, default=256, help='Window length')
@@ -49,8 +51,15 @@ parser.add_argument('--seed', type=int, default=42, help='Random seed')
 def main(args):
     set_seed(args.seed)
     
-    train_dataset = IdealMaskSpectrogramTrainDataset(args.wav_root, args.train_json_path, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, mask_type=args.ideal_mask, threshold=args.threshold)
-    valid_dataset = IdealMaskSpectrogramEvalDataset(args.wav_root, args.valid_json_path, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, mask_type=args.ideal_mask, threshold=args.threshold)
+    if args.feature_pipeline:
+        train_dataset = WaveTrainDataset(args.wav_root, args.train_json_path)
+        valid_dataset = WaveEvalDataset(args.wav_root, args.valid_json_path)
+        transform = IdealMaskSpectrogramTransform(args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, mask_type=args.ideal_mask, threshold=args.threshold)
+    else:
+        train_dataset = IdealMaskSpectrogramTrainDataset(args.wav_root, args.train_json_path, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, mask_type=args.ideal_mask, threshold=args.threshold)
+        valid_dataset = IdealMaskSpectrogramEvalDataset(args.wav_root, args.valid_json_path, fft_size=args.fft_size, hop_size=args.hop_size, window_fn=args.window_fn, mask_type=args.ideal_mask, threshold=args.threshold)
+        transform = None
+    
     print("Training dataset includes {} samples.".format(len(train_dataset)))
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
@@ -91,7 +100,7 @@ def main(args):
     else:
         raise ValueError("Not support criterion {}".format(args.criterion))
     
-    trainer = AttractorTrainer(model, loader, criterion, optimizer, args)
+    trainer = AttractorTrainer(model, loader, criterion, optimizer, args, transform=transform)
     trainer.run()
 
 if __name__ == '__main__':
@@ -3,6 +3,8 @@ import os
 import torch
 import torchaudio
 
+from utils.utils_dataset import build_n_frames_index, build_packed_audio, LengthBucketBatchSampler, padded_collate_fn
+
 EPS = 1e-12
 
 class WSJ0Dataset(torch.utils.data.Dataset):
@@ -46,49 +48,42 @@ class WaveDataset(WSJ0Dataset):
         
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix_{}'.format(mix_type), '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix_{}'.format(mix_type)):
+            for start_idx in range(0, T_total, samples - overlap):
+                end_idx = start_idx + samples
+                if end_idx > T_total:
+                    break
+                data = {
+                    'sources': {},
+                    'mixture': {}
+                }
                 
-                for start_idx in range(0, T_total, samples - overlap):
-                    end_idx = start_idx + samples
-                    if end_idx > T_total:
-                        break
-                    data = {
-                        'sources': {},
-                        'mixture': {}
-                    }
-                    
-                    for source_idx in range(n_sources):
-                        source_data = {
-                            'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                            'start': start_idx,
-                            'end': end_idx
-                        }
-                        data['sources']['s{}'.format(source_idx + 1)] = source_data
-                    
-                    noise_data = {
-                        'path': os.path.join('noise', '{}.wav'.format(ID)),
+                for source_idx in range(n_sources):
+                    source_data = {
+                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
                         'start': start_idx,
                         'end': end_idx
                     }
+                    data['sources']['s{}'.format(source_idx + 1)] = source_data
+                
+                noise_data = {
+                    'path': os.path.join('noise', '{}.wav'.format(ID)),
+                    'start': start_idx,
+                    'end': end_idx
+                }
 
-                    data['noise'] = noise_data
+                data['noise'] = noise_data
 
-                    mixture_data = {
-                        'path': os.path.join('mix_{}'.format(mix_type), '{}.wav'.format(ID)),
-                        'start': start_idx,
-                        'end': end_idx
-                    }
-                    
-                    data['mixture'] = mixture_data
-                    data['ID'] = ID
+                mixture_data = {
+                    'path': os.path.join('mix_{}'.format(mix_type), '{}.wav'.format(ID)),
+                    'start': start_idx,
+                    'end': end_idx
+                }
                 
-                    self.json_data.append(data)
+                data['mixture'] = mixture_data
+                data['ID'] = ID
+            
+                self.json_data.append(data)
         
     def __getitem__(self, idx):
         """
@@ -103,21 +98,18 @@ class WaveDataset(WSJ0Dataset):
         for key in data['sources'].keys():
             source_data = data['sources'][key]
             start, end = source_data['start'], source_data['end']
-            wav_path = os.path.join(self.wav_root, source_data['path'])
-            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+            wave = self._load_audio(source_data['path'], start, end)
             sources.append(wave)
         
         sources = torch.cat(sources, dim=0)
 
         noise_data = data['mixture']
         start, end = noise_data['start'], noise_data['end']
-        wav_path = os.path.join(self.wav_root, noise_data['path'])
-        noise, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        noise = self._load_audio(noise_data['path'], start, end)
 
         mixture_data = data['mixture']
         start, end = mixture_data['start'], mixture_data['end']
-        wav_path = os.path.join(self.wav_root, mixture_data['path'])
-        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        mixture = self._load_audio(mixture_data['path'], start, end)
             
         segment_ID = self.json_data[idx]['ID'] + '_{}-{}'.format(start, end)
         
@@ -125,6 +117,20 @@ class WaveDataset(WSJ0Dataset):
         
     def __len__(self):
         return len(self.json_data)
+    
+    def _load_audio(self, path, start, end):
+        """
+        Args:
+            path <str>: Path relative to `wav_root`
+            start <int>: Start sample
+            end <int>: End sample
+        Returns:
+            wave (n_channels, end - start) <torch.Tensor>
+        """
+        wav_path = os.path.join(self.wav_root, path)
+        wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+
+        return wave
 
 class WaveTrainDataset(WaveDataset):
     def __init__(self, wav_root, list_path, task='separate-noisy', samples=32000, overlap=None, n_sources=2):
@@ -146,53 +152,45 @@ class WaveEvalDataset(WaveDataset):
 
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix_{}'.format(mix_type), '{}.wav'.format(ID))
-
-                wave, _ = torchaudio.load(wav_path)
-                
-                _, T_total = wave.size()
-                
-                if max_samples is None:
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix_{}'.format(mix_type)):
+            if max_samples is None:
+                samples = T_total
+            else:
+                if T_total < max_samples:
                     samples = T_total
                 else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx + 1)] = source_data
-                
-                noise_data = {
-                    'path': os.path.join('noise', '{}.wav'.format(ID)),
+                    samples = max_samples
+            
+            data = {
+                'sources': {},
+                'mixture': {}
+            }
+            
+            for source_idx in range(n_sources):
+                source_data = {
+                    'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
                     'start': 0,
                     'end': samples
                 }
+                data['sources']['s{}'.format(source_idx + 1)] = source_data
+            
+            noise_data = {
+                'path': os.path.join('noise', '{}.wav'.format(ID)),
+                'start': 0,
+                'end': samples
+            }
 
-                data['noise'] = noise_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix_{}'.format(mix_type), '{}.wav'.format(ID)),
-                    'start': 0,
-                    'end': samples
-                }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
+            data['noise'] = noise_data
             
-                self.json_data.append(data)
+            mixture_data = {
+                'path': os.path.join('mix_{}'.format(mix_type), '{}.wav'.format(ID)),
+                'start': 0,
+                'end': samples
+            }
+            data['mixture'] = mixture_data
+            data['ID'] = ID
+            
+            self.json_data.append(data)
     
     def __getitem__(self, idx):
         mixture, sources, _, _ = super().__getitem__(idx)
@@ -215,6 +213,54 @@ class WaveTestDataset(WaveEvalDataset):
         
         return mixture, sources, segment_ID
 
+class PackedWaveTrainDataset(WaveTrainDataset):
+    """
+    Same as `WaveTrainDataset`, but audio is loaded from memory-mapped array packed in `pack_dir`.
+    The array is packed at the first time.
+    """
+    def __init__(self, wav_root, list_path, pack_dir, task='separate-noisy', samples=32000, overlap=None, n_sources=2, dtype='float32'):
+        super().__init__(wav_root, list_path, task=task, samples=samples, overlap=overlap, n_sources=n_sources)
+
+        self.packed_audio = build_packed_audio(search_paths(self.json_data), pack_dir, root=self.wav_root, dtype=dtype)
+    
+    def _load_audio(self, path, start, end):
+        wave, _ = self.packed_audio.load(path, frame_offset=start, num_frames=end-start)
+
+        return wave
+
+class PackedWaveEvalDataset(WaveEvalDataset):
+    """
+    Same as `WaveEvalDataset`, but audio is loaded from memory-mapped array packed in `pack_dir`.
+    The array is packed at the first time.
+    """
+    def __init__(self, wav_root, list_path, pack_dir, task='separate-noisy', max_samples=None, n_sources=2, dtype='float32'):
+        super().__init__(wav_root, list_path, task=task, max_samples=max_samples, n_sources=n_sources)
+
+        self.packed_audio = build_packed_audio(search_paths(self.json_data), pack_dir, root=self.wav_root, dtype=dtype)
+    
+    def _load_audio(self, path, start, end):
+        wave, _ = self.packed_audio.load(path, frame_offset=start, num_frames=end-start)
+
+        return wave
+
+def search_paths(json_data):
+    """
+    Returns:
+        paths <list<str>>: Paths of mixtures, sources and noise included in `json_data` without duplication.
+    """
+    paths = []
+
+    for data in json_data:
+        for key in data['sources'].keys():
+            paths.append(data['sources'][key]['path'])
+        
+        paths.append(data['noise']['path'])
+        paths.append(data['mixture']['path'])
+    
+    paths = list(dict.fromkeys(paths))
+
+    return paths
+
 """
     Data loader
 """
@@ -237,6 +283,19 @@ class TestDataLoader(torch.utils.data.DataLoader):
         
         self.collate_fn = test_collate_fn
 
+class BucketEvalDataLoader(torch.utils.data.DataLoader):
+    """
+    Utterances of similar length are batched up to `max_samples` in total (including padding), instead of batch_size=1.
+    In addition to items of `EvalDataLoader`, mask (batch_size, T) of valid samples is returned as the last item.
+    The mask excludes padding from loss, but not from the model: e.g. gLN statistics include padded zeros, so outputs differ from batch_size=1 over the whole utterance.
+    Use it only for validation during training, where approximate loss is enough to monitor training and select the model.
+    """
+    def __init__(self, dataset, max_samples, max_batch_size=None, shuffle=False, **kwargs):
+        lengths = [data['mixture']['end'] - data['mixture']['start'] for data in dataset.json_data]
+        batch_sampler = LengthBucketBatchSampler(lengths, max_samples, max_batch_size=max_batch_size, shuffle=shuffle)
+
+        super().__init__(dataset, batch_sampler=batch_sampler, collate_fn=padded_collate_fn, **kwargs)
+
 def test_collate_fn(batch):
     batched_mixture, batched_sources = None, None
     batched_segment_ID = []
@@ -11,6 +11,7 @@ import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
 
 BITS_PER_SAMPLE_WSJ0 = 16
 MIN_PESQ = -0.5
@@ -41,6 +42,8 @@ class TrainerBase:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
@@ -118,7 +121,9 @@ class TrainerBase:
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -173,18 +178,23 @@ class TrainerBase:
         n_valid = len(self.valid_loader.dataset)
         
         with torch.no_grad():
-            for idx, (mixture, sources, segment_IDs) in enumerate(self.valid_loader):
+            for idx, (mixture, sources, segment_IDs, *mask) in enumerate(self.valid_loader):
+                # Mask of valid samples is given by `BucketEvalDataLoader`.
+                mask = mask[0] if len(mask) > 0 else None
+                
                 if self.use_cuda:
                     mixture = mixture.cuda()
                     sources = sources.cuda()
+                    mask = mask.cuda() if mask is not None else None
                 output = self.model(mixture)
-                loss, _ = self.pit_criterion(output, sources, batch_mean=False)
+                loss, _ = self.pit_criterion(output, sources, batch_mean=False, mask=mask)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
                 
                 if idx < 5:
-                    mixture = mixture[0].squeeze(dim=0).cpu()
-                    estimated_sources = output[0].cpu()
+                    T = mask[0].sum().item() if mask is not None else mixture.size(-1)
+                    mixture = mixture[0, ..., :T].squeeze(dim=0).cpu()
+                    estimated_sources = output[0, ..., :T].cpu()
                     
                     save_dir = os.path.join(self.sample_dir, segment_IDs[0])
                     os.makedirs(save_dir, exist_ok=True)
@@ -223,7 +233,7 @@ class TrainerBase:
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class TesterBase:
     def __init__(self, model, loader, pit_criterion, args):
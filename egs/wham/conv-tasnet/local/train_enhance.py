@@ -6,7 +6,7 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
-from dataset import WaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader
+from dataset import WaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader, BucketEvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.conv_tasnet import ConvTasNet
 from criterion.sdr import NegSDR, NegSISDR
@@ -49,6 +49,7 @@ parser.add_argument('--lr', type=float, default=0.001, help='Learning rate. Defa
 parser.add_argument('--weight_decay', type=float, default=0, help='Weight decay (L2 penalty). Default: 0')
 parser.add_argument('--max_norm', type=float, default=None, help='Gradient clipping')
 parser.add_argument('--batch_size', type=int, default=4, help='Batch size. Default: 4')
+parser.add_argument('--max_samples_per_batch', type=int, default=None, help='If given, validation utterances of similar lengths are zero-padded and batched so that (batch size) x (max length) does not exceed this value. Padding changes model outputs (e.g. gLN statistics), so validation loss is NOT equal to that of batch size 1. Default: batch size 1')
 parser.add_argument('--epochs', type=int, default=100, help='Number of epochs')
 parser.add_argument('--model_dir', type=str, default='./tmp/model', help='Model directory')
 parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss directory')
@@ -73,7 +74,10 @@ def main(args):
     
     loader = {}
     loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
-    loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
+    if args.max_samples_per_batch is None:
+        loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
+    else:
+        loader['valid'] = BucketEvalDataLoader(valid_dataset, max_samples=args.max_samples_per_batch, shuffle=False)
     
     if not args.enc_nonlinear:
         args.enc_nonlinear = None
@@ -4,6 +4,7 @@ import torch
 import torchaudio
 import torch.nn as nn
 
+from utils.utils_dataset import build_n_frames_index, build_packed_audio, LengthBucketBatchSampler, padded_collate_fn, FeatureCache, SourcePool, DynamicMixingDataset
 from algorithm.frequency_mask import compute_ideal_binary_mask, compute_ideal_ratio_mask, compute_wiener_filter_mask
 
 EPS = 1e-12
@@ -27,40 +28,33 @@ class WaveDataset(WSJ0Dataset):
         
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix'):
+            for start_idx in range(0, T_total, samples - overlap):
+                end_idx = start_idx + samples
+                if end_idx > T_total:
+                    break
+                data = {
+                    'sources': {},
+                    'mixture': {}
+                }
                 
-                for start_idx in range(0, T_total, samples - overlap):
-                    end_idx = start_idx + samples
-                    if end_idx > T_total:
-                        break
-                    data = {
-                        'sources': {},
-                        'mixture': {}
-                    }
-                    
-                    for source_idx in range(n_sources):
-                        source_data = {
-                            'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                            'start': start_idx,
-                            'end': end_idx
-                        }
-                        data['sources']['s{}'.format(source_idx + 1)] = source_data
-                    
-                    mixture_data = {
-                        'path': os.path.join('mix', '{}.wav'.format(ID)),
+                for source_idx in range(n_sources):
+                    source_data = {
+                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
                         'start': start_idx,
                         'end': end_idx
                     }
-                    data['mixture'] = mixture_data
-                    data['ID'] = ID
+                    data['sources']['s{}'.format(source_idx + 1)] = source_data
                 
-                    self.json_data.append(data)
+                mixture_data = {
+                    'path': os.path.join('mix', '{}.wav'.format(ID)),
+                    'start': start_idx,
+                    'end': end_idx
+                }
+                data['mixture'] = mixture_data
+                data['ID'] = ID
+            
+                self.json_data.append(data)
         
     def __getitem__(self, idx):
         """
@@ -75,16 +69,14 @@ class WaveDataset(WSJ0Dataset):
         for key in data['sources'].keys():
             source_data = data['sources'][key]
             start, end = source_data['start'], source_data['end']
-            wav_path = os.path.join(self.wav_root, source_data['path'])
-            wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+            wave = self._load_audio(source_data['path'], start, end)
             sources.append(wave)
         
         sources = torch.cat(sources, dim=0)
         
         mixture_data = data['mixture']
         start, end = mixture_data['start'], mixture_data['end']
-        wav_path = os.path.join(self.wav_root, mixture_data['path'])
-        mixture, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+        mixture = self._load_audio(mixture_data['path'], start, end)
             
         segment_ID = self.json_data[idx]['ID'] + '_{}-{}'.format(start, end)
         
@@ -92,6 +84,20 @@ class WaveDataset(WSJ0Dataset):
         
     def __len__(self):
         return len(self.json_data)
+    
+    def _load_audio(self, path, start, end):
+        """
+        Args:
+            path <str>: Path relative to `wav_root`
+            start <int>: Start sample
+            end <int>: End sample
+        Returns:
+            wave (n_channels, end - start) <torch.Tensor>
+        """
+        wav_path = os.path.join(self.wav_root, path)
+        wave, _ = torchaudio.load(wav_path, frame_offset=start, num_frames=end-start)
+
+        return wave
 
 class WaveTrainDataset(WaveDataset):
     def __init__(self, wav_root, list_path, samples=32000, overlap=None, n_sources=2):
@@ -111,45 +117,37 @@ class WaveEvalDataset(WaveDataset):
 
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-
-                wave, _ = torchaudio.load(wav_path)
-                
-                _, T_total = wave.size()
-                
-                if max_samples is None:
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix'):
+            if max_samples is None:
+                samples = T_total
+            else:
+                if T_total < max_samples:
                     samples = T_total
                 else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx + 1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
+                    samples = max_samples
+            
+            data = {
+                'sources': {},
+                'mixture': {}
+            }
+            
+            for source_idx in range(n_sources):
+                source_data = {
+                    'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
                     'start': 0,
                     'end': samples
                 }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
+                data['sources']['s{}'.format(source_idx + 1)] = source_data
             
-                self.json_data.append(data)
+            mixture_data = {
+                'path': os.path.join('mix', '{}.wav'.format(ID)),
+                'start': 0,
+                'end': samples
+            }
+            data['mixture'] = mixture_data
+            data['ID'] = ID
+            
+            self.json_data.append(data)
     
     def __getitem__(self, idx):
         mixture, sources, _ = super().__getitem__(idx)
@@ -172,6 +170,82 @@ class WaveTestDataset(WaveEvalDataset):
         
         return mixture, sources, segment_ID
 
+class PackedWaveTrainDataset(WaveTrainDataset):
+    """
+    Same as `WaveTrainDataset`, but audio is loaded from memory-mapped array packed in `pack_dir`.
+    The array is packed at the first time.
+    """
+    def __init__(self, wav_root, list_path, pack_dir, samples=32000, overlap=None, n_sources=2, dtype='float32'):
+        super().__init__(wav_root, list_path, samples=samples, overlap=overlap, n_sources=n_sources)
+
+        self.packed_audio = build_packed_audio(search_paths(self.json_data), pack_dir, root=self.wav_root, dtype=dtype)
+    
+    def _load_audio(self, path, start, end):
+        wave, _ = self.packed_audio.load(path, frame_offset=start, num_frames=end-start)
+
+        return wave
+
+class PackedWaveEvalDataset(WaveEvalDataset):
+    """
+    Same as `WaveEvalDataset`, but audio is loaded from memory-mapped array packed in `pack_dir`.
+    The array is packed at the first time.
+    """
+    def __init__(self, wav_root, list_path, pack_dir, max_samples=None, n_sources=2, dtype='float32'):
+        super().__init__(wav_root, list_path, max_samples=max_samples, n_sources=n_sources)
+
+        self.packed_audio = build_packed_audio(search_paths(self.json_data), pack_dir, root=self.wav_root, dtype=dtype)
+    
+    def _load_audio(self, path, start, end):
+        wave, _ = self.packed_audio.load(path, frame_offset=start, num_frames=end-start)
+
+        return wave
+
+class DynamicMixingWaveTrainDataset(DynamicMixingDataset):
+    """
+    Same output as `WaveTrainDataset`, but new mixtures are synthesized from sources in `wav_root` every time.
+    Each WSJ0 utterance is loaded only once into memory. Its speaker ID is the first 3 characters of utterance ID.
+    """
+    def __init__(self, wav_root, list_path, samples=32000, overlap=None, n_sources=2, max_gain=2.5, noise_root=None, snr_range=(-6, 3), n_mixtures=None):
+        """
+        Args:
+            overlap <int>: Used only to count default `n_mixtures`, as `WaveTrainDataset`. Default: samples//2
+            noise_root <str>: Directory of noise wav files, e.g. wham_noise/tr. If None, noise is not added.
+            n_mixtures <int>: Number of mixtures per epoch. If None, number of segments of `WaveTrainDataset` with the same `samples` and `overlap` is used, so that an epoch has the same number of iterations.
+        """
+        wav_root = os.path.abspath(wav_root)
+
+        if overlap is None:
+            overlap = samples//2
+
+        index = build_n_frames_index(wav_root, list_path, sub_dir='mix')
+        paths, speaker_IDs = {}, {}
+
+        for ID, _ in index:
+            # Mixture ID is <utterance ID>_<gain>_<utterance ID>_<gain>...
+            utterance_IDs = ID.split('_')[0::2]
+
+            for source_idx in range(n_sources):
+                utterance_ID = utterance_IDs[source_idx]
+
+                if utterance_ID in paths:
+                    continue
+
+                paths[utterance_ID] = os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID))
+                speaker_IDs[utterance_ID] = utterance_ID[:3]
+
+        source_pool = SourcePool(list(paths.values()), speaker_IDs=list(speaker_IDs.values()), root=wav_root)
+
+        if noise_root is None:
+            noise_pool = None
+        else:
+            noise_paths = sorted([path for path in os.listdir(noise_root) if path.endswith('.wav')])
+            noise_pool = SourcePool(noise_paths, root=os.path.abspath(noise_root))
+
+        if n_mixtures is None:
+            n_mixtures = sum([max((T_total - samples) // (samples - overlap) + 1, 0) for _, T_total in index])
+
+        super().__init__(source_pool, n_mixtures, samples=samples, n_sources=n_sources, max_gain=max_gain, noise_pool=noise_pool, snr_range=snr_range)
+
 class SpectrogramDataset(WaveDataset):
     def __init__(self, wav_root, list_path, fft_size, hop_size=None, window_fn='hann', normalize=False, samples=32000, overlap=None, n_sources=2):
         super().__init__(wav_root, list_path, samples=samples, overlap=overlap, n_sources=n_sources)
@@ -192,7 +266,21 @@ class SpectrogramDataset(WaveDataset):
         else:
             self.window = None
         
+        self.window_fn = window_fn
         self.normalize = normalize
+
+        self.feature_cache = None
+    
+    def enable_feature_cache(self, cache_dir, max_bytes=None, dtype='complex64', n_shards=16):
+        """
+        Spectrograms are cached on disk, because segments are deterministic.
+        Args:
+            cache_dir <str>: Directory of cache
+            max_bytes <int>: Size cap in bytes. Least recently used spectrograms are evicted.
+            dtype <str>: 'complex64' or 'float16' (magnitude and phase)
+            n_shards <int>: Number of sub-directories
+        """
+        self.feature_cache = FeatureCache(cache_dir, max_bytes=max_bytes, dtype=dtype, n_shards=n_shards)
         
     def __getitem__(self, idx):
         """
@@ -202,6 +290,31 @@ class SpectrogramDataset(WaveDataset):
             T (), <int>: Number of samples in time-domain
             segment_IDs (n_sources,) <list<str>>
         """
+        if self.feature_cache is None:
+            return self._compute_spectrogram(idx)
+        
+        data = self.json_data[idx]
+        mixture_data = data['mixture']
+        start, end = mixture_data['start'], mixture_data['end']
+
+        key = [self.wav_root, self.fft_size, self.hop_size, self.window_fn, self.normalize]
+        key += [(mixture_data['path'], start, end)]
+        key += [(source_data['path'], source_data['start'], source_data['end']) for source_data in data['sources'].values()]
+        key = tuple(key)
+
+        feature = self.feature_cache.get(key)
+
+        if feature is None:
+            mixture, sources, T, segment_IDs = self._compute_spectrogram(idx)
+            self.feature_cache.put(key, torch.cat([mixture, sources], dim=0))
+        else:
+            mixture, sources = torch.split(feature, [1, feature.size(0) - 1], dim=0)
+            T = end - start
+            segment_IDs = data['ID'] + '_{}-{}'.format(start, end)
+        
+        return mixture, sources, T, segment_IDs
+    
+    def _compute_spectrogram(self, idx):
         mixture, sources, segment_IDs = super().__getitem__(idx)
 
         n_dims = mixture.dim()
@@ -288,45 +401,37 @@ class IdealMaskSpectrogramEvalDataset(IdealMaskSpectrogramDataset):
 
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                
-                _, T_total = wave.size()
-                
-                if max_samples is None:
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix'):
+            if max_samples is None:
+                samples = T_total
+            else:
+                if T_total < max_samples:
                     samples = T_total
                 else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx+1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
+                    samples = max_samples
+            
+            data = {
+                'sources': {},
+                'mixture': {}
+            }
+            
+            for source_idx in range(n_sources):
+                source_data = {
+                    'path': os.path.join('s{}'.format(source_idx + 1), '{}.wav'.format(ID)),
                     'start': 0,
                     'end': samples
                 }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
+                data['sources']['s{}'.format(source_idx+1)] = source_data
             
-                self.json_data.append(data)
+            mixture_data = {
+                'path': os.path.join('mix', '{}.wav'.format(ID)),
+                'start': 0,
+                'end': samples
+            }
+            data['mixture'] = mixture_data
+            data['ID'] = ID
+            
+            self.json_data.append(data)
 
     def __getitem__(self, idx):
         """
@@ -380,6 +485,19 @@ class TestDataLoader(torch.utils.data.DataLoader):
         
         self.collate_fn = test_collate_fn
 
+class BucketEvalDataLoader(torch.utils.data.DataLoader):
+    """
+    Utterances of similar length are batched up to `max_samples` in total (including padding), instead of batch_size=1.
+    In addition to items of `EvalDataLoader`, mask (batch_size, T) of valid samples is returned as the last item.
+    The mask excludes padding from loss, but not from the model: e.g. gLN statistics include padded zeros, so outputs differ from batch_size=1 over the whole utterance.
+    Use it only for validation during training, where approximate loss is enough to monitor training and select the model.
+    """
+    def __init__(self, dataset, max_samples, max_batch_size=None, shuffle=False, **kwargs):
+        lengths = [data['mixture']['end'] - data['mixture']['start'] for data in dataset.json_data]
+        batch_sampler = LengthBucketBatchSampler(lengths, max_samples, max_batch_size=max_batch_size, shuffle=shuffle)
+
+        super().__init__(dataset, batch_sampler=batch_sampler, collate_fn=padded_collate_fn, **kwargs)
+
 def test_collate_fn(batch):
     batched_mixture, batched_sources = None, None
     batched_segment_ID = []
@@ -433,6 +551,23 @@ def attractor_test_collate_fn(batch):
     
     return batched_mixture, batched_sources, batched_assignment, batched_weight_threshold, batched_T, batched_segment_ID
 
+def search_paths(json_data):
+    """
+    Returns:
+        paths <list<str>>: Paths of mixtures and sources included in `json_data` without duplication.
+    """
+    paths = []
+
+    for data in json_data:
+        for key in data['sources'].keys():
+            paths.append(data['sources'][key]['path'])
+        
+        paths.append(data['mixture']['path'])
+    
+    paths = list(dict.fromkeys(paths))
+
+    return paths
+
 """
 Dataset for unknown number of sources.
 """
@@ -449,48 +584,41 @@ class MixedNumberSourcesWaveDataset(WSJ0Dataset):
         
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-
-                n_sources = 0
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix'):
+            n_sources = 0
 
-                for source_idx in range(max_n_sources):
-                    wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
-                    if not os.path.exists(wav_path):
-                        break
-                    n_sources += 1
+            for source_idx in range(max_n_sources):
+                wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
+                if not os.path.exists(wav_path):
+                    break
+                n_sources += 1
+            
+            for start_idx in range(0, T_total, samples - overlap):
+                end_idx = start_idx + samples
+                if end_idx > T_total:
+                    break
+                data = {
+                    'sources': {},
+                    'mixture': {}
+                }
                 
-                for start_idx in range(0, T_total, samples - overlap):
-                    end_idx = start_idx + samples
-                    if end_idx > T_total:
-                        break
-                    data = {
-                        'sources': {},
-                        'mixture': {}
-                    }
-                    
-                    for source_idx in range(n_sources):
-                        source_data = {
-                            'path': os.path.join('s{}'.format(source_idx+1), '{}.wav'.format(ID)),
-                            'start': start_idx,
-                            'end': end_idx
-                        }
-                        data['sources']['s{}'.format(source_idx+1)] = source_data
-                    
-                    mixture_data = {
-                        'path': os.path.join('mix', '{}.wav'.format(ID)),
+                for source_idx in range(n_sources):
+                    source_data = {
+                        'path': os.path.join('s{}'.format(source_idx+1), '{}.wav'.format(ID)),
                         'start': start_idx,
                         'end': end_idx
                     }
-                    data['mixture'] = mixture_data
-                    data['ID'] = ID
+                    data['sources']['s{}'.format(source_idx+1)] = source_data
                 
-                    self.json_data.append(data)
+                mixture_data = {
+                    'path': os.path.join('mix', '{}.wav'.format(ID)),
+                    'start': start_idx,
+                    'end': end_idx
+                }
+                data['mixture'] = mixture_data
+                data['ID'] = ID
+            
+                self.json_data.append(data)
         
     def __getitem__(self, idx):
         """
@@ -541,52 +669,45 @@ class MixedNumberSourcesWaveEvalDataset(MixedNumberSourcesWaveDataset):
 
         self.json_data = []
         
-        with open(list_path) as f:
-            for line in f:
-                ID = line.strip()
-                wav_path = os.path.join(wav_root, 'mix', '{}.wav'.format(ID))
-                
-                wave, _ = torchaudio.load(wav_path)
-                _, T_total = wave.size()
-                
-                if max_samples is None:
+        for ID, T_total in build_n_frames_index(wav_root, list_path, sub_dir='mix'):
+            if max_samples is None:
+                samples = T_total
+            else:
+                if T_total < max_samples:
                     samples = T_total
                 else:
-                    if T_total < max_samples:
-                        samples = T_total
-                    else:
-                        samples = max_samples
-                
-                n_sources = 0
+                    samples = max_samples
+            
+            n_sources = 0
 
-                for source_idx in range(max_n_sources):
-                    wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
-                    if not os.path.exists(wav_path):
-                        break
-                    n_sources += 1
-                
-                data = {
-                    'sources': {},
-                    'mixture': {}
-                }
-                
-                for source_idx in range(n_sources):
-                    source_data = {
-                        'path': os.path.join('s{}'.format(source_idx+1), '{}.wav'.format(ID)),
-                        'start': 0,
-                        'end': samples
-                    }
-                    data['sources']['s{}'.format(source_idx+1)] = source_data
-                
-                mixture_data = {
-                    'path': os.path.join('mix', '{}.wav'.format(ID)),
+            for source_idx in range(max_n_sources):
+                wav_path = os.path.join(wav_root, 's{}'.format(source_idx+1), '{}.wav'.format(ID))
+                if not os.path.exists(wav_path):
+                    break
+                n_sources += 1
+            
+            data = {
+                'sources': {},
+                'mixture': {}
+            }
+            
+            for source_idx in range(n_sources):
+                source_data = {
+                    'path': os.path.join('s{}'.format(source_idx+1), '{}.wav'.format(ID)),
                     'start': 0,
                     'end': samples
                 }
-                data['mixture'] = mixture_data
-                data['ID'] = ID
+                data['sources']['s{}'.format(source_idx+1)] = source_data
             
-                self.json_data.append(data)
+            mixture_data = {
+                'path': os.path.join('mix', '{}.wav'.format(ID)),
+                'start': 0,
+                'end': samples
+            }
+            data['mixture'] = mixture_data
+            data['ID'] = ID
+            
+            self.json_data.append(data)
     
     def __getitem__(self, idx):
         mixture, sources, _ = super().__getitem__(idx)
@@ -1,20 +1,17 @@
 import os
-import shutil
-import subprocess
 import time
-import uuid
 
-import numpy as np
-from mir_eval.separation import bss_eval_sources
 import torch
 import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
+from utils.utils_precision import MixedPrecision, to_fp32
 from criterion.pit import pit
+from evaluation import ScoringPool
 
 BITS_PER_SAMPLE_WSJ0 = 16
-MIN_PESQ = -0.5
 
 class TrainerBase:
     def __init__(self, model, loader, pit_criterion, optimizer, args):
@@ -40,12 +37,16 @@ class TrainerBase:
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         
         self.train_loss = torch.empty(self.epochs)
         self.valid_loss = torch.empty(self.epochs)
         
         self.use_cuda = args.use_cuda
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
+        self.speedup = None
         
         if args.continue_from:
             config = torch.load(args.continue_from, map_location=lambda storage, loc: storage)
@@ -65,6 +66,9 @@ class TrainerBase:
                 self.model.load_state_dict(config['state_dict'])
             
             self.optimizer.load_state_dict(config['optim_dict'])
+            
+            if 'scaler_dict' in config:
+                self.mixed_precision.load_state_dict(config['scaler_dict'])
         else:
             model_path = os.path.join(self.model_dir, "best.pth")
             
@@ -86,7 +90,12 @@ class TrainerBase:
             train_loss, valid_loss = self.run_one_epoch(epoch)
             end = time.time()
             
-            print("[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch+1, self.epochs, train_loss, valid_loss, end - start), flush=True)
+            s = "[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch+1, self.epochs, train_loss, valid_loss, end - start)
+            
+            if self.speedup is not None:
+                s += ", {}: x{:.2f} faster than fp32".format(self.mixed_precision.precision, self.speedup)
+            
+            print(s, flush=True)
             
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
@@ -117,7 +126,9 @@ class TrainerBase:
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -142,16 +153,23 @@ class TrainerBase:
                 mixture = mixture.cuda()
                 sources = sources.cuda()
             
-            estimated_sources = self.model(mixture)
-            loss, _ = self.pit_criterion(estimated_sources, sources)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.pit_criterion(to_fp32(self.model(mixture)), sources)[0])
+            
+            # Loss is computed in fp32.
+            with self.mixed_precision.autocast():
+                estimated_sources = self.model(mixture)
+            
+            loss, _ = self.pit_criterion(to_fp32(estimated_sources), sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -172,18 +190,27 @@ class TrainerBase:
         n_valid = len(self.valid_loader.dataset)
         
         with torch.no_grad():
-            for idx, (mixture, sources, segment_IDs) in enumerate(self.valid_loader):
+            for idx, (mixture, sources, segment_IDs, *mask) in enumerate(self.valid_loader):
+                # Mask of valid samples is given by `BucketEvalDataLoader`.
+                mask = mask[0] if len(mask) > 0 else None
+                
                 if self.use_cuda:
                     mixture = mixture.cuda()
                     sources = sources.cuda()
-                output = self.model(mixture)
-                loss, _ = self.pit_criterion(output, sources, batch_mean=False)
+                    mask = mask.cuda() if mask is not None else None
+                
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture)
+                
+                output = to_fp32(output)
+                loss, _ = self.pit_criterion(output, sources, batch_mean=False, mask=mask)
                 loss = loss.sum(dim=0)
                 valid_loss += loss.item()
                 
                 if idx < 5:
-                    mixture = mixture[0].squeeze(dim=0).cpu()
-                    estimated_sources = output[0].cpu()
+                    T = mask[0].sum().item() if mask is not None else mixture.size(-1)
+                    mixture = mixture[0, ..., :T].squeeze(dim=0).cpu()
+                    estimated_sources = output[0, ..., :T].cpu()
                     
                     save_dir = os.path.join(self.sample_dir, segment_IDs[0])
                     os.makedirs(save_dir, exist_ok=True)
@@ -213,6 +240,7 @@ class TrainerBase:
             config['state_dict'] = self.model.state_dict()
             
         config['optim_dict'] = self.optimizer.state_dict()
+        config['scaler_dict'] = self.mixed_precision.state_dict()
         
         config['best_loss'] = self.best_loss
         config['no_improvement'] = self.no_improvement
@@ -222,7 +250,7 @@ class TrainerBase:
         
         config['epoch'] = epoch + 1
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class TesterBase:
     def __init__(self, model, loader, pit_criterion, args):
@@ -245,6 +273,8 @@ class TesterBase:
             os.makedirs(self.out_dir, exist_ok=True)
         
         self.use_cuda = args.use_cuda
+        self.n_workers = getattr(args, 'n_workers', None)
+        self.mixed_precision = MixedPrecision(getattr(args, 'precision', 'fp32'), use_cuda=self.use_cuda)
         
         config = torch.load(args.model_path, map_location=lambda storage, loc: storage)
         
@@ -256,23 +286,17 @@ class TesterBase:
     def run(self):
         self.model.eval()
         
-        test_loss = 0
-        test_loss_improvement = 0
-        test_sdr_improvement = 0
-        test_sir_improvement = 0
-        test_sar = 0
-        test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
         print("ID, Loss, Loss improvement, SDR improvement, SIR improvement, SAR, PESQ", flush=True)
 
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
+        pesq_path = os.path.abspath('./PESQ')
+        loss_keys = ['loss', 'loss_improvement']
+        columns = loss_keys + ['sdr_improvement', 'sir_improvement', 'sar', 'pesq']
+        sums = {}
         
-        with torch.no_grad():
+        # Metrics are computed by worker processes while the model processes following utterances.
+        with torch.no_grad(), ScoringPool(n_workers=self.n_workers) as pool:
             for idx, (mixture, sources, segment_IDs) in enumerate(self.loader):
                 if self.use_cuda:
                     mixture = mixture.cuda()
@@ -281,7 +305,10 @@ class TesterBase:
                 loss_mixture, _ = self.pit_criterion(mixture, sources, batch_mean=False)
                 loss_mixture = loss_mixture.sum(dim=0)
                 
-                output = self.model(mixture)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture)
+                
+                output = to_fp32(output)
                 loss, perm_idx = self.pit_criterion(output, sources, batch_mean=False)
                 loss = loss.sum(dim=0)
                 loss_improvement = loss_mixture.item() - loss.item()
@@ -291,100 +318,68 @@ class TesterBase:
                 estimated_sources = output[0].cpu() # -> (n_sources, T)
                 perm_idx = perm_idx[0] # -> (n_sources,)
                 segment_IDs = segment_IDs[0] # -> <str>
-
-                repeated_mixture = torch.tile(mixture, (self.n_sources, 1))
-                result_estimated = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=estimated_sources.numpy()
-                )
-                result_mixed = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=repeated_mixture.numpy()
-                )
-        
-                sdr_improvement = np.mean(result_estimated[0] - result_mixed[0])
-                sir_improvement = np.mean(result_estimated[1] - result_mixed[1])
-                sar = np.mean(result_estimated[2])
-                
-                norm = torch.abs(mixture).max()
-                mixture /= norm
                 mixture_ID = segment_IDs
-                
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
 
                 if idx < 10 and self.out_dir is not None:
-                    mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(mixture_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                
-                for order_idx in range(self.n_sources):
-                    source, estimated_source = sources[order_idx], estimated_sources[perm_idx[order_idx]]
-                    
-                    # Target
-                    norm = torch.abs(source).max()
-                    source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
-                        signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                        torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    
-                    # Estimated source
-                    norm = torch.abs(estimated_source).max()
-                    estimated_source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(order_idx + 1, random_ID)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                
-                pesq = 0
-                
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sr, source_path, estimated_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-                    
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += MIN_PESQ
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(estimated_path), shell=True)
-                
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), loss_improvement, sdr_improvement, sir_improvement, sar, pesq), flush=True)
+                    self.save_examples(mixture_ID, mixture, sources, estimated_sources[perm_idx])
                 
-                test_loss += loss.item()
-                test_loss_improvement += loss_improvement
-                test_sdr_improvement += sdr_improvement
-                test_sir_improvement += sir_improvement
-                test_sar += sar
-                test_pesq += pesq
-        
-        os.chdir("../") # back to the original directory
+                finished = pool.submit(
+                    (mixture_ID, loss.item(), loss_improvement),
+                    mixture.numpy(), sources.numpy(), estimated_sources[perm_idx].numpy(), self.sr, pesq_path=pesq_path
+                )
+                self.report(finished, sums, loss_keys=loss_keys, columns=columns)
+            
+            self.report(pool.drain(), sums, loss_keys=loss_keys, columns=columns)
 
-        test_loss /= n_test
-        test_loss_improvement /= n_test
-        test_sdr_improvement /= n_test
-        test_sir_improvement /= n_test
-        test_sar /= n_test
-        test_pesq /= n_test
+        test_loss = sums['loss'] / n_test
+        test_loss_improvement = sums['loss_improvement'] / n_test
+        test_sdr_improvement = sums['sdr_improvement'] / n_test
+        test_sir_improvement = sums['sir_improvement'] / n_test
+        test_sar = sums['sar'] / n_test
+        test_pesq = sums['pesq'] / n_test
             
         print("Loss: {:.3f}, loss improvement: {:3f}, SDR improvement: {:3f}, SIR improvement: {:3f}, SAR: {:3f}, PESQ: {:.3f}".format(test_loss, test_loss_improvement, test_sdr_improvement, test_sir_improvement, test_sar, test_pesq))
-        print("Evaluation of PESQ returns error {} times.".format(n_pesq_error))
+        print("Evaluation of PESQ returns error {} times.".format(sums['n_pesq_error']))
+    
+    def report(self, finished, sums, loss_keys, columns):
+        """
+        Print scores of finished utterances and add them into `sums`.
+        Args:
+            finished <list<tuple>>: (meta, result) returned by `ScoringPool`, where meta is (mixture_ID, *losses).
+            sums <dict<str, float>>: Running sums of losses and scores, which is updated in-place.
+            loss_keys <list<str>>: Names of losses in meta, e.g. ['loss', 'loss_improvement']
+            columns <list<str>>: Keys printed after mixture ID, chosen from `loss_keys` and keys of result.
+        """
+        for (mixture_ID, *losses), result in finished:
+            scores = dict(zip(loss_keys, losses), **result)
+            print(", ".join([mixture_ID] + ["{:.3f}".format(scores[key]) for key in columns]), flush=True)
+
+            for key, value in scores.items():
+                sums[key] = sums.get(key, 0) + value
+    
+    def save_examples(self, mixture_ID, mixture, sources, estimated_sources):
+        """
+        Args:
+            mixture (T,)
+            sources (n_sources, T)
+            estimated_sources (n_sources, T): Already permuted in order of sources.
+        """
+        mixture = mixture / torch.abs(mixture).max()
+        mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
+        torchaudio.save(mixture_path, mixture.unsqueeze(dim=0), sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+        
+        for order_idx in range(self.n_sources):
+            source, estimated_source = sources[order_idx], estimated_sources[order_idx]
+            
+            # Target
+            source = source / torch.abs(source).max()
+            source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
+            torchaudio.save(source_path, source.unsqueeze(dim=0), sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+            
+            # Estimated source
+            estimated_source = estimated_source / torch.abs(estimated_source).max()
+            estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
+            torchaudio.save(estimated_path, estimated_source.unsqueeze(dim=0), sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
 
 class Trainer(TrainerBase):
     def __init__(self, model, loader, pit_criterion, optimizer, args):
@@ -444,16 +439,22 @@ class AttractorTrainer(TrainerBase):
             mixture_amplitude = torch.abs(mixture)
             sources_amplitude = torch.abs(sources)
             
-            estimated_sources_amplitude = self.model(mixture_amplitude, assignment=assignment, threshold_weight=threshold_weight, n_sources=sources.size(1))
-            loss = self.criterion(estimated_sources_amplitude, sources_amplitude)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.criterion(to_fp32(self.model(mixture_amplitude, assignment=assignment, threshold_weight=threshold_weight, n_sources=sources.size(1))), sources_amplitude))
+            
+            with self.mixed_precision.autocast():
+                estimated_sources_amplitude = self.model(mixture_amplitude, assignment=assignment, threshold_weight=threshold_weight, n_sources=sources.size(1))
+            
+            loss = self.criterion(to_fp32(estimated_sources_amplitude), sources_amplitude)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -493,7 +494,10 @@ class AttractorTrainer(TrainerBase):
                 mixture_amplitude = torch.abs(mixture)
                 sources_amplitude = torch.abs(sources)
                 
-                output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                
+                output = to_fp32(output)
                 # At the test phase, assignment may be unknown.
                 loss, _ = pit(self.criterion, output, sources_amplitude, batch_mean=False)
                 loss = loss.sum(dim=0)
@@ -563,20 +567,14 @@ class AttractorTester(TesterBase):
 
         n_sources = self.n_sources
 
-        test_loss = 0
-        test_sdr_improvement = 0
-        test_sir_improvement = 0
-        test_sar = 0
-        test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
+        pesq_path = os.path.abspath('./PESQ')
+        loss_keys = ['loss']
+        columns = loss_keys + ['pesq']
+        sums = {}
 
-        with torch.no_grad():
+        with torch.no_grad(), ScoringPool(n_workers=self.n_workers) as pool:
             for idx, (mixture, sources, ideal_mask, threshold_weight, T, segment_IDs) in enumerate(self.loader):
                 """
                     mixture (1, 1, n_bins, n_frames)
@@ -594,7 +592,10 @@ class AttractorTester(TesterBase):
                 mixture_amplitude = torch.abs(mixture) # -> (1, 1, n_bins, n_frames)
                 sources_amplitude = torch.abs(sources)
                 
-                output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture_amplitude, assignment=None, threshold_weight=threshold_weight, n_sources=n_sources)
+                
+                output = to_fp32(output)
                 loss, perm_idx = self.pit_criterion(output, sources_amplitude, batch_mean=False)
                 loss = loss.sum(dim=0)
                 
@@ -612,98 +613,27 @@ class AttractorTester(TesterBase):
                 mixture = torch.istft(mixture, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T).squeeze(dim=0) # -> (T,)
                 sources = torch.istft(sources, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T) # -> (n_sources, T)
                 estimated_sources = torch.istft(estimated_sources, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T) # -> (n_sources, T)
-                
-                repeated_mixture = torch.tile(mixture, (self.n_sources, 1))
-                result_estimated = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=estimated_sources.numpy()
-                )
-                result_mixed = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=repeated_mixture.numpy()
-                )
-        
-                sdr_improvement = np.mean(result_estimated[0] - result_mixed[0])
-                sir_improvement = np.mean(result_estimated[1] - result_mixed[1])
-                sar = np.mean(result_estimated[2])
-
-                norm = torch.abs(mixture).max()
-                mixture /= norm
                 mixture_ID = segment_IDs
-
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
                     
                 if idx < 10 and self.out_dir is not None:
-                    mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(mixture_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    
-                for order_idx in range(self.n_sources):
-                    source, estimated_source = sources[order_idx], estimated_sources[perm_idx[order_idx]]
-                    
-                    # Target
-                    norm = torch.abs(source).max()
-                    source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
-                        signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                        torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-
-                    # Estimated source
-                    norm = torch.abs(estimated_source).max()
-                    estimated_source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(order_idx + 1, random_ID)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                
-                pesq = 0
-                    
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sr, source_path, estimated_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += -0.5
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(estimated_path), shell=True)
-                
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), pesq), flush=True)
+                    self.save_examples(mixture_ID, mixture, sources, estimated_sources[perm_idx])
                 
-                test_loss += loss.item()
-                test_sdr_improvement += sdr_improvement
-                test_sir_improvement += sir_improvement
-                test_sar += sar
-                test_pesq += pesq
+                finished = pool.submit(
+                    (mixture_ID, loss.item()),
+                    mixture.numpy(), sources.numpy(), estimated_sources[perm_idx].numpy(), self.sr, pesq_path=pesq_path
+                )
+                self.report(finished, sums, loss_keys=loss_keys, columns=columns)
+            
+            self.report(pool.drain(), sums, loss_keys=loss_keys, columns=columns)
 
-        test_loss /= n_test
-        test_sdr_improvement /= n_test
-        test_sir_improvement /= n_test
-        test_sar /= n_test
-        test_pesq /= n_test
-        
-        os.chdir("../") # back to the original directory
+        test_loss = sums['loss'] / n_test
+        test_sdr_improvement = sums['sdr_improvement'] / n_test
+        test_sir_improvement = sums['sir_improvement'] / n_test
+        test_sar = sums['sar'] / n_test
+        test_pesq = sums['pesq'] / n_test
 
         print("Loss: {:.3f}, SDR improvement: {:3f}, SIR improvement: {:3f}, SAR: {:3f}, PESQ: {:.3f}".format(test_loss, test_sdr_improvement, test_sir_improvement, test_sar, test_pesq))
-        print("Evaluation of PESQ returns error {} times".format(n_pesq_error))
+        print("Evaluation of PESQ returns error {} times".format(sums['n_pesq_error']))
 
 class AnchoredAttractorTrainer(AttractorTrainer):
     def __init__(self, model, loader, criterion, optimizer, args):
@@ -728,16 +658,22 @@ class AnchoredAttractorTrainer(AttractorTrainer):
             mixture_amplitude = torch.abs(mixture)
             sources_amplitude = torch.abs(sources)
             
-            estimated_sources_amplitude = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=sources.size(1))
-            loss = self.criterion(estimated_sources_amplitude, sources_amplitude)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.criterion(to_fp32(self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=sources.size(1))), sources_amplitude))
+            
+            with self.mixed_precision.autocast():
+                estimated_sources_amplitude = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=sources.size(1))
+            
+            loss = self.criterion(to_fp32(estimated_sources_amplitude), sources_amplitude)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
         
             train_loss += loss.item()
             
@@ -775,7 +711,10 @@ class AnchoredAttractorTrainer(AttractorTrainer):
                 mixture_amplitude = torch.abs(mixture)
                 sources_amplitude = torch.abs(sources)
                 
-                output = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=n_sources)
+                with self.mixed_precision.autocast():
+                    output = self.model(mixture_amplitude, threshold_weight=threshold_weight, n_sources=n_sources)
+                
+                output = to_fp32(output)
                 # At the test phase, assignment may be unknown.
                 loss, _ = pit(self.criterion, output, sources_amplitude, batch_mean=False)
                 loss = loss.sum(dim=0)
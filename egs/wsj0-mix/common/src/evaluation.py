@@ -0,0 +1,251 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+import wave
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+import numpy as np
+import torch
+
+from criterion.bss_eval import bss_eval_improvement
+
+MIN_PESQ = -0.5
+SHM_DIR = '/dev/shm'
+
+_worker_tmp_dir = None
+
+def score_utterance(mixture, sources, estimated_sources, sr, pesq_path=None, tmp_dir=None):
+    """
+    Score one utterance from in-memory arrays.
+    Args:
+        mixture (T,) <np.ndarray>
+        sources (n_sources, T) <np.ndarray>
+        estimated_sources (n_sources, T) <np.ndarray>: Already permuted in order of sources.
+        sr <int>: Sampling rate
+        pesq_path <str>: Path to PESQ binary. If None, PESQ is not computed.
+        tmp_dir <str>: Directory for temporary wav files required by PESQ binary. If None, per-process directory is used.
+    Returns:
+        result <dict>: 'sdr_improvement', 'sir_improvement', 'sar', 'pesq' and 'n_pesq_error'
+    """
+    n_sources = sources.shape[0]
+
+    sdr_improvement, sir_improvement, sar, _ = bss_eval_improvement(
+        torch.from_numpy(mixture[np.newaxis]), torch.from_numpy(sources[np.newaxis]), torch.from_numpy(estimated_sources[np.newaxis])
+    )
+
+    result = {
+        'sdr_improvement': sdr_improvement.mean().item(),
+        'sir_improvement': sir_improvement.mean().item(),
+        'sar': sar.mean().item(),
+        'pesq': 0,
+        'n_pesq_error': 0
+    }
+
+    if pesq_path is None:
+        return result
+
+    if tmp_dir is None:
+        tmp_dir = _get_worker_tmp_dir()
+
+    pesq = 0
+
+    for source, estimated_source in zip(sources, estimated_sources):
+        source = source / np.abs(source).max()
+        estimated_source = estimated_source / np.abs(estimated_source).max()
+        _pesq = compute_pesq(source, estimated_source, sr, pesq_path, tmp_dir=tmp_dir)
+
+        if _pesq is None:
+            # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
+            result['n_pesq_error'] += 1
+            pesq += MIN_PESQ
+        else:
+            pesq += _pesq
+
+    result['pesq'] = pesq / n_sources
+
+    return result
+
+def compute_pesq(reference, estimated, sr, pesq_path, tmp_dir):
+    """
+    Args:
+        reference (T,) <np.ndarray>: Normalized into [-1, 1]
+        estimated (T,) <np.ndarray>: Normalized into [-1, 1]
+        sr <int>: Sampling rate
+        pesq_path <str>: Path to PESQ binary
+        tmp_dir <str>: Working directory of PESQ binary, which also writes its log files here.
+    Returns:
+        pesq <float>: Returns None if PESQ binary fails.
+    """
+    random_ID = str(uuid.uuid4())
+    reference_path = os.path.join(tmp_dir, "tmp-target_{}.wav".format(random_ID))
+    estimated_path = os.path.join(tmp_dir, "tmp-estimated_{}.wav".format(random_ID))
+
+    try:
+        _save_wav_int16(reference_path, reference, sr)
+        _save_wav_int16(estimated_path, estimated, sr)
+
+        process = subprocess.run([pesq_path, "+{}".format(sr), reference_path, estimated_path], cwd=tmp_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        # e.g. PESQ binary is not found, which is counted as error as well as failure in PESQ software.
+        return None
+    finally:
+        for path in [reference_path, estimated_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    for line in process.stdout.decode(errors='ignore').splitlines():
+        if 'Prediction' in line:
+            fields = line.split()
+
+            if len(fields) >= 5:
+                try:
+                    return float(fields[4])
+                except ValueError:
+                    return None
+
+    return None
+
+def _save_wav_int16(path, signal, sr):
+    signal = np.clip(np.round(signal * 32767), -32768, 32767).astype('<i2')
+
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(signal.tobytes())
+
+def _init_worker():
+    # Parallelism is given by processes.
+    torch.set_num_threads(1)
+
+def _get_worker_tmp_dir():
+    global _worker_tmp_dir
+
+    if _worker_tmp_dir is None:
+        # Prefer tmpfs, because PESQ binary requires wav files.
+        root = SHM_DIR if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK) else None
+        _worker_tmp_dir = tempfile.mkdtemp(prefix='pesq-', dir=root)
+        Finalize(None, shutil.rmtree, args=(_worker_tmp_dir,), kwargs={'ignore_errors': True}, exitpriority=0)
+
+    return _worker_tmp_dir
+
+class ScoringPool:
+    """
+    Score utterances on process pool while the main process runs inference.
+    Results are yielded in order of submission, so that printed results are deterministic.
+    The number of pending utterances is bounded, so that memory usage doesn't grow with the size of test set.
+    """
+    def __init__(self, n_workers=None, max_pending=None):
+        """
+        Args:
+            n_workers <int>: Number of processes. If None, os.cpu_count() is used. If 0, utterances are scored in the main process.
+            max_pending <int>: Max number of submitted but not yielded utterances. Default: 2 * n_workers.
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+
+        self.n_workers = n_workers
+
+        if max_pending is None:
+            max_pending = 2 * max(n_workers, 1)
+
+        self.max_pending = max_pending
+
+        if n_workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker)
+        else:
+            self.executor = None
+
+        self.pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, key, *args, **kwargs):
+        """
+        Submit `score_utterance(*args, **kwargs)`.
+        Returns:
+            finished <list<tuple>>: (key, result) of finished utterances, which are popped to keep pending bounded.
+        """
+        if self.executor is None:
+            future = score_utterance(*args, **kwargs)
+        else:
+            future = self.executor.submit(score_utterance, *args, **kwargs)
+
+        self.pending.append((key, future))
+
+        finished = []
+
+        while len(self.pending) > self.max_pending:
+            finished.append(self._pop())
+
+        return finished
+
+    def drain(self):
+        """
+        Returns:
+            finished <list<tuple>>: (key, result) of all pending utterances
+        """
+        finished = []
+
+        while len(self.pending) > 0:
+            finished.append(self._pop())
+
+        return finished
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _pop(self):
+        key, future = self.pending.popleft()
+
+        if self.executor is None:
+            return key, future
+
+        return key, future.result()
+
+def _test_scoring_pool():
+    import time
+
+    np.random.seed(111)
+
+    n_utterances, n_sources, T = 8, 2, 8000
+    data = []
+
+    for idx in range(n_utterances):
+        sources = np.random.randn(n_sources, T)
+        mixture = sources.sum(axis=0)
+        estimated_sources = sources + 0.1 * np.random.randn(n_sources, T)
+        data.append((mixture, sources, estimated_sources))
+
+    results = {}
+
+    for n_workers in [0, 2]:
+        start = time.perf_counter()
+
+        with ScoringPool(n_workers=n_workers, max_pending=2) as pool:
+            results[n_workers] = []
+
+            for idx, (mixture, sources, estimated_sources) in enumerate(data):
+                results[n_workers] += pool.submit(idx, mixture, sources, estimated_sources, 8000)
+
+            results[n_workers] += pool.drain()
+
+        end = time.perf_counter()
+
+        print("n_workers={}: {:.3f}[sec]".format(n_workers, end - start))
+
+    print([key for key, _ in results[2]])
+    print(all([np.isclose(result_serial['sdr_improvement'], result_parallel['sdr_improvement']) for (_, result_serial), (_, result_parallel) in zip(results[0], results[2])]))
+
+if __name__ == '__main__':
+    _test_scoring_pool()
@@ -6,7 +6,7 @@ import torch
 import torch.nn as nn
 
 from utils.utils import set_seed
-from dataset import WaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader
+from dataset import WaveTrainDataset, DynamicMixingWaveTrainDataset, WaveEvalDataset, TrainDataLoader, EvalDataLoader, BucketEvalDataLoader
 from adhoc_driver import AdhocTrainer
 from models.conv_tasnet import ConvTasNet
 from criterion.sdr import NegSISDR
@@ -21,6 +21,9 @@ parser.add_argument('--valid_list_path', type=str, default=None, help='Path for
 parser.add_argument('--sr', type=int, default=10, help='Sampling rate')
 parser.add_argument('--duration', type=float, default=2, help='Duration')
 parser.add_argument('--valid_duration', type=float, default=4, help='Duration for valid dataset for avoiding memory error.')
+parser.add_argument('--dynamic_mixing', type=int, default=0, help='0: Fixed mixtures, 1: Synthesize new mixtures from sources every time')
+parser.add_argument('--noise_root', type=str, default=None, help='Directory of noise for dynamic mixing, e.g. wham_noise/tr. If not given, noise is not added.')
+parser.add_argument('--n_mixtures', type=int, default=None, help='# mixtures per epoch for dynamic mixing. If not given, # segments of fixed mixtures is used.')
 parser.add_argument('--enc_basis', type=str, default='trainable', choices=['trainable','Fourier','trainableFourier','trainableFourierTrainablePhase'], help='Encoder type')
 parser.add_argument('--dec_basis', type=str, default='trainable', choices=['trainable','Fourier','trainableFourier','trainableFourierTrainablePhase', 'pinv'], help='Decoder type')
 parser.add_argument('--enc_nonlinear', type=str, default=None, help='Non-linear function of encoder')
@@ -49,12 +52,15 @@ parser.add_argument('--lr', type=float, default=0.001, help='Learning rate. Defa
 parser.add_argument('--weight_decay', type=float, default=0, help='Weight decay (L2 penalty). Default: 0')
 parser.add_argument('--max_norm', type=float, default=None, help='Gradient clipping')
 parser.add_argument('--batch_size', type=int, default=4, help='Batch size. Default: 128')
+parser.add_argument('--max_samples_per_batch', type=int, default=None, help='If given, validation utterances of similar lengths are zero-padded and batched so that (batch size) x (max length) does not exceed this value. Padding changes model outputs (e.g. gLN statistics), so validation loss is NOT equal to that of batch size 1. Default: batch size 1')
 parser.add_argument('--epochs', type=int, default=5, help='Number of epochs')
 parser.add_argument('--model_dir', type=str, default='./tmp/model', help='Model directory')
 parser.add_argument('--loss_dir', type=str, default='./tmp/loss', help='Loss directory')
 parser.add_argument('--sample_dir', type=str, default='./tmp/sample', help='Sample directory')
 parser.add_argument('--continue_from', type=str, default=None, help='Resume training')
+parser.add_argument('--max_checkpoints', type=int, default=1, help='# of checkpoints kept for each of best.pth and last.pth. Older ones are renamed to best.pth.1, best.pth.2, ...')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'], help='Precision of forward computation. bf16 is available on both CPU and GPU, fp16 only on GPU.')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -65,14 +71,20 @@ def main(args):
     overlap = samples // 2
     max_samples = int(args.sr * args.valid_duration)
     
-    train_dataset = WaveTrainDataset(args.train_wav_root, args.train_list_path, samples=samples, overlap=overlap, n_sources=args.n_sources)
+    if args.dynamic_mixing:
+        train_dataset = DynamicMixingWaveTrainDataset(args.train_wav_root, args.train_list_path, samples=samples, overlap=overlap, n_sources=args.n_sources, noise_root=args.noise_root, n_mixtures=args.n_mixtures)
+    else:
+        train_dataset = WaveTrainDataset(args.train_wav_root, args.train_list_path, samples=samples, overlap=overlap, n_sources=args.n_sources)
     valid_dataset = WaveEvalDataset(args.valid_wav_root, args.valid_list_path, max_samples=max_samples, n_sources=args.n_sources)
     print("Training dataset includes {} samples.".format(len(train_dataset)))
     print("Valid dataset includes {} samples.".format(len(valid_dataset)))
     
     loader = {}
     loader['train'] = TrainDataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
-    loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
+    if args.max_samples_per_batch is None:
+        loader['valid'] = EvalDataLoader(valid_dataset, batch_size=1, shuffle=False)
+    else:
+        loader['valid'] = BucketEvalDataLoader(valid_dataset, max_samples=args.max_samples_per_batch, shuffle=False)
     
     if not args.enc_nonlinear:
         args.enc_nonlinear = None
@@ -115,7 +127,7 @@ def main(args):
     else:
         raise ValueError("Not support criterion {}".format(args.criterion))
     
-    pit_criterion = PIT1d(criterion, n_sources=args.n_sources)
+    pit_criterion = PIT1d(criterion, n_sources=args.n_sources, pairwise=True)
     
     trainer = AdhocTrainer(model, loader, pit_criterion, optimizer, args)
     trainer.run()
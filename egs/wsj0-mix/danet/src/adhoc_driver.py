@@ -1,21 +1,16 @@
 import os
-import shutil
-import subprocess
 import time
-import uuid
 
-import numpy as np
-from mir_eval.separation import bss_eval_sources
 import torch
 import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
 from driver import TrainerBase, TesterBase
+from evaluation import ScoringPool
 from criterion.pit import pit
 
 BITS_PER_SAMPLE_WSJ0 = 16
-MIN_PESQ = -0.5
 
 class AdhocTrainer(TrainerBase):
     def __init__(self, model, loader, criterion, optimizer, args):
@@ -91,7 +86,9 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch + 1], valid_loss=self.valid_loss[:epoch + 1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch_train(self, epoch):
         # Override
@@ -233,22 +230,16 @@ class AdhocTester(TesterBase):
 
         n_sources = self.n_sources
         
-        test_loss = 0
-        test_sdr_improvement = 0
-        test_sir_improvement = 0
-        test_sar = 0
-        test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
         print("ID, Loss, SDR improvement, SIR improvement, SAR, PESQ", flush=True)
 
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
+        pesq_path = os.path.abspath('./PESQ')
+        loss_keys = ['loss']
+        columns = loss_keys + ['sdr_improvement', 'sir_improvement', 'sar', 'pesq']
+        sums = {}
         
-        with torch.no_grad():
+        with torch.no_grad(), ScoringPool(n_workers=self.n_workers) as pool:
             for idx, (mixture, sources, ideal_mask, threshold_weight, T, segment_IDs) in enumerate(self.loader):
                 """
                     mixture (1, 1, n_bins, n_frames)
@@ -284,95 +275,24 @@ class AdhocTester(TesterBase):
                 mixture = torch.istft(mixture, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T).squeeze(dim=0) # -> (T,)
                 sources = torch.istft(sources, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T) # -> (n_sources, T)
                 estimated_sources = torch.istft(estimated_sources, n_fft=self.fft_size, hop_length=self.hop_size, normalized=self.normalize, window=self.window, length=T) # -> (n_sources, T)
-                
-                repeated_mixture = torch.tile(mixture, (self.n_sources, 1))
-                result_estimated = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=estimated_sources.numpy()
-                )
-                result_mixed = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=repeated_mixture.numpy()
-                )
-
-                sdr_improvement = np.mean(result_estimated[0] - result_mixed[0])
-                sir_improvement = np.mean(result_estimated[1] - result_mixed[1])
-                sar = np.mean(result_estimated[2])
-
-                norm = torch.abs(mixture).max()
-                mixture /= norm
                 mixture_ID = segment_IDs
-
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
                     
                 if idx < 10 and self.out_dir is not None:
-                    mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(mixture_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                
-                for order_idx in range(self.n_sources):
-                    source, estimated_source = sources[order_idx], estimated_sources[perm_idx[order_idx]]
-                    
-                    # Target
-                    norm = torch.abs(source).max()
-                    source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
-                        signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                        torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    
-                    # Estimated source
-                    norm = torch.abs(estimated_source).max()
-                    estimated_source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(order_idx + 1, random_ID)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-
-                pesq = 0
-                    
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sr, source_path, estimated_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-                    
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += MIN_PESQ
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(estimated_path), shell=True)
-
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), sdr_improvement, sir_improvement, sar, pesq), flush=True)
+                    self.save_examples(mixture_ID, mixture, sources, estimated_sources[perm_idx])
                 
-                test_loss += loss.item()
-                test_sdr_improvement += sdr_improvement
-                test_sir_improvement += sir_improvement
-                test_sar += sar
-                test_pesq += pesq
+                finished = pool.submit(
+                    (mixture_ID, loss.item()),
+                    mixture.numpy(), sources.numpy(), estimated_sources[perm_idx].numpy(), self.sr, pesq_path=pesq_path
+                )
+                self.report(finished, sums, loss_keys=loss_keys, columns=columns)
+            
+            self.report(pool.drain(), sums, loss_keys=loss_keys, columns=columns)
         
-        test_loss /= n_test
-        test_sdr_improvement /= n_test
-        test_sir_improvement /= n_test
-        test_sar /= n_test
-        test_pesq /= n_test
-
-        os.chdir("../") # back to the original directory
+        test_loss = sums['loss'] / n_test
+        test_sdr_improvement = sums['sdr_improvement'] / n_test
+        test_sir_improvement = sums['sir_improvement'] / n_test
+        test_sar = sums['sar'] / n_test
+        test_pesq = sums['pesq'] / n_test
 
         print("Loss: {:.3f}, SDR improvement: {:3f}, SIR improvement: {:3f}, SAR: {:3f}, PESQ: {:.3f}".format(test_loss, test_sdr_improvement, test_sir_improvement, test_sar, test_pesq))
-        print("Evaluation of PESQ returns error {} times".format(n_pesq_error))
\ No newline at end of file
+        print("Evaluation of PESQ returns error {} times".format(sums['n_pesq_error']))
\ No newline at end of file
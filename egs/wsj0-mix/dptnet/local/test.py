@@ -22,6 +22,8 @@ parser.add_argument('--criterion', type=str, default='sisdr', choices=['sisdr'],
 parser.add_argument('--out_dir', type=str, default=None, help='Output directory')
 parser.add_argument('--model_path', type=str, default='./tmp/model/best.pth', help='Path for model')
 parser.add_argument('--use_cuda', type=int, default=1, help='0: Not use cuda, 1: Use cuda')
+parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'], help='Precision of forward computation. bf16 is available on both CPU and GPU, fp16 only on GPU.')
+parser.add_argument('--n_workers', type=int, default=None, help='# processes for evaluation of SDR and PESQ. If not given, os.cpu_count() is used. 0: Evaluate in main process')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 parser.add_argument('--seed', type=int, default=42, help='Random seed')
 
@@ -53,7 +55,7 @@ def main(args):
     else:
         raise ValueError("Not support criterion {}".format(args.criterion))
     
-    pit_criterion = PIT1d(criterion, n_sources=args.n_sources)
+    pit_criterion = PIT1d(criterion, n_sources=args.n_sources, pairwise=True)
     
     tester = Tester(model, loader, pit_criterion, args)
     tester.run()
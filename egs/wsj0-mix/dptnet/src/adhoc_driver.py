@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_precision import to_fp32
 from driver import TrainerBase, TesterBase
 
 class AdhocTrainer(TrainerBase):
@@ -31,7 +32,12 @@ class AdhocTrainer(TrainerBase):
             train_loss, valid_loss = self.run_one_epoch(epoch)
             end = time.time()
             
-            print("[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch+1, self.epochs, train_loss, valid_loss, end - start), flush=True)
+            s = "[Epoch {}/{}] loss (train): {:.5f}, loss (valid): {:.5f}, {:.3f} [sec]".format(epoch+1, self.epochs, train_loss, valid_loss, end - start)
+            
+            if self.speedup is not None:
+                s += ", {}: x{:.2f} faster than fp32".format(self.mixed_precision.precision, self.speedup)
+            
+            print(s, flush=True)
             
             self.train_loss[epoch] = train_loss
             self.valid_loss[epoch] = valid_loss
@@ -53,11 +59,13 @@ class AdhocTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
 
             if self.no_improvement >= 10:
                 print("Stop training.")
                 break
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch_train(self, epoch):
         """
@@ -73,17 +81,23 @@ class AdhocTrainer(TrainerBase):
                 mixture = mixture.cuda()
                 sources = sources.cuda()
             
-            estimated_sources = self.model(mixture)
-            loss, _ = self.pit_criterion(estimated_sources, sources)
+            if self.mixed_precision.enabled and self.speedup is None:
+                self.speedup = self.mixed_precision.measure_speedup(self.model, lambda: self.pit_criterion(to_fp32(self.model(mixture)), sources)[0])
+            
+            with self.mixed_precision.autocast():
+                estimated_sources = self.model(mixture)
+            
+            loss, _ = self.pit_criterion(to_fp32(estimated_sources), sources)
             
             self.optimizer.zero_grad()
-            loss.backward()
+            self.mixed_precision.backward(loss)
             
             if self.max_norm:
+                self.mixed_precision.unscale_(self.optimizer)
                 nn.utils.clip_grad_norm_(self.model.parameters(), self.max_norm)
             
             self.update_lr(epoch)
-            self.optimizer.step()
+            self.mixed_precision.step(self.optimizer)
             
             train_loss += loss.item()
             
@@ -131,6 +145,7 @@ class AdhocTrainer(TrainerBase):
             config['state_dict'] = self.model.state_dict()
             
         config['optim_dict'] = self.optimizer.state_dict()
+        config['scaler_dict'] = self.mixed_precision.state_dict()
         
         config['best_loss'] = self.best_loss
         config['no_improvement'] = self.no_improvement
@@ -141,7 +156,7 @@ class AdhocTrainer(TrainerBase):
         config['epoch'] = epoch + 1
         config['step'] = self.step # self.step is already updated in `update_lr`, so you don't have to plus 1.
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class Tester(TesterBase):
     def __init__(self, model, loader, pit_criterion, args):
@@ -20,6 +20,7 @@ parser.add_argument('--hop_size', type=int, default=None, help='Hop size')
 parser.add_argument('--n_sources', type=int, default=None, help='# speakers')
 parser.add_argument('--criterion', type=str, default='sisdr', choices=['sisdr'], help='Criterion')
 parser.add_argument('--out_dir', type=str, default=None, help='Output directory')
+parser.add_argument('--n_workers', type=int, default=None, help='# processes for evaluation of SDR and PESQ. If not given, os.cpu_count() is used. 0: Evaluate in main process')
 parser.add_argument('--overwrite', type=int, default=0, help='0: NOT overwrite, 1: FORCE overwrite')
 
 def main(args):
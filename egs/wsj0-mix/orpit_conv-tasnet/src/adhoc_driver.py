@@ -1,22 +1,15 @@
 import os
-import shutil
-import subprocess
 import time
-import uuid
 
-import numpy as np
-from mir_eval.separation import bss_eval_sources
 import torch
-import torchaudio
 import torch.nn as nn
 
 from utils.utils import draw_loss_curve
+from utils.utils_checkpoint import CheckpointWriter
 from driver import TrainerBase, TesterBase
+from evaluation import ScoringPool
 from criterion.pit import pit
 
-BITS_PER_SAMPLE_WSJ0 = 16
-MIN_PESQ = -0.5
-
 class ORPITTrainer(TrainerBase):
     def __init__(self, model, loader, pit_criterion, optimizer, args):
         super().__init__(model, loader, pit_criterion, optimizer, args)
@@ -34,6 +27,8 @@ class ORPITTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         self.train_loss = torch.empty(self.epochs)
         
@@ -77,7 +72,9 @@ class ORPITTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
     
     def run_one_epoch(self, epoch):
         """
@@ -155,7 +152,7 @@ class ORPITTrainer(TrainerBase):
         config['epoch'] = epoch + 1
         config['train_loss'] = self.train_loss
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class Tester(TesterBase):
     def __init__(self, model, loader, pit_criterion, args):
@@ -165,23 +162,16 @@ class Tester(TesterBase):
         self.model.eval()
         
         n_sources = self.n_sources
-        test_loss = 0
-        test_loss_improvement = 0
-        test_sdr_improvement = 0
-        test_sir_improvement = 0
-        test_sar = 0
-        test_pesq = 0
-        n_pesq_error = 0
         n_test = len(self.loader.dataset)
 
         print("ID, Loss, Loss improvement, SDR improvement, SIR improvement, SAR, PESQ", flush=True)
 
-        tmp_dir = os.path.join(os.getcwd(), 'tmp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        shutil.copy('./PESQ', os.path.join(tmp_dir, 'PESQ'))
-        os.chdir(tmp_dir)
+        pesq_path = os.path.abspath('./PESQ')
+        loss_keys = ['loss', 'loss_improvement']
+        columns = loss_keys + ['sdr_improvement', 'sir_improvement', 'sar', 'pesq']
+        sums = {}
         
-        with torch.no_grad():
+        with torch.no_grad(), ScoringPool(n_workers=self.n_workers) as pool:
             for idx, (mixture, sources, segment_IDs) in enumerate(self.loader):
                 if self.use_cuda:
                     mixture = mixture.cuda()
@@ -209,100 +199,28 @@ class Tester(TesterBase):
                 estimated_sources = output[0].cpu() # -> (n_sources, T)
                 perm_idx = perm_idx[0] # -> (n_sources,)
                 segment_IDs = segment_IDs[0] # -> <str>
-
-                repeated_mixture = np.tile(mixture.numpy(), reps=(self.n_sources, 1))
-                result_estimated = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=estimated_sources.numpy()
-                )
-                result_mixed = bss_eval_sources(
-                    reference_sources=sources.numpy(),
-                    estimated_sources=repeated_mixture.numpy()
-                )
-        
-                sdr_improvement = np.mean(result_estimated[0] - result_mixed[0])
-                sir_improvement = np.mean(result_estimated[1] - result_mixed[1])
-                sar = np.mean(result_estimated[2])
-                
-                norm = torch.abs(mixture).max()
-                mixture /= norm
                 mixture_ID = segment_IDs
-                
-                # Generate random number temporary wav file.
-                random_ID = str(uuid.uuid4())
 
                 if idx < 10 and self.out_dir is not None:
-                    mixture_path = os.path.join(self.out_dir, "{}.wav".format(mixture_ID))
-                    signal = mixture.unsqueeze(dim=0) if mixture.dim() == 1 else mixture
-                    torchaudio.save(mixture_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
+                    self.save_examples(mixture_ID, mixture, sources, estimated_sources[perm_idx])
                 
-                for order_idx in range(self.n_sources):
-                    source, estimated_source = sources[order_idx], estimated_sources[perm_idx[order_idx]]
-                    
-                    # Target
-                    norm = torch.abs(source).max()
-                    source /= norm
-                    if idx < 10 and self.out_dir is not None:
-                        source_path = os.path.join(self.out_dir, "{}_{}-target.wav".format(mixture_ID, order_idx + 1))
-                        signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                        torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    source_path = "tmp-{}-target_{}.wav".format(order_idx + 1, random_ID)
-                    signal = source.unsqueeze(dim=0) if source.dim() == 1 else source
-                    torchaudio.save(source_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    
-                    # Estimated source
-                    norm = torch.abs(estimated_source).max()
-                    estimated_source /= norm
-                    if idx < 10 and  self.out_dir is not None:
-                        estimated_path = os.path.join(self.out_dir, "{}_{}-estimated.wav".format(mixture_ID, order_idx + 1))
-                        signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                        torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(order_idx + 1, random_ID)
-                    signal = estimated_source.unsqueeze(dim=0) if estimated_source.dim() == 1 else estimated_source
-                    torchaudio.save(estimated_path, signal, sample_rate=self.sr, bits_per_sample=BITS_PER_SAMPLE_WSJ0)
-                
-                pesq = 0
-                
-                for source_idx in range(self.n_sources):
-                    source_path = "tmp-{}-target_{}.wav".format(source_idx + 1, random_ID)
-                    estimated_path = "tmp-{}-estimated_{}.wav".format(source_idx + 1, random_ID)
-                    
-                    command = "./PESQ +{} {} {}".format(self.sr, source_path, estimated_path)
-                    command += " | grep Prediction | awk '{print $5}'"
-                    pesq_output = subprocess.check_output(command, shell=True)
-                    pesq_output = pesq_output.decode().strip()
-                    
-                    if pesq_output == '':
-                        # If processing error occurs in PESQ software, it is regarded as PESQ score is -0.5. (minimum of PESQ)
-                        n_pesq_error += 1
-                        pesq += MIN_PESQ
-                    else:
-                        pesq += float(pesq_output)
-                    
-                    subprocess.call("rm {}".format(source_path), shell=True)
-                    subprocess.call("rm {}".format(estimated_path), shell=True)
-                
-                pesq /= self.n_sources
-                print("{}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}".format(mixture_ID, loss.item(), loss_improvement, sdr_improvement, sir_improvement, sar, pesq), flush=True)
-                
-                test_loss += loss.item()
-                test_loss_improvement += loss_improvement
-                test_sdr_improvement += sdr_improvement
-                test_sir_improvement += sir_improvement
-                test_sar += sar
-                test_pesq += pesq
-        
-        os.chdir("../") # back to the original directory
-
-        test_loss /= n_test
-        test_loss_improvement /= n_test
-        test_sdr_improvement /= n_test
-        test_sir_improvement /= n_test
-        test_sar /= n_test
-        test_pesq /= n_test
+                finished = pool.submit(
+                    (mixture_ID, loss.item(), loss_improvement),
+                    mixture.numpy(), sources.numpy(), estimated_sources[perm_idx].numpy(), self.sr, pesq_path=pesq_path
+                )
+                self.report(finished, sums, loss_keys=loss_keys, columns=columns)
+            
+            self.report(pool.drain(), sums, loss_keys=loss_keys, columns=columns)
+
+        test_loss = sums['loss'] / n_test
+        test_loss_improvement = sums['loss_improvement'] / n_test
+        test_sdr_improvement = sums['sdr_improvement'] / n_test
+        test_sir_improvement = sums['sir_improvement'] / n_test
+        test_sar = sums['sar'] / n_test
+        test_pesq = sums['pesq'] / n_test
             
         print("Loss: {:.3f}, loss improvement: {:3f}, SDR improvement: {:3f}, SIR improvement: {:3f}, SAR: {:3f}, PESQ: {:.3f}".format(test_loss, test_loss_improvement, test_sdr_improvement, test_sir_improvement, test_sar, test_pesq))
-        print("Evaluation of PESQ returns error {} times.".format(n_pesq_error))
+        print("Evaluation of PESQ returns error {} times.".format(sums['n_pesq_error']))
 
 
 class AdhocTrainer(ORPITTrainer):
@@ -326,6 +244,8 @@ class FinetuneTrainer(TrainerBase):
         os.makedirs(self.loss_dir, exist_ok=True)
         os.makedirs(self.sample_dir, exist_ok=True)
         
+        self.checkpoint_writer = CheckpointWriter(max_to_keep=getattr(args, 'max_checkpoints', 1))
+        
         self.epochs = args.epochs
         self.train_loss = torch.empty(self.epochs)
         self.valid_loss = torch.empty(self.epochs)
@@ -383,7 +303,9 @@ class FinetuneTrainer(TrainerBase):
             self.save_model(epoch, model_path)
             
             save_path = os.path.join(self.loss_dir, "loss.png")
-            draw_loss_curve(train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+            self.checkpoint_writer.submit(draw_loss_curve, train_loss=self.train_loss[:epoch+1], valid_loss=self.valid_loss[:epoch+1], save_path=save_path)
+        
+        self.checkpoint_writer.flush()
 
     def run_one_epoch_train(self, epoch):
         """
@@ -511,7 +433,7 @@ class FinetuneTrainer(TrainerBase):
         config['epoch'] = epoch + 1
         config['is_finetune'] = True # For finetuner
         
-        torch.save(config, model_path)
+        self.checkpoint_writer.save(config, model_path)
 
 class AdhocFinetuneTrainer(FinetuneTrainer):
     def __init__(self, model, loader, pit_criterion, optimizer, args):
@@ -1,87 +1,170 @@
-import random
-
 import torch
+import torch.nn.functional as F
 
 class Kmeans:
-    def __init__(self, data, K=2, init_centroids='kmeans++'):
+    def __init__(self, data, K=2, init_centroids='kmeans++', generator=None):
         """
         Args:
             data (num_data, dimension) <torch.Tensor>
         """
         self.K = K
+        self.num_data = len(data)
+
+        self.kmeans = BatchKmeans(data.unsqueeze(dim=0), K=K, init_centroids=init_centroids, generator=generator)
+        
+    def __call__(self, iteration=10, tol=None):
+        """
+        Args:
+            iteration <int>: Max number of iterations
+            tol <float>: See `BatchKmeans.__call__`.
+        Returns:
+            onehot_labels (num_data, K) <torch.Tensor>
+            centroids (K, dimension) <torch.Tensor>
+        """
+        onehot_labels, centroids = self.kmeans(iteration=iteration, tol=tol)
         
-        num_data = len(data)
+        return onehot_labels.squeeze(dim=0), centroids.squeeze(dim=0)
+        
+    def update_once(self):
+        onehot_labels, centroids = self.kmeans.update_once()
+    
+        return onehot_labels.squeeze(dim=0), centroids.squeeze(dim=0)
+    
+    @property
+    def onehot_labels(self):
+        return self.kmeans.onehot_labels.squeeze(dim=0)
+
+class BatchKmeans:
+    def __init__(self, data, K=2, init_centroids='kmeans++', generator=None):
+        """
+        K-means for batch of data. Each data in batch is clustered independently.
+        Args:
+            data (batch_size, num_data, dimension) <torch.Tensor>
+            generator <torch.Generator>: Used in initialization of centroids.
+        """
+        self.K = K
+        
+        batch_size, num_data, _ = data.size()
         
         if init_centroids == 'kmeans++':
-            centroid_id = self._init_kmeans_pp(data, K=K)
+            centroids = self._init_kmeans_pp(data, K=K, generator=generator)
         else:
-            centroid_id = random.sample(range(num_data), K)
-        centroids = data[centroid_id]
+            centroid_id = torch.rand(batch_size, num_data, generator=generator).argsort(dim=1)[:, :K].to(data.device)
+            centroids = self._gather(data, centroid_id)
         
-        data = data.unsqueeze(dim=1)
-        distance = torch.norm((data - centroids), dim=2) # (num_data, K)
-        distance, cluster_id = torch.min(distance, dim=1)
-        
-        self.onehot_labels = torch.eye(K)[cluster_id].to(data.device)
-        self.num_data = num_data
+        self.batch_size, self.num_data = batch_size, num_data
         self.data = data
+        self.squared_norm = torch.sum(data**2, dim=2) # (batch_size, num_data)
+        self.centroids = centroids
+        self.cluster_id = self._assign(centroids)
     
-    def _init_kmeans_pp(self, data, K=2):
+    def _init_kmeans_pp(self, data, K=2, generator=None):
         """
+        Minimum distance to chosen centroids is updated by distance to the latest centroid only.
         Args:
-            data (num_data, dimension) <torch.Tensor>
+            data (batch_size, num_data, dimension) <torch.Tensor>
         Returns:
-            centroid_id <list<int>>: where len(centroid_id) = K
+            centroids (batch_size, K, dimension) <torch.Tensor>
         """
-        num_data = len(data)
-        centroid_id = random.choices(range(num_data), k=1)
-
-        while len(centroid_id) < K:
-            centroids = data[centroid_id]
-
-            data = data.unsqueeze(dim=1)
-            distance = torch.norm(data - centroids, dim=2) # (num_data, K)
-            distance, _ = torch.min(distance, dim=1)
-            distance = distance**2
-            weights = distance / torch.sum(distance)
+        batch_size, num_data, _ = data.size()
+        
+        centroid_id = torch.randint(num_data, (batch_size, 1), generator=generator).to(data.device)
+        centroids = [self._gather(data, centroid_id)]
+        min_distance = None
+
+        while len(centroids) < K:
+            distance = torch.sum((data - centroids[-1])**2, dim=2) # (batch_size, num_data)
+
+            if min_distance is None:
+                min_distance = distance
+            else:
+                min_distance = torch.minimum(min_distance, distance)
+            
+            # If all points coincide with centroids, sample uniformly.
+            weights = torch.where(min_distance.sum(dim=1, keepdim=True) > 0, min_distance, torch.ones_like(min_distance))
+            centroid_id = torch.multinomial(weights.cpu().double(), 1, generator=generator).to(data.device) # (batch_size, 1)
+            centroids.append(self._gather(data, centroid_id))
+
+        centroids = torch.cat(centroids, dim=1)
+
+        return centroids
+    
+    def _gather(self, data, index):
+        """
+        Args:
+            data (batch_size, num_data, dimension) <torch.Tensor>
+            index (batch_size, n) <torch.LongTensor>
+        Returns:
+            output (batch_size, n, dimension) <torch.Tensor>
+        """
+        index = index.unsqueeze(dim=2).expand(-1, -1, data.size(2))
+        output = torch.gather(data, 1, index)
 
-            centroid_id += random.choices(range(num_data), k=1, weights=weights)
+        return output
+    
+    def _assign(self, centroids):
+        """
+        Distance is expanded as |x|^2 - 2x^Tc + |c|^2, so that (batch_size, num_data, K, dimension) tensor is not required.
+        Args:
+            centroids (batch_size, K, dimension) <torch.Tensor>
+        Returns:
+            cluster_id (batch_size, num_data) <torch.LongTensor>
+        """
+        squared_norm = torch.sum(centroids**2, dim=2).unsqueeze(dim=1) # (batch_size, 1, K)
+        distance = self.squared_norm.unsqueeze(dim=2) - 2 * torch.bmm(self.data, centroids.permute(0, 2, 1)) + squared_norm # (batch_size, num_data, K)
+        cluster_id = torch.argmin(distance, dim=2)
 
-        return centroid_id
-        
-    def __call__(self, iteration=10):
-        onehot_labels, centroids = None, None
+        return cluster_id
+    
+    def __call__(self, iteration=10, tol=1e-4):
+        """
+        Args:
+            iteration <int>: Max number of iterations
+            tol <float>: Iteration stops when squared shift of centroids is less than or equal to `tol` for all data in batch. If None, `iteration` times are run.
+        Returns:
+            onehot_labels (batch_size, num_data, K) <torch.Tensor>
+            centroids (batch_size, K, dimension) <torch.Tensor>
+        """
+        onehot_labels, centroids = self.onehot_labels, self.centroids
         
         for idx in range(iteration):
+            previous_centroids = self.centroids
             onehot_labels, centroids = self.update_once()
+
+            if tol is not None:
+                shift = torch.sum((centroids - previous_centroids)**2, dim=(1, 2))
+
+                if torch.all(shift <= tol):
+                    break
         
         return onehot_labels, centroids
-        
+    
     def update_once(self):
-        num_data, K = self.num_data, self.K
-        onehot_labels = self.onehot_labels.view(num_data, K, 1) # (num_data, K, 1)
-        data = self.data # (num_data, 1, D)
-        
+        """
+        Returns:
+            onehot_labels (batch_size, num_data, K) <torch.Tensor>
+            centroids (batch_size, K, dimension) <torch.Tensor>
+        """
         """
         1. Calculate centroids
         """
-        masked_data = data * onehot_labels # (num_data, K, D)
-        pseudo_centroids = masked_data.sum(dim=0)
-        normalizer = onehot_labels.sum(dim=0)
-        centroids = pseudo_centroids / normalizer  # (K, D)
+        onehot_labels = self.onehot_labels # (batch_size, num_data, K)
+        pseudo_centroids = torch.bmm(onehot_labels.permute(0, 2, 1), self.data) # (batch_size, K, D)
+        normalizer = onehot_labels.sum(dim=1).unsqueeze(dim=2) # (batch_size, K, 1)
+        # Empty cluster keeps its previous centroid.
+        centroids = torch.where(normalizer > 0, pseudo_centroids / normalizer.clamp(min=1), self.centroids)
         
         """
         2. Put labels based on distance
         """
-        distance = torch.norm((data - centroids), dim=2) # (num_data, K)
-        distance, cluster_id = torch.min(distance, dim=1)
-        onehot_labels = torch.eye(K)[cluster_id].to(data.device)
-        
-        self.num_data = num_data
-        self.data = data
-        self.onehot_labels = onehot_labels
+        self.centroids = centroids
+        self.cluster_id = self._assign(centroids)
     
-        return onehot_labels, centroids
+        return self.onehot_labels, centroids
+    
+    @property
+    def onehot_labels(self):
+        return F.one_hot(self.cluster_id, num_classes=self.K).to(self.data.dtype)
 
 def _test_kmeans():
     import os
@@ -89,7 +172,7 @@ def _test_kmeans():
     import matplotlib.pyplot as plt
 
     os.makedirs("data/Kmeans", exist_ok=True)
-    random.seed(111)
+    torch.manual_seed(111)
 
     K = 2
     iteration = 10
@@ -128,6 +211,38 @@ def _test_kmeans():
         plt.savefig("data/Kmeans/faithful-{}.png".format(idx+1), bbox_inches='tight')
 
 
+def _test_batch_kmeans():
+    import time
+
+    torch.manual_seed(111)
+
+    batch_size, num_data, D = 4, 4000, 20
+    K = 3
+
+    means = 4 * torch.randn(batch_size, K, D)
+    true_cluster_id = torch.randint(K, (batch_size, num_data))
+    data = torch.stack([means[batch_idx, true_cluster_id[batch_idx]] for batch_idx in range(batch_size)], dim=0)
+    data = data + torch.randn(batch_size, num_data, D)
+
+    start = time.perf_counter()
+    for batch_idx in range(batch_size):
+        kmeans = Kmeans(data[batch_idx], K=K)
+        kmeans(iteration=10)
+    end = time.perf_counter()
+    print("Kmeans (loop over batch): {:.3f}[sec]".format(end - start))
+
+    start = time.perf_counter()
+    kmeans = BatchKmeans(data, K=K)
+    onehot_labels, centroids = kmeans(iteration=10)
+    end = time.perf_counter()
+    print("BatchKmeans: {:.3f}[sec]".format(end - start))
+
+    # Clusters are correct up to permutation.
+    cluster_id = onehot_labels.argmax(dim=2)
+    correct = [len(set(zip(cluster_id[batch_idx].tolist(), true_cluster_id[batch_idx].tolist()))) == K for batch_idx in range(batch_size)]
+    print(onehot_labels.size(), centroids.size(), correct)
+
 if __name__ == '__main__':
     _test_kmeans()
+    _test_batch_kmeans()
 
@@ -1,5 +1,6 @@
 import warnings
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 
@@ -22,9 +23,9 @@ def compute_ideal_binary_mask(input):
         
         input = input.permute(1, 2, 0).contiguous()
         flatten_input = input.view(n_bins*n_frames, n_sources)
-        flatten_idx = torch.arange(0, n_bins*n_frames*n_sources, n_sources)
+        flatten_idx = torch.arange(0, n_bins*n_frames*n_sources, n_sources, device=input.device)
         flatten_idx = flatten_idx + flatten_input.argmax(dim=1)
-        flatten_mask = torch.zeros(n_bins*n_frames*n_sources)
+        flatten_mask = torch.zeros(n_bins*n_frames*n_sources, dtype=input.dtype, device=input.device)
         flatten_mask[flatten_idx] = 1
         
         mask = flatten_mask.view(n_bins, n_frames, n_sources)
@@ -34,9 +35,9 @@ def compute_ideal_binary_mask(input):
         
         input = input.permute(0, 2, 3, 1).contiguous()
         flatten_input = input.view(batch_size*n_bins*n_frames, n_sources)
-        flatten_idx = torch.arange(0, batch_size*n_bins*n_frames*n_sources, n_sources)
+        flatten_idx = torch.arange(0, batch_size*n_bins*n_frames*n_sources, n_sources, device=input.device)
         flatten_idx = flatten_idx + flatten_input.argmax(dim=1)
-        flatten_mask = torch.zeros(batch_size*n_bins*n_frames*n_sources)
+        flatten_mask = torch.zeros(batch_size*n_bins*n_frames*n_sources, dtype=input.dtype, device=input.device)
         flatten_mask[flatten_idx] = 1
         
         mask = flatten_mask.view(batch_size, n_bins, n_frames, n_sources)
@@ -193,7 +194,7 @@ def ideal_complex_mask(input, eps=EPS):
     mask = compute_ideal_complex_mask(input, eps=eps)
     return mask
 
-def multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, eps=EPS):
+def multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=1, channels_first=True, chunk_size=None, n_threads=1, eps=EPS):
     """
     Multichannel Wiener filter.
     Implementation is based on norbert package.
@@ -202,6 +203,8 @@ def multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=1
         estimated_sources_amplitude <torch.Tensor>: Nonnegative tensor with shape of (n_sources, n_channels, n_bins, n_frames) or (batch_size, n_sources, n_channels, n_bins, n_frames)
         iteration <int>: Iteration of EM algorithm updates
         channels_first <bool>: Only supports True
+        chunk_size <int>: Number of frames processed at once, which bounds memory of (n_bins, chunk_size, n_channels, n_channels) covariances. If None, all frames are processed at once.
+        n_threads <int>: Number of threads, each of which processes a band of frequency bins.
         eps <float>: small value for numerical stability
     """
     assert channels_first, "`channels_first` is expected True, but given {}".format(channels_first)
@@ -214,19 +217,11 @@ def multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=1
         Shape of mixture is (1, n_channels, n_bins, n_frames) or (n_channels, n_bins, n_frames)
         """
         if n_dims_mixture == 4:
-            mixture = mixture.squeeze(dim=1) # (n_channels, n_bins, n_frames)
+            mixture = mixture.squeeze(dim=0) # (n_channels, n_bins, n_frames)
         elif n_dims_mixture != 3:
             raise ValueError("mixture.dim() is expected 3 or 4, but given {}.".format(mixture.dim()))
         
-        # Use soft mask
-        ratio = estimated_sources_amplitude / (estimated_sources_amplitude.sum(dim=0) + eps)
-        estimated_sources = ratio * mixture
-
-        norm = max(1, torch.abs(mixture).max() / 10)
-        mixture, estimated_sources = mixture / norm, estimated_sources / norm
-
-        estimated_sources = update_em(mixture, estimated_sources, iteration, eps=eps)
-        estimated_sources = norm * estimated_sources
+        mixture, estimated_sources_amplitude = mixture.unsqueeze(dim=0), estimated_sources_amplitude.unsqueeze(dim=0)
     elif n_dims == 5:
         """
         Shape of mixture is (batch_size, 1, n_channels, n_bins, n_frames) or (batch_size, n_channels, n_bins, n_frames)
@@ -235,25 +230,22 @@ def multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=1
             mixture = mixture.squeeze(dim=1) # (batch_size, n_channels, n_bins, n_frames)
         elif n_dims_mixture != 4:
             raise ValueError("mixture.dim() is expected 4 or 5, but given {}.".format(mixture.dim()))
-        
-        estimated_sources = []
+    else:
+        raise ValueError("estimated_sources_amplitude.dim() is expected 4 or 5, but given {}.".format(estimated_sources_amplitude.dim()))
 
-        for _mixture, _estimated_sources_amplitude in zip(mixture, estimated_sources_amplitude):
-            # Use soft mask
-            ratio = _estimated_sources_amplitude / (_estimated_sources_amplitude.sum(dim=0) + eps)
-            _estimated_sources = ratio * _mixture
+    # Use soft mask
+    ratio = estimated_sources_amplitude / (estimated_sources_amplitude.sum(dim=1, keepdim=True) + eps)
+    estimated_sources = ratio * mixture.unsqueeze(dim=1) # (batch_size, n_sources, n_channels, n_bins, n_frames)
 
-            norm = max(1, torch.abs(_mixture).max() / 10)
-            _mixture, _estimated_sources = _mixture / norm, _estimated_sources / norm
+    norm = torch.abs(mixture).flatten(start_dim=1).max(dim=1).values / 10
+    norm = torch.clamp(norm, min=1).view(-1, 1, 1, 1) # (batch_size, 1, 1, 1)
+    mixture, estimated_sources = mixture / norm, estimated_sources / norm.unsqueeze(dim=1)
 
-            _estimated_sources = update_em(_mixture, _estimated_sources, iteration, eps=eps)
-            _estimated_sources = norm * _estimated_sources
+    estimated_sources = update_em_batch(mixture, estimated_sources, iteration, chunk_size=chunk_size, n_threads=n_threads, eps=eps)
+    estimated_sources = norm.unsqueeze(dim=1) * estimated_sources
 
-            estimated_sources.append(_estimated_sources.unsqueeze(dim=0))
-        
-        estimated_sources = torch.cat(estimated_sources, dim=0)
-    else:
-        raise ValueError("estimated_sources_amplitude.dim() is expected 4 or 5, but given {}.".format(estimated_sources_amplitude.dim()))
+    if n_dims == 4:
+        estimated_sources = estimated_sources.squeeze(dim=0)
 
     return estimated_sources
 
@@ -338,6 +330,109 @@ def update_em(mixture, estimated_sources, iteration=1, source_parallel=False, bi
 
     return estimated_sources
 
+def update_em_batch(mixture, estimated_sources, iteration=1, chunk_size=None, n_threads=1, eps=EPS):
+    """
+    Batched version of `update_em`. Frequency bins are independent of each other, so they are split into bands when n_threads > 1.
+    Args:
+        mixture: (batch_size, n_channels, n_bins, n_frames)
+        estimated_sources: (batch_size, n_sources, n_channels, n_bins, n_frames)
+        chunk_size <int>: Number of frames processed at once. If None, all frames are processed at once.
+        n_threads <int>: Number of threads to process bands of frequency bins.
+    Returns
+        estiamted_sources: (batch_size, n_sources, n_channels, n_bins, n_frames)
+    """
+    n_bins = mixture.size(2)
+
+    if n_threads <= 1 or n_bins < n_threads:
+        return _update_em_batch(mixture, estimated_sources, iteration=iteration, chunk_size=chunk_size, eps=eps)
+    
+    sections = [n_bins // n_threads + (1 if idx < n_bins % n_threads else 0) for idx in range(n_threads)]
+    mixture_bands = torch.split(mixture, sections, dim=2)
+    estimated_sources_bands = torch.split(estimated_sources, sections, dim=3)
+
+    def _update(band):
+        _mixture, _estimated_sources = band
+        return _update_em_batch(_mixture, _estimated_sources, iteration=iteration, chunk_size=chunk_size, eps=eps)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        estimated_sources = list(executor.map(_update, zip(mixture_bands, estimated_sources_bands)))
+    
+    estimated_sources = torch.cat(estimated_sources, dim=3)
+
+    return estimated_sources
+
+def _update_em_batch(mixture, estimated_sources, iteration=1, chunk_size=None, eps=EPS):
+    """
+    Args:
+        mixture: (batch_size, n_channels, n_bins, n_frames)
+        estimated_sources: (batch_size, n_sources, n_channels, n_bins, n_frames)
+    Returns
+        estiamted_sources: (batch_size, n_sources, n_channels, n_bins, n_frames)
+    """
+    n_frames = mixture.size(-1)
+
+    if chunk_size is None:
+        chunk_size = n_frames
+
+    for iteration_idx in range(iteration):
+        # Spatial covariance matrices are accumulated over all frames.
+        v, R, denominator = [], 0, 0
+
+        for start in range(0, n_frames, chunk_size):
+            y = estimated_sources[..., start: start + chunk_size] # (batch_size, n_sources, n_channels, n_bins, chunk_size)
+            y_real, y_imag = y.real, y.imag
+            _v = torch.mean(y_real**2 + y_imag**2, dim=2) # (batch_size, n_sources, n_bins, chunk_size)
+            R = R + torch.einsum('bsift,bsjft->bsfij', y, y.conj()) # (batch_size, n_sources, n_bins, n_channels, n_channels)
+            denominator = denominator + _v.sum(dim=3) # (batch_size, n_sources, n_bins)
+            v.append(_v)
+        
+        R = R / (denominator.unsqueeze(dim=3).unsqueeze(dim=4) + eps)
+
+        updated_sources = torch.empty_like(estimated_sources)
+
+        for chunk_idx, start in enumerate(range(0, n_frames, chunk_size)):
+            x = mixture[..., start: start + chunk_size] # (batch_size, n_channels, n_bins, chunk_size)
+            _v = v[chunk_idx] # (batch_size, n_sources, n_bins, chunk_size)
+
+            Cxx = torch.einsum('bsft,bsfij->bftij', _v.to(R.dtype), R) # (batch_size, n_bins, chunk_size, n_channels, n_channels)
+            inv_Cxx = _inverse_hermitian(Cxx, eps=math.sqrt(eps))
+
+            # Gain v * R * inv(Cxx) is not materialized, because inv(Cxx) * x is shared among sources.
+            z = torch.einsum('bftij,bjft->bfti', inv_Cxx, x) # (batch_size, n_bins, chunk_size, n_channels)
+            y = torch.einsum('bsfij,bftj->bsift', R, z) # (batch_size, n_sources, n_channels, n_bins, chunk_size)
+            updated_sources[..., start: start + chunk_size] = _v.unsqueeze(dim=2) * y
+        
+        estimated_sources = updated_sources
+
+    return estimated_sources
+
+def _inverse_hermitian(input, eps=EPS):
+    """
+    Inverse of input + eps * I, where input is Hermitian.
+    Closed form is used for 2x2 matrices (stereo).
+    Args:
+        input (*, n_channels, n_channels)
+    Returns:
+        output (*, n_channels, n_channels)
+    """
+    n_channels = input.size(-1)
+
+    if n_channels != 2:
+        return torch.linalg.inv(input + eps * torch.eye(n_channels, dtype=input.dtype, device=input.device))
+    
+    a, b = input[..., 0, 0].real + eps, input[..., 0, 1]
+    c, d = input[..., 1, 0], input[..., 1, 1].real + eps
+    det = a * d - (b * c).real # Real, because c is conjugate of b.
+
+    a, d = a.to(input.dtype), d.to(input.dtype)
+    output = torch.stack([
+        torch.stack([d, - b], dim=-1),
+        torch.stack([- c, a], dim=-1)
+    ], dim=-2)
+    output = output / det.unsqueeze(dim=-1).unsqueeze(dim=-1)
+
+    return output
+
 def get_stats(spectrogram, eps=EPS):
     """
     Compute empirical parameters of local gaussian model.
@@ -406,10 +501,43 @@ def _test_spectrogram(spectrogram, method='PSM'):
     for signal, tag in zip(estimated_signal, ['man', 'woman']):
         torchaudio.save("data/frequency_mask/{}-estimated_{}.wav".format(tag, method), signal.unsqueeze(dim=0), sample_rate=16000, bits_per_sample=16)
 
+def _test_multichannel_wiener_filter():
+    torch.manual_seed(111)
+
+    batch_size, n_sources, n_channels, n_bins, n_frames = 2, 4, 2, 513, 400
+    mixture = torch.randn(batch_size, 1, n_channels, n_bins, n_frames, dtype=torch.cfloat)
+    estimated_sources_amplitude = torch.rand(batch_size, n_sources, n_channels, n_bins, n_frames)
+
+    # Reference: update_em for each data
+    start = time.perf_counter()
+    reference = []
+
+    for _mixture, _estimated_sources_amplitude in zip(mixture.squeeze(dim=1), estimated_sources_amplitude):
+        ratio = _estimated_sources_amplitude / (_estimated_sources_amplitude.sum(dim=0) + EPS)
+        _estimated_sources = ratio * _mixture
+        norm = max(1, torch.abs(_mixture).max() / 10)
+        _estimated_sources = norm * update_em(_mixture / norm, _estimated_sources / norm, iteration=2)
+        reference.append(_estimated_sources)
+    
+    reference = torch.stack(reference, dim=0)
+    end = time.perf_counter()
+    print("update_em: {:.3f}[sec]".format(end - start))
+
+    for chunk_size, n_threads in [(None, 1), (64, 1), (64, 4)]:
+        start = time.perf_counter()
+        estimated_sources = multichannel_wiener_filter(mixture, estimated_sources_amplitude, iteration=2, chunk_size=chunk_size, n_threads=n_threads)
+        end = time.perf_counter()
+        error = torch.abs(estimated_sources - reference).max() / torch.abs(reference).max()
+        print("chunk_size={}, n_threads={}: {:.3f}[sec], relative error: {:.3e}".format(chunk_size, n_threads, end - start, error.item()))
+
 if __name__ == '__main__':
     import os
+    import time
 
     import torchaudio
+
+    _test_multichannel_wiener_filter()
+    print()
     
     os.makedirs("data/frequency_mask", exist_ok=True)
     
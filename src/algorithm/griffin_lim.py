@@ -5,6 +5,8 @@ import torch.nn as nn
 
 from utils.utils_audio import build_window
 
+EPS = 1e-12
+
 class GriffinLim(nn.Module):
     def __init__(self, fft_size, hop_size=None, window_fn='hann'):
         super().__init__()
@@ -16,16 +18,44 @@ class GriffinLim(nn.Module):
 
         window = build_window(fft_size, window_fn=window_fn)
         self.window = nn.Parameter(window, requires_grad=False)
+
+        self.momentum = 0
     
-    def forward(self, amplitude, phase=None, iteration=10):
+    def forward(self, amplitude, phase=None, iteration=10, tol=None):
         """
             Args:
-                amplitude (n_bins, n_frames)
+                amplitude (n_bins, n_frames) or (*, n_bins, n_frames): All channels are processed by one batched STFT.
+                phase (n_bins, n_frames) or (*, n_bins, n_frames): Initial phase for warm start. If None, random phase is used.
+                iteration <int>: Max number of iterations
+                tol <float>: Iteration stops when relative improvement of spectral convergence is less than `tol` for all channels. If None, `iteration` times are run.
             Returns:
-                phase (n_bins, n_frames): Reconstructed phase
+                phase (n_bins, n_frames) or (*, n_bins, n_frames): Reconstructed phase
         """
+        amplitude, channels = self._flatten(amplitude)
+
+        if phase is None:
+            phase = self._init_phase(amplitude)
+        else:
+            phase, _ = self._flatten(phase)
+        
+        spectrogram = torch.exp(1j * phase) # Unit phasor
+        previous_spectrogram = None
+        spectral_convergence = None
+
         for idx in range(iteration):
-            phase = self.update(amplitude, phase)
+            spectrogram, previous_spectrogram, _spectral_convergence = self._update(amplitude, spectrogram, previous_spectrogram)
+
+            if tol is not None:
+                if spectral_convergence is not None:
+                    improvement = (spectral_convergence - _spectral_convergence) / (spectral_convergence + EPS)
+
+                    if torch.all(improvement < tol):
+                        break
+                
+                spectral_convergence = _spectral_convergence
+        
+        phase = torch.angle(spectrogram)
+        phase = self._unflatten(phase, channels)
         
         return phase
     
@@ -36,47 +66,131 @@ class GriffinLim(nn.Module):
             Returns:
                 phase (n_bins, n_frames) or (in_channels, n_bins, n_frames) or (in_channels, n_bins, n_frames)
         """
+        amplitude, channels = self._flatten(amplitude)
+        
+        if phase is None:
+            phase = self._init_phase(amplitude)
+        else:
+            phase, _ = self._flatten(phase)
+        
+        spectrogram, _, _ = self._update(amplitude, torch.exp(1j * phase))
+        phase = torch.angle(spectrogram)
+        phase = self._unflatten(phase, channels)
+        
+        return phase
+    
+    def _update(self, amplitude, spectrogram, previous_spectrogram=None):
+        """
+        Args:
+            amplitude (batch_size, n_bins, n_frames)
+            spectrogram (batch_size, n_bins, n_frames): Complex unit phasor
+            previous_spectrogram (batch_size, n_bins, n_frames): Projected spectrogram at previous iteration, used for momentum.
+        Returns:
+            spectrogram (batch_size, n_bins, n_frames): Updated complex unit phasor
+            projected_spectrogram (batch_size, n_bins, n_frames): Consistent spectrogram
+            spectral_convergence (batch_size,): || amplitude - |projected_spectrogram| || / || amplitude ||
+        """
         fft_size, hop_size = self.fft_size, self.hop_size
         window = self.window
 
-        if torch.is_complex(amplitude):
-            raise ValueError("amplitude is NOT expected complex tensor.")
+        signal = torch.istft(amplitude * spectrogram, fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=False)
+        projected_spectrogram = torch.stft(signal, fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=True)
+        projected_amplitude = torch.abs(projected_spectrogram)
+
+        spectral_convergence = torch.linalg.vector_norm(amplitude - projected_amplitude, dim=(-2, -1)) / (torch.linalg.vector_norm(amplitude, dim=(-2, -1)) + EPS)
+
+        if self.momentum > 0 and previous_spectrogram is not None:
+            spectrogram = projected_spectrogram - (self.momentum / (1 + self.momentum)) * previous_spectrogram
+            spectrogram = spectrogram / (torch.abs(spectrogram) + EPS)
+        else:
+            spectrogram = projected_spectrogram / (projected_amplitude + EPS)
+
+        return spectrogram, projected_spectrogram, spectral_convergence
+    
+    def _init_phase(self, amplitude):
+        sampler = torch.distributions.uniform.Uniform(0, 2*math.pi)
+        phase = sampler.sample(amplitude.size()).to(amplitude.device)
+
+        return phase
+    
+    def _flatten(self, input):
+        if torch.is_complex(input):
+            raise ValueError("Input is NOT expected complex tensor.")
         
-        n_dims = amplitude.dim()
+        n_dims = input.dim()
 
         if n_dims == 2:
             channels = None
-            amplitude = amplitude.unsqueeze(dim=0)
+            input = input.unsqueeze(dim=0)
         elif n_dims > 2:
-            channels = amplitude.size()[:-2]
-            amplitude = amplitude.view(-1, *amplitude.size()[-2:])
+            channels = input.size()[:-2]
+            input = input.reshape(-1, *input.size()[-2:])
         else:
             raise ValueError("Invalid shape of tensor.")
         
-        if phase is None:
-            sampler = torch.distributions.uniform.Uniform(0, 2*math.pi)
-            phase = sampler.sample(amplitude.size()).to(amplitude.device)
-        
-        spectrogram = amplitude * torch.exp(1j * phase)
-
-        signal = torch.istft(spectrogram, fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=False)
-        spectrogram = torch.stft(signal, fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=True)
-        phase = torch.angle(spectrogram)
-
-        if n_dims == 2:
-            phase = phase.squeeze(dim=0)
-        elif n_dims > 2:
-            phase = phase.view(*channels, *phase.size()[-2:])
+        return input, channels
+    
+    def _unflatten(self, input, channels):
+        if channels is None:
+            input = input.squeeze(dim=0)
         else:
-            raise ValueError("Invalid shape of tensor.")
+            input = input.view(*channels, *input.size()[-2:])
         
-        return phase
+        return input
 
+"""
+    Fast Griffin-Lim algorithm
+    See "A fast Griffin-Lim algorithm"
+    https://ieeexplore.ieee.org/document/6701851
+"""
 class FastGriffinLim(GriffinLim):
-    def __init__(self, fft_size, hop_size=None, window_fn='hann'):
+    def __init__(self, fft_size, hop_size=None, window_fn='hann', momentum=0.99):
         super().__init__(fft_size, hop_size=hop_size, window_fn=window_fn)
 
-        raise NotImplementedError("Coming soon.")
+        self.momentum = momentum
+
+def _test_fast_griffin_lim():
+    import time
+
+    torch.manual_seed(111)
+
+    n_sources = 4
+    T = 16000 * 2
+    fft_size, hop_size = 1024, 256
+    window = build_window(fft_size, window_fn='hann')
+
+    # Harmonic signals with vibrato
+    t = torch.arange(T) / 16000
+    f0 = 110 * torch.arange(1, n_sources + 1).unsqueeze(dim=1) * (1 + 0.02 * torch.sin(2 * math.pi * 5 * t))
+    phase = 2 * math.pi * torch.cumsum(f0, dim=1) / 16000
+    signal = sum([torch.sin(order * phase) / order for order in range(1, 6)]) + 0.01 * torch.randn(n_sources, T)
+
+    spectrogram = torch.stft(signal, fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=True)
+    amplitude = torch.abs(spectrogram)
+
+    def spectral_convergence(phase):
+        estimated_signal = torch.istft(amplitude * torch.exp(1j * phase), fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=False)
+        estimated_amplitude = torch.abs(torch.stft(estimated_signal, fft_size, hop_length=hop_size, window=window, onesided=True, return_complex=True))
+        return (torch.linalg.vector_norm(amplitude - estimated_amplitude) / torch.linalg.vector_norm(amplitude)).item()
+
+    initial_phase = 2 * math.pi * torch.rand(amplitude.size())
+
+    griffin_lim = GriffinLim(fft_size, hop_size=hop_size, window_fn='hann')
+    fast_griffin_lim = FastGriffinLim(fft_size, hop_size=hop_size, window_fn='hann')
+
+    for iteration in [10, 25, 50, 100]:
+        phase = griffin_lim(amplitude, phase=initial_phase, iteration=iteration)
+        fast_phase = fast_griffin_lim(amplitude, phase=initial_phase, iteration=iteration)
+        print("iteration {}: spectral convergence {:.4f} (Griffin-Lim), {:.4f} (fast Griffin-Lim)".format(iteration, spectral_convergence(phase), spectral_convergence(fast_phase)))
+    
+    start = time.perf_counter()
+    phase = fast_griffin_lim(amplitude, phase=initial_phase, iteration=500, tol=1e-3)
+    end = time.perf_counter()
+    print("Early stopping: spectral convergence {:.4f}, {:.3f}[sec]".format(spectral_convergence(phase), end - start))
+
+    # Warm start from phase of previous result
+    phase = fast_griffin_lim(amplitude, phase=phase, iteration=10)
+    print("Warm start: spectral convergence {:.4f}".format(spectral_convergence(phase)))
 
 def _test():
     target_sr = 16000
@@ -119,4 +233,5 @@ if __name__ == '__main__':
     os.makedirs("data/GriffinLim", exist_ok=True)
     torch.manual_seed(111)
     
+    _test_fast_griffin_lim()
     _test()
\ No newline at end of file
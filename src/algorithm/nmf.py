@@ -29,64 +29,178 @@ class NMF:
         
         self.loss = []
     
-    def update(self, target, iteration=100):
+    def update(self, target, iteration=100, base=None, tol=None, check_interval=10):
+        """
+        Args:
+            target (F_bin, T_bin) or (batch_size, F_bin, T_bin): Nonnegative matrices, which are factorized at once.
+            iteration <int>: Max number of iterations
+            base (F_bin, K) or (batch_size, F_bin, K): Pre-trained bases. If given, bases are fixed and only activations are updated.
+            tol <float>: Iteration stops when relative decrease of loss is less than `tol` for all matrices. If None, `iteration` times are run.
+            check_interval <int>: Loss is evaluated every `check_interval` iterations, because it requires synchronization.
+                `self.loss` records the initial loss and one loss per `check_interval` iterations (and the last iteration), not one per iteration.
+        """
         K = self.K
         self.target = target
-        F_bin, T_bin = target.size()
+        F_bin, T_bin = target.size()[-2:]
+        batch_size = target.size()[:-2]
 
-        self.base = torch.rand(F_bin, K, dtype=torch.float) + 1
-        self.activation = torch.rand(K, T_bin, dtype=torch.float) + 1
+        if base is None:
+            self.base = torch.rand(*batch_size, F_bin, K, dtype=target.dtype, device=target.device) + 1
+            self.fix_base = False
+        else:
+            assert base.size(-1) == K, "base.size(-1) is expected {}, given {}".format(K, base.size(-1))
+            self.base = base.to(target.device, target.dtype)
+            self.fix_base = True
+        
+        self.activation = torch.rand(*batch_size, K, T_bin, dtype=target.dtype, device=target.device) + 1
         self.reconstruction = torch.matmul(self.base, self.activation)
 
-        loss = self.criterion(self.reconstruction, target)
-        self.loss.append(loss.sum().item())
+        loss = self.compute_loss()
+        self.loss.append(loss.tolist())
+        self.n_iterations = 0
 
         for idx in range(iteration):
             self.update_once()
-            loss = self.criterion(self.reconstruction, target)
-            self.loss.append(loss.sum().item())
+            self.n_iterations = idx + 1
+
+            if (idx + 1) % check_interval == 0 or idx == iteration - 1:
+                previous_loss = loss
+                loss = self.compute_loss()
+                self.loss.append(loss.tolist())
+
+                if tol is not None:
+                    improvement = (previous_loss - loss) / (torch.abs(previous_loss) + self.eps)
+
+                    if torch.all(improvement < tol):
+                        break
+    
+    def compute_loss(self):
+        """
+        Returns:
+            loss () or (batch_size,)
+        """
+        loss = self.criterion(self.reconstruction, self.target)
+        loss = loss.sum(dim=(-2, -1))
+
+        return loss
         
     def update_once(self):
+        """
+        Each update returns reconstruction by updated bases and activations, which is reused by the next update and `compute_loss`.
+        """
         if self.metric == 'EUC':
-            self.update_euc()
+            self.reconstruction = self.update_euc()
         elif self.metric == 'KL':
-            self.update_kl()
+            self.reconstruction = self.update_kl()
         elif self.metric == 'IS':
-            self.update_is()
+            self.reconstruction = self.update_is()
         else:
             raise NotImplementedError("Not support {}".format(self.metric))
 
-        self.reconstruction = torch.matmul(self.base, self.activation)
-
     def update_euc(self):
         eps = self.eps
         target = self.target
-        base, activation, reconstruction = self.base, self.activation, self.reconstruction
-        base_transpose, activation_transpose = base.permute(1,0), activation.permute(1,0)
+        base, activation = self.base, self.activation
 
-        self.base = base * (torch.matmul(target, activation_transpose) / (torch.matmul(reconstruction, activation_transpose) + eps))
+        if not self.fix_base:
+            reconstruction = self.reconstruction
+            activation_transpose = activation.transpose(-2, -1)
+            self.base = base * (torch.matmul(target, activation_transpose) / (torch.matmul(reconstruction, activation_transpose) + eps))
+            base = self.base
+            reconstruction = torch.matmul(base, activation)
+        else:
+            reconstruction = self.reconstruction
+        
+        base_transpose = base.transpose(-2, -1)
         self.activation = activation * (torch.matmul(base_transpose, target) / (torch.matmul(base_transpose, reconstruction) + eps))
+
+        reconstruction = torch.matmul(base, self.activation)
+
+        return reconstruction
     
     def update_kl(self):
         eps = self.eps
         target = self.target
-        base, activation, reconstruction = self.base, self.activation, self.reconstruction
-        base_transpose, activation_transpose = base.permute(1,0), activation.permute(1,0)
-        division = target / (reconstruction + eps)
+        base, activation = self.base, self.activation
+
+        if not self.fix_base:
+            reconstruction = self.reconstruction
+            activation_transpose = activation.transpose(-2, -1)
+            division = target / (reconstruction + eps)
+            self.base = base * (torch.matmul(division, activation_transpose) / (activation_transpose.sum(dim=-2, keepdim=True) + eps))
+            base = self.base
+            reconstruction = torch.matmul(base, activation)
+        else:
+            reconstruction = self.reconstruction
         
-        self.base = base * (torch.matmul(division, activation_transpose) / (activation_transpose.sum(dim=0, keepdim=True) + eps))
-        self.activation = activation * (torch.matmul(base_transpose, division) / (base_transpose.sum(dim=1, keepdim=True) + eps))
+        base_transpose = base.transpose(-2, -1)
+        division = target / (reconstruction + eps)
+        self.activation = activation * (torch.matmul(base_transpose, division) / (base_transpose.sum(dim=-1, keepdim=True) + eps))
+
+        reconstruction = torch.matmul(base, self.activation)
+
+        return reconstruction
     
     def update_is(self):
         eps = self.eps
         target = self.target
-        base, activation, reconstruction = self.base, self.activation, self.reconstruction
-        base_transpose, activation_transpose = base.permute(1,0), activation.permute(1,0)
-        division, reconstruction_inverse = target / (reconstruction + eps)**2, 1 / (reconstruction + eps)
+        base, activation = self.base, self.activation
+
+        if not self.fix_base:
+            reconstruction = self.reconstruction
+            activation_transpose = activation.transpose(-2, -1)
+            division, reconstruction_inverse = target / (reconstruction + eps)**2, 1 / (reconstruction + eps)
+            self.base = base * torch.sqrt(torch.matmul(division, activation_transpose) / (torch.matmul(reconstruction_inverse, activation_transpose) + eps))
+            base = self.base
+            reconstruction = torch.matmul(base, activation)
+        else:
+            reconstruction = self.reconstruction
         
-        self.base = base * torch.sqrt(torch.matmul(division, activation_transpose) / (torch.matmul(reconstruction_inverse, activation_transpose) + eps))
+        base_transpose = base.transpose(-2, -1)
+        division, reconstruction_inverse = target / (reconstruction + eps)**2, 1 / (reconstruction + eps)
         self.activation = activation * torch.sqrt(torch.matmul(base_transpose, division) / (torch.matmul(base_transpose, reconstruction_inverse) + eps))
 
+        reconstruction = torch.matmul(base, self.activation)
+
+        return reconstruction
+
+def _test_batch_nmf(metric='EUC'):
+    import time
+
+    torch.manual_seed(111)
+
+    batch_size, F_bin, T_bin = 32, 257, 200
+    K = 8
+    iteration = 200
+
+    base = torch.rand(batch_size, F_bin, K)
+    activation = torch.rand(batch_size, K, T_bin)
+    target = torch.matmul(base, activation)
+
+    start = time.perf_counter()
+    for batch_idx in range(batch_size):
+        nmf = NMF(K, metric=metric)
+        nmf.update(target[batch_idx], iteration=iteration, check_interval=1)
+    end = time.perf_counter()
+    print("Loop over batch: {:.3f}[sec], loss {:.3f}".format(end - start, nmf.loss[-1]))
+
+    start = time.perf_counter()
+    nmf = NMF(K, metric=metric)
+    nmf.update(target, iteration=iteration)
+    end = time.perf_counter()
+    print("Batch: {:.3f}[sec], loss {:.3f}".format(end - start, nmf.loss[-1][-1]))
+
+    start = time.perf_counter()
+    nmf = NMF(K, metric=metric)
+    nmf.update(target, iteration=iteration, tol=1e-2)
+    end = time.perf_counter()
+    print("Batch (tol=1e-2): {:.3f}[sec], {} iterations, loss {:.3f}".format(end - start, nmf.n_iterations, nmf.loss[-1][-1]))
+
+    # Supervised: bases are fixed.
+    nmf = NMF(K, metric=metric)
+    nmf.update(target, iteration=iteration, base=base)
+    print("Fixed bases: loss {:.3f}, bases unchanged: {}".format(nmf.loss[-1][-1], torch.equal(nmf.base, base)))
+
 def _test(metric='EUC'):
     torch.manual_seed(111)
 
@@ -166,6 +280,11 @@ if __name__ == '__main__':
     os.makedirs('data/NMF/KL', exist_ok=True)
     os.makedirs('data/NMF/IS', exist_ok=True)
 
+    for metric in __metrics__:
+        print("="*10, metric, "="*10)
+        _test_batch_nmf(metric=metric)
+        print()
+
     _test(metric='EUC')
     _test(metric='KL')
     _test(metric='IS')
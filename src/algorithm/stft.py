@@ -5,25 +5,56 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from utils.utils_audio import build_Fourier_bases, build_window, build_optimal_window
+from utils.utils_precision import autocast_fp32
 
 class BatchSTFT(nn.Module):
-    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False):
+    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False, trainable=False):
+        """
+        Args:
+            trainable <bool>: If True, STFT is computed by convolution with Fourier bases, which are trainable. Otherwise, FFT is used and bases are built only when `get_bases()` is called.
+        """
         super().__init__()
         
         if hop_size is None:
             hop_size = fft_size//2
         
         self.fft_size, self.hop_size = fft_size, hop_size
+        self.normalize = normalize
+        self.trainable = trainable
     
         window = build_window(fft_size, window_fn=window_fn) # (fft_size,)
 
-        cos_bases, sin_bases = build_Fourier_bases(fft_size, normalize=normalize)
+        if self.trainable:
+            bases = self._build_bases(window)
+            self.bases = nn.Parameter(bases, requires_grad=True)
+        else:
+            self.register_buffer('window', window)
+            self._bases = None
+    
+    def _build_bases(self, window):
+        fft_size = self.fft_size
+
+        cos_bases, sin_bases = build_Fourier_bases(fft_size, normalize=self.normalize)
         cos_bases, sin_bases = cos_bases[:fft_size//2+1] * window, - sin_bases[:fft_size//2+1] * window
         
         bases = torch.cat([cos_bases, sin_bases], dim=0)
+
+        return bases.unsqueeze(dim=1)
+    
+    def get_bases(self):
+        """
+        Returns:
+            bases (2 * n_bins, 1, fft_size): Windowed Fourier bases used in convolution.
+        """
+        if self.trainable:
+            return self.bases
+        
+        if self._bases is None or self._bases.device != self.window.device:
+            self._bases = self._build_bases(self.window)
         
-        self.bases = nn.Parameter(bases.unsqueeze(dim=1), requires_grad=False)
+        return self._bases
         
+    @autocast_fp32
     def forward(self, input):
         """
         Args:
@@ -41,36 +72,71 @@ class BatchSTFT(nn.Module):
         padding_right = padding - padding_left
         
         input = F.pad(input, (padding_left, padding_right))
-        input = input.unsqueeze(dim=1)
-        output = F.conv1d(input, self.bases, stride=self.hop_size)
-        real, imag = output[:, :n_bins], output[:, n_bins:]
-        output = torch.cat([real.unsqueeze(dim=3), imag.unsqueeze(dim=3)], dim=3)
+
+        if self.trainable:
+            input = input.unsqueeze(dim=1)
+            output = F.conv1d(input, self.bases, stride=self.hop_size)
+            real, imag = output[:, :n_bins], output[:, n_bins:]
+            output = torch.cat([real.unsqueeze(dim=3), imag.unsqueeze(dim=3)], dim=3)
+        else:
+            output = torch.stft(input, n_fft=fft_size, hop_length=hop_size, window=self.window, center=False, normalized=self.normalize, onesided=True, return_complex=True) # (batch_size, n_bins, n_frames)
+            output = torch.view_as_real(output)
         
         return output
 
 class BatchInvSTFT(nn.Module):
-    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False):
+    def __init__(self, fft_size, hop_size=None, window_fn='hann', normalize=False, trainable=False):
+        """
+        Args:
+            trainable <bool>: If True, inverse STFT is computed by transposed convolution with Fourier bases, which are trainable. Otherwise, inverse FFT is used and bases are built only when `get_bases()` is called.
+        """
         super().__init__()
         
         if hop_size is None:
             hop_size = fft_size//2
         
         self.fft_size, self.hop_size = fft_size, hop_size
+        self.normalize = normalize
+        self.trainable = trainable
 
         window = build_window(fft_size, window_fn=window_fn) # (fft_size,)
         optimal_window = build_optimal_window(window, hop_size=hop_size)
 
-        cos_bases, sin_bases = build_Fourier_bases(fft_size, normalize=normalize)
+        if self.trainable:
+            bases = self._build_bases(optimal_window)
+            self.bases = nn.Parameter(bases, requires_grad=True)
+        else:
+            self.register_buffer('optimal_window', optimal_window)
+            self._bases = None
+    
+    def _build_bases(self, optimal_window):
+        fft_size = self.fft_size
+
+        cos_bases, sin_bases = build_Fourier_bases(fft_size, normalize=self.normalize)
         cos_bases, sin_bases = cos_bases[:fft_size//2+1] * optimal_window, - sin_bases[:fft_size//2+1] * optimal_window
         
-        if not normalize:
+        if not self.normalize:
             cos_bases = cos_bases / fft_size
             sin_bases = sin_bases / fft_size
         
         bases = torch.cat([cos_bases, sin_bases], dim=0)
+
+        return bases.unsqueeze(dim=1)
+    
+    def get_bases(self):
+        """
+        Returns:
+            bases (2 * n_bins, 1, fft_size): Windowed Fourier bases used in transposed convolution.
+        """
+        if self.trainable:
+            return self.bases
         
-        self.bases = nn.Parameter(bases.unsqueeze(dim=1), requires_grad=False)
+        if self._bases is None or self._bases.device != self.optimal_window.device:
+            self._bases = self._build_bases(self.optimal_window)
         
+        return self._bases
+        
+    @autocast_fp32
     def forward(self, input, T=None):
         """
         Args:
@@ -87,17 +153,62 @@ class BatchInvSTFT(nn.Module):
         padding_left = padding // 2
         padding_right = padding - padding_left
         
-        real, imag = input[...,0], input[...,1]
-        input = torch.cat([real, imag, real[:,1:-1], imag[:,1:-1]], dim=1)
-        bases = torch.cat([self.bases, self.bases[1:fft_size//2], self.bases[-fft_size//2:-1]], dim=0)
+        if self.trainable:
+            real, imag = input[...,0], input[...,1]
+            input = torch.cat([real, imag, real[:,1:-1], imag[:,1:-1]], dim=1)
+            bases = torch.cat([self.bases, self.bases[1:fft_size//2], self.bases[-fft_size//2:-1]], dim=0)
+            
+            output = F.conv_transpose1d(input, bases, stride=self.hop_size)
+        else:
+            n_frames = input.size(2)
+            norm = 'ortho' if self.normalize else 'backward'
+
+            input = torch.view_as_complex(input.contiguous()) # (batch_size, n_bins, n_frames)
+            frames = torch.fft.irfft(input, n=fft_size, dim=1, norm=norm) # (batch_size, fft_size, n_frames)
+            frames = self.optimal_window.unsqueeze(dim=1) * frames
+            output = F.fold(frames, output_size=(1, (n_frames - 1) * hop_size + fft_size), kernel_size=(1, fft_size), stride=(1, hop_size)) # Overlap-add
+            output = output.squeeze(dim=2) # (batch_size, 1, (n_frames - 1) * hop_size + fft_size)
         
-        output = F.conv_transpose1d(input, bases, stride=self.hop_size)
         output = F.pad(output, (-padding_left, -padding_right))
         output = output.squeeze(dim=1)
         
         return output
 
+def _test_batch_stft():
+    import time
+
+    torch.manual_seed(111)
+
+    batch_size = 4
+    T = 44100 * 4
+    fft_size, hop_size = 4096, 1024
+    window_fn = 'hann'
+
+    input = torch.randn((batch_size, T), dtype=torch.float)
+
+    for normalize in [False, True]:
+        output = {}
+
+        for trainable in [True, False]:
+            stft = BatchSTFT(fft_size=fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, trainable=trainable)
+            istft = BatchInvSTFT(fft_size=fft_size, hop_size=hop_size, window_fn=window_fn, normalize=normalize, trainable=trainable)
+
+            start = time.perf_counter()
+            spectrogram = stft(input)
+            reconstructed = istft(spectrogram, T=T)
+            end = time.perf_counter()
+
+            output[trainable] = spectrogram, reconstructed
+            print("normalize={}, trainable={}: {:.3f}[sec]".format(normalize, trainable, end - start))
+
+        (spectrogram_conv, reconstructed_conv), (spectrogram_fft, reconstructed_fft) = output[True], output[False]
+        scale = torch.abs(spectrogram_conv).max()
+        print(spectrogram_fft.size(), torch.allclose(spectrogram_conv / scale, spectrogram_fft / scale, atol=1e-5))
+        print(reconstructed_fft.size(), torch.allclose(reconstructed_conv, reconstructed_fft, atol=1e-4), torch.allclose(input, reconstructed_fft, atol=1e-4))
+
 if __name__ == '__main__':
+    _test_batch_stft()
+
     import os
     import matplotlib.pyplot as plt
     from matplotlib.colors import Normalize
@@ -191,29 +191,34 @@ class MultiDilatedConv1d(nn.Module):
     def forward(self, input):
         kernel_size = self.kernel_size
 
-        weights = torch.split(self.weights, self.sections, dim=1)
         if self.bias:
-            biases = torch.split(self.biases, self.out_channels, dim=0)
+            # Biases of all dilations are added only once.
+            bias = self.biases.view(len(self.sections), self.out_channels).sum(dim=0)
         else:
-            biases = [None] * len(weights)
+            bias = None
 
+        weights = torch.split(self.weights, self.sections, dim=1)
         input = torch.split(input, self.sections, dim=1)
-        output = 0
+        output = None
 
         for idx in range(len(self.sections)):
-            dilation = 2**idx
+            dilation = self.dilations[idx]
             padding = (kernel_size - 1) * dilation
             padding_left = padding // 2
             padding_right = padding - padding_left
 
             x = F.pad(input[idx], (padding_left, padding_right))
-            output = output + F.conv1d(x, weight=weights[idx], bias=biases[idx], stride=1, dilation=dilation)
+
+            if output is None:
+                output = F.conv1d(x, weight=weights[idx], bias=bias, stride=1, dilation=dilation)
+            else:
+                output += F.conv1d(x, weight=weights[idx], bias=None, stride=1, dilation=dilation)
 
         return output
     
     def _reset_parameters(self):
         nn.modules.conv.init.kaiming_uniform_(self.weights, a=math.sqrt(5))
-        if self.bias is not None:
+        if self.bias:
             fan_in, _ = nn.modules.conv.init._calculate_fan_in_and_fan_out(self.weights)
             bound = 1 / math.sqrt(fan_in)
             nn.modules.conv.init.uniform_(self.biases, -bound, bound)
@@ -278,14 +283,15 @@ class MultiDilatedConv2d(nn.Module):
     def forward(self, input):
         kernel_size = self.kernel_size
 
-        weights = torch.split(self.weights, self.sections, dim=1)
         if self.bias:
-            biases = torch.split(self.biases, self.out_channels, dim=0)
+            # Biases of all dilations are added only once.
+            bias = self.biases.view(len(self.sections), self.out_channels).sum(dim=0)
         else:
-            biases = [None] * len(weights)
+            bias = None
 
+        weights = torch.split(self.weights, self.sections, dim=1)
         input = torch.split(input, self.sections, dim=1)
-        output = 0
+        output = None
 
         for idx in range(len(self.sections)):
             dilation = self.dilations[idx]
@@ -297,13 +303,17 @@ class MultiDilatedConv2d(nn.Module):
             padding_right = padding_width - padding_left
 
             x = F.pad(input[idx], (padding_left, padding_right, padding_up, padding_bottom))
-            output = output + F.conv2d(x, weight=weights[idx], bias=biases[idx], stride=(1,1), dilation=dilation)
+
+            if output is None:
+                output = F.conv2d(x, weight=weights[idx], bias=bias, stride=(1,1), dilation=dilation)
+            else:
+                output += F.conv2d(x, weight=weights[idx], bias=None, stride=(1,1), dilation=dilation)
 
         return output
     
     def _reset_parameters(self):
         nn.modules.conv.init.kaiming_uniform_(self.weights, a=math.sqrt(5))
-        if self.bias is not None:
+        if self.bias:
             fan_in, _ = nn.modules.conv.init._calculate_fan_in_and_fan_out(self.weights)
             bound = 1 / math.sqrt(fan_in)
             nn.modules.conv.init.uniform_(self.biases, -bound, bound)
@@ -359,9 +369,64 @@ def _test_multidilated_conv2d():
     print(input.size(), output.size())
     print()
 
+def _benchmark_multi_dilated_conv():
+    """
+    Per-dilation convolutions vs. one convolution with a packed (zero-dilated) kernel,
+    at the low band of D3Net for MUSDB18 (config/paper/vocals.yaml: num_features=32, growth_rate=16, depth=5).
+    """
+    torch.manual_seed(111)
+
+    batch_size = 1
+    num_features, growth_rate, depth = 32, 16, 5
+    kernel_size = 3
+    n_iters = 3
+
+    in_channels = [num_features] + [growth_rate] * (depth - 1)
+    conv2d = MultiDilatedConv2d(in_channels, growth_rate, kernel_size=kernel_size)
+    conv2d.eval()
+
+    # Place each section's kernel into a kernel of the largest dilation, spacing taps by its own dilation.
+    max_dilation = conv2d.dilations[-1][0]
+    packed_size = (kernel_size - 1) * max_dilation + 1
+    packed_weight = conv2d.weights.new_zeros(growth_rate, sum(in_channels), packed_size, packed_size)
+    center = ((kernel_size - 1) * max_dilation) // 2
+    start_channel = 0
+
+    for weight, (dilation, _) in zip(torch.split(conv2d.weights, conv2d.sections, dim=1), conv2d.dilations):
+        end_channel = start_channel + weight.size(1)
+        start = center - ((kernel_size - 1) * dilation) // 2
+        end = start + (kernel_size - 1) * dilation + 1
+        packed_weight[:, start_channel:end_channel, start:end:dilation, start:end:dilation] = weight
+        start_channel = end_channel
+
+    packed_bias = conv2d.biases.view(len(conv2d.sections), growth_rate).sum(dim=0)
+    padding = (center, packed_size - 1 - center, center, packed_size - 1 - center)
+
+    def _packed_conv2d(input):
+        return F.conv2d(F.pad(input, padding), weight=packed_weight, bias=packed_bias)
+
+    with torch.no_grad():
+        for H in [128, 32, 8]:
+            input = torch.randn(batch_size, sum(in_channels), H, H)
+            output_per_dilation, output_packed = conv2d(input), _packed_conv2d(input)
+
+            elapsed = {}
+
+            for name, fn in [('per-dilation', conv2d), ('packed', _packed_conv2d)]:
+                start_time = time.perf_counter()
+                for _ in range(n_iters):
+                    fn(input)
+                elapsed[name] = (time.perf_counter() - start_time) / n_iters
+
+            print("{}x{}: per-dilation {:.2f}ms, packed {:.2f}ms, allclose={}".format(H, H, 1000 * elapsed['per-dilation'], 1000 * elapsed['packed'], torch.allclose(output_per_dilation, output_packed, atol=1e-5)))
+
 if __name__ == '__main__':
+    import time
+
     _test_multidilated_conv1d()
     print()
 
     _test_multidilated_conv2d()
-    
+    print()
+
+    _benchmark_multi_dilated_conv()
@@ -0,0 +1,266 @@
+import itertools
+
+import torch
+
+from criterion.sdr import sisdr
+
+FILTER_LENGTH = 512
+EPS = 1e-12
+
+"""
+BSS-eval (v3) in batch, which is equivalent to `mir_eval.separation.bss_eval_sources`.
+See "Performance measurement in blind audio source separation"
+https://ieeexplore.ieee.org/document/1643671
+"""
+
+def bss_eval_sources(reference, estimated, compute_permutation=True, filter_length=FILTER_LENGTH):
+    """
+    Args:
+        reference (batch_size, n_sources, T): Reference sources
+        estimated (batch_size, n_sources, T): Estimated sources
+        compute_permutation <bool>: If True, estimated sources are permuted so that mean SIR is maximized like mir_eval.
+        filter_length <int>: Length of distortion filter
+    Returns:
+        sdr (batch_size, n_sources): SDR in order of reference
+        sir (batch_size, n_sources): SIR in order of reference
+        sar (batch_size, n_sources): SAR in order of reference
+        pattern (batch_size, n_sources) <torch.LongTensor>: pattern[:, j] is index of estimated source for j-th reference.
+    """
+    assert reference.size() == estimated.size(), "reference and estimated are expected same size, but given {} and {}.".format(reference.size(), estimated.size())
+
+    batch_size, n_sources, _ = reference.size()
+
+    sdr, sir, sar = compute_pairwise_bss_eval(reference, estimated, filter_length=filter_length) # (batch_size, n_sources, n_sources)
+
+    if compute_permutation:
+        patterns = list(itertools.permutations(range(n_sources)))
+        patterns = torch.Tensor(patterns).long().to(sir.device)
+        possible_sir = sir[:, patterns, torch.arange(n_sources)].mean(dim=2) # (batch_size, P)
+        indices = torch.argmax(possible_sir, dim=1)
+        pattern = patterns[indices] # (batch_size, n_sources)
+    else:
+        pattern = torch.arange(n_sources, device=sir.device).expand(batch_size, n_sources)
+
+    pattern = pattern.contiguous()
+    sdr = _gather_pair(sdr, pattern)
+    sir = _gather_pair(sir, pattern)
+    sar = _gather_pair(sar, pattern)
+
+    return sdr, sir, sar, pattern.cpu()
+
+def bss_eval_improvement(mixture, reference, estimated, filter_length=FILTER_LENGTH):
+    """
+    SDR and SIR improvements over the mixture, which are what testers compute by two calls of `bss_eval_sources`.
+    Projections onto references are shared between the estimated sources and the mixture.
+    Args:
+        mixture (batch_size, T) or (batch_size, 1, T)
+        reference (batch_size, n_sources, T)
+        estimated (batch_size, n_sources, T)
+        filter_length <int>: Length of distortion filter
+    Returns:
+        sdr_improvement (batch_size, n_sources)
+        sir_improvement (batch_size, n_sources)
+        sar (batch_size, n_sources)
+        pattern (batch_size, n_sources) <torch.LongTensor>: pattern[:, j] is index of estimated source for j-th reference.
+    """
+    if mixture.dim() == 2:
+        mixture = mixture.unsqueeze(dim=1)
+
+    n_sources = reference.size(1)
+
+    input = torch.cat([estimated, mixture], dim=1)
+    sdr, sir, sar = compute_pairwise_bss_eval(reference, input, filter_length=filter_length) # (batch_size, n_sources + 1, n_sources)
+    sdr_mixture, sir_mixture = sdr[:, -1], sir[:, -1] # (batch_size, n_sources)
+    sdr, sir, sar = sdr[:, :-1], sir[:, :-1], sar[:, :-1]
+
+    patterns = list(itertools.permutations(range(n_sources)))
+    patterns = torch.Tensor(patterns).long().to(sir.device)
+    possible_sir = sir[:, patterns, torch.arange(n_sources)].mean(dim=2) # (batch_size, P)
+    indices = torch.argmax(possible_sir, dim=1)
+    pattern = patterns[indices]
+
+    sdr_improvement = _gather_pair(sdr, pattern) - sdr_mixture
+    sir_improvement = _gather_pair(sir, pattern) - sir_mixture
+    sar = _gather_pair(sar, pattern)
+
+    return sdr_improvement, sir_improvement, sar, pattern.cpu()
+
+def sisdr_improvement(mixture, reference, estimated, pattern=None, eps=EPS):
+    """
+    Args:
+        mixture (batch_size, T) or (batch_size, 1, T)
+        reference (batch_size, n_sources, T)
+        estimated (batch_size, n_sources, T)
+        pattern (batch_size, n_sources) <torch.LongTensor>: pattern[:, j] is index of estimated source for j-th reference. If None, permutation which maximizes mean SI-SDR is used.
+    Returns:
+        sisdr_improvement (batch_size, n_sources)
+    """
+    if mixture.dim() == 2:
+        mixture = mixture.unsqueeze(dim=1)
+
+    n_sources = reference.size(1)
+
+    if pattern is None:
+        pairwise_sisdr = sisdr(estimated.unsqueeze(dim=2), reference.unsqueeze(dim=1), eps=eps) # (batch_size, n_sources, n_sources)
+        patterns = list(itertools.permutations(range(n_sources)))
+        patterns = torch.Tensor(patterns).long().to(pairwise_sisdr.device)
+        possible_sisdr = pairwise_sisdr[:, patterns, torch.arange(n_sources)].mean(dim=2)
+        indices = torch.argmax(possible_sisdr, dim=1)
+        pattern = patterns[indices]
+
+    pattern = pattern.to(estimated.device)
+    estimated = torch.gather(estimated, 1, pattern.unsqueeze(dim=2).expand_as(estimated))
+    mixture = mixture.expand_as(reference)
+
+    return sisdr(estimated, reference, eps=eps) - sisdr(mixture, reference, eps=eps)
+
+def compute_pairwise_bss_eval(reference, estimated, filter_length=FILTER_LENGTH):
+    """
+    SDR, SIR and SAR of all pairs of estimated and reference sources.
+    Let P_j and P be orthogonal projections onto delayed versions of j-th reference and of all references.
+    Because both projections are nested and orthogonal, energies of every error term are given by quadratic forms of
+    Gram matrix of the references, which is computed and factorized only once per utterance.
+    Args:
+        reference (batch_size, n_sources, T)
+        estimated (batch_size, n_estimated, T)
+        filter_length <int>: Length of distortion filter
+    Returns:
+        sdr (batch_size, n_estimated, n_sources): sdr[:, i, j] is SDR of i-th estimated source for j-th reference.
+        sir (batch_size, n_estimated, n_sources)
+        sar (batch_size, n_estimated, n_sources)
+    """
+    batch_size, n_sources, T = reference.size()
+    n_estimated = estimated.size(1)
+    L = filter_length
+
+    reference, estimated = reference.double(), estimated.double()
+
+    n_fft = 2**int(torch.ceil(torch.log2(torch.tensor(T + L - 1, dtype=torch.double))).item())
+    reference_spectrum = torch.fft.rfft(reference, n=n_fft) # (batch_size, n_sources, n_bins)
+    estimated_spectrum = torch.fft.rfft(estimated, n=n_fft) # (batch_size, n_estimated, n_bins)
+
+    # Inner products between delayed versions of references
+    correlation = torch.fft.irfft(reference_spectrum.unsqueeze(dim=2) * reference_spectrum.conj().unsqueeze(dim=1), n=n_fft) # (batch_size, n_sources, n_sources, n_fft)
+    shift = torch.arange(L, device=reference.device)
+    lag = (shift.unsqueeze(dim=0) - shift.unsqueeze(dim=1)) % n_fft # (L, L)
+    G = correlation[..., lag] # (batch_size, n_sources, n_sources, L, L)
+
+    # Inner products between estimated sources and delayed versions of references
+    correlation = torch.fft.irfft(reference_spectrum.unsqueeze(dim=1) * estimated_spectrum.conj().unsqueeze(dim=2), n=n_fft) # (batch_size, n_estimated, n_sources, n_fft)
+    D = correlation[..., (- shift) % n_fft] # (batch_size, n_estimated, n_sources, L)
+
+    # Projection onto all references
+    G_all = G.permute(0, 1, 3, 2, 4).reshape(batch_size, n_sources * L, n_sources * L)
+    D_all = D.reshape(batch_size, n_estimated, n_sources * L).permute(0, 2, 1) # (batch_size, n_sources * L, n_estimated)
+    C_all = _solve(G_all, D_all)
+    energy_all = torch.sum(C_all * D_all, dim=1) # (batch_size, n_estimated)
+
+    # Projection onto each reference
+    G_each = torch.diagonal(G, dim1=1, dim2=2).permute(0, 3, 1, 2) # (batch_size, n_sources, L, L)
+    D_each = D.permute(0, 2, 3, 1) # (batch_size, n_sources, L, n_estimated)
+    C_each = _solve(G_each, D_each)
+    energy_each = torch.sum(C_each * D_each, dim=2).permute(0, 2, 1) # (batch_size, n_estimated, n_sources)
+
+    energy_estimated = torch.sum(estimated**2, dim=2) # (batch_size, n_estimated)
+    energy_all = energy_all.unsqueeze(dim=2)
+    energy_estimated = energy_estimated.unsqueeze(dim=2)
+
+    # Residuals of orthogonal projections, which are non-negative up to rounding error.
+    distortion = torch.clamp(energy_estimated - energy_each, min=0) # ||e_interf + e_artif||^2
+    interference = torch.clamp(energy_all - energy_each, min=0) # ||e_interf||^2
+    artifact = torch.clamp(energy_estimated - energy_all, min=0) # ||e_artif||^2
+
+    sdr = _safe_db(energy_each, distortion)
+    sir = _safe_db(energy_each, interference)
+    sar = _safe_db(energy_all.expand_as(energy_each), artifact.expand_as(energy_each))
+
+    return sdr, sir, sar
+
+def _solve(A, B):
+    try:
+        X = torch.linalg.solve(A, B)
+    except RuntimeError:
+        # Singular, e.g. silent reference
+        X = torch.linalg.lstsq(A, B).solution
+
+    return X
+
+def _safe_db(numerator, denominator):
+    db = 10 * torch.log10(numerator / denominator)
+    db = torch.where(denominator == 0, torch.full_like(db, float('inf')), db)
+
+    return db
+
+def _gather_pair(pairwise, pattern):
+    """
+    Args:
+        pairwise (batch_size, n_estimated, n_sources)
+        pattern (batch_size, n_sources): pattern[:, j] is index of estimated source for j-th reference.
+    Returns:
+        output (batch_size, n_sources): output[:, j] = pairwise[:, pattern[:, j], j]
+    """
+    output = torch.gather(pairwise, 1, pattern.unsqueeze(dim=1)).squeeze(dim=1)
+
+    return output
+
+def _test_bss_eval_sources():
+    torch.manual_seed(111)
+
+    batch_size, n_sources, T = 4, 3, 16000
+    reference = torch.randn(batch_size, n_sources, T)
+    mixing = torch.eye(n_sources) + 0.2 * torch.rand(n_sources, n_sources)
+    estimated = torch.matmul(mixing, reference) + 0.1 * torch.randn(batch_size, n_sources, T)
+    estimated = estimated[:, torch.randperm(n_sources)]
+
+    start = time.perf_counter()
+    sdr, sir, sar, pattern = bss_eval_sources(reference, estimated)
+    end = time.perf_counter()
+    print("torch: {:.3f}[sec]".format(end - start))
+
+    start = time.perf_counter()
+    results = [_bss_eval_sources(reference[batch_idx].numpy(), estimated[batch_idx].numpy()) for batch_idx in range(batch_size)]
+    end = time.perf_counter()
+    print("mir_eval: {:.3f}[sec]".format(end - start))
+
+    for idx, name in enumerate(['SDR', 'SIR', 'SAR']):
+        target = torch.Tensor(np.stack([result[idx] for result in results], axis=0)).double()
+        print(name, torch.abs((sdr, sir, sar)[idx] - target).max().item())
+
+    print(torch.equal(pattern, torch.Tensor(np.stack([result[3] for result in results], axis=0)).long()))
+
+def _test_bss_eval_improvement():
+    torch.manual_seed(111)
+
+    batch_size, n_sources, T = 4, 2, 16000
+    reference = torch.randn(batch_size, n_sources, T)
+    mixture = reference.sum(dim=1)
+    estimated = reference + 0.3 * torch.randn(batch_size, n_sources, T)
+
+    sdr_improvement, sir_improvement, sar, pattern = bss_eval_improvement(mixture, reference, estimated)
+
+    for batch_idx in range(batch_size):
+        result_estimated = _bss_eval_sources(reference[batch_idx].numpy(), estimated[batch_idx].numpy())
+        result_mixed = _bss_eval_sources(reference[batch_idx].numpy(), np.tile(mixture[batch_idx].numpy(), (n_sources, 1)))
+        print(
+            abs(sdr_improvement[batch_idx].mean().item() - np.mean(result_estimated[0] - result_mixed[0])),
+            abs(sir_improvement[batch_idx].mean().item() - np.mean(result_estimated[1] - result_mixed[1])),
+            abs(sar[batch_idx].mean().item() - np.mean(result_estimated[2]))
+        )
+
+    print(sisdr_improvement(mixture, reference, estimated))
+
+if __name__ == '__main__':
+    import time
+    import warnings
+
+    import numpy as np
+    from mir_eval.separation import bss_eval_sources as _bss_eval_sources
+
+    warnings.simplefilter('ignore', FutureWarning)
+
+    print('='*10, "BSS-eval", '='*10)
+    _test_bss_eval_sources()
+    print()
+
+    print('='*10, "BSS-eval improvement", '='*10)
+    _test_bss_eval_improvement()
@@ -1,13 +1,183 @@
 import torch
 import torch.nn as nn
 
+from criterion.pit import hungarian_pit
+
 """
 "Many-Speakers Single Channel Speech Separation with Optimal Permutation Training"
+See https://arxiv.org/abs/2104.08955
 """
 
+def hungarian(cost, maximize=False, backend=None):
+    """
+    Solve linear assignment problems by Hungarian algorithm.
+    Args:
+        cost (batch_size, n_sources, n_sources): cost[:, i, j] is cost of assigning i to j.
+        maximize <bool>: If True, total cost is maximized.
+        backend <str>: 'scipy' or 'torch'. If None, 'scipy' is used when available, otherwise 'torch'.
+    Returns:
+        pattern (batch_size, n_sources) <torch.LongTensor>: pattern[:, i] is assigned to i.
+    """
+    if backend is None:
+        try:
+            import scipy.optimize # noqa: F401
+            backend = 'scipy'
+        except ImportError:
+            backend = 'torch'
+
+    cost = cost.detach().cpu()
+
+    if maximize:
+        cost = - cost
+
+    batch_size, n_sources, _ = cost.size()
+    pattern = torch.zeros(batch_size, n_sources, dtype=torch.long)
+
+    if backend == 'scipy':
+        from scipy.optimize import linear_sum_assignment
+
+        cost = cost.numpy()
+
+        for batch_idx in range(batch_size):
+            _, _pattern = linear_sum_assignment(cost[batch_idx])
+            pattern[batch_idx] = torch.from_numpy(_pattern)
+    elif backend == 'torch':
+        cost = cost.double()
+
+        for batch_idx in range(batch_size):
+            pattern[batch_idx] = _hungarian_torch(cost[batch_idx])
+    else:
+        raise ValueError("Not support backend {}.".format(backend))
+
+    return pattern
+
+def _hungarian_torch(cost):
+    """
+    O(n^3) Hungarian algorithm with potentials. Inner loops over columns are vectorized.
+    Args:
+        cost (n_sources, n_sources)
+    Returns:
+        pattern (n_sources,) <torch.LongTensor>
+    """
+    n_sources = cost.size(0)
+    inf = float('inf')
+
+    # Index 0 of rows and columns is a dummy.
+    u = torch.zeros(n_sources + 1, dtype=cost.dtype)
+    v = torch.zeros(n_sources + 1, dtype=cost.dtype)
+    p = torch.zeros(n_sources + 1, dtype=torch.long) # p[j]: row assigned to column j
+    way = torch.zeros(n_sources + 1, dtype=torch.long)
+
+    for i in range(1, n_sources + 1):
+        p[0] = i
+        j0 = 0
+        minv = torch.full((n_sources + 1,), inf, dtype=cost.dtype)
+        used = torch.zeros(n_sources + 1, dtype=torch.bool)
+
+        while True:
+            used[j0] = True
+            i0 = p[j0].item()
+
+            unused = torch.logical_not(used)
+            unused[0] = False
+
+            current = cost[i0 - 1] - u[i0] - v[1:]
+            current = torch.cat([current.new_full((1,), inf), current])
+            updated = torch.logical_and(unused, current < minv)
+            minv = torch.where(updated, current, minv)
+            way = torch.where(updated, torch.full_like(way, j0), way)
+
+            delta, j1 = torch.min(torch.where(unused, minv, torch.full_like(minv, inf)), dim=0)
+            j1 = j1.item()
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[unused] -= delta
+
+            j0 = j1
+
+            if p[j0].item() == 0:
+                break
+
+        while True:
+            j1 = way[j0].item()
+            p[j0] = p[j1]
+            j0 = j1
+
+            if j0 == 0:
+                break
+
+    pattern = torch.zeros(n_sources, dtype=torch.long)
+    pattern[p[1:] - 1] = torch.arange(n_sources)
+
+    return pattern
+
 class HungarianLoss(nn.Module):
-    def __init__(self):
+    """
+    Permutation invariant training by Hungarian algorithm, which costs O(n_sources^3) instead of O(n_sources!).
+    Same interface as `PIT`.
+    """
+    def __init__(self, criterion, n_sources=None, backend=None):
+        """
+        Args:
+            criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called, and averaged (or summed) over sources.
+            backend <str>: 'scipy' or 'torch'. See `hungarian`.
+        """
         super().__init__()
-    
+
+        self.criterion = criterion
+        self.n_sources = n_sources
+        self.backend = backend
+
     def forward(self, input, target, batch_mean=True):
-        raise NotImplementedError
\ No newline at end of file
+        """
+        Args:
+            input (batch_size, n_sources, *)
+            target (batch_size, n_sources, *)
+        Returns:
+            loss (batch_size,): minimum loss for each data
+            pattern (batch_size, n_sources): permutation indices
+        """
+        loss, pattern = hungarian_pit(self.criterion, input, target, n_sources=self.n_sources, backend=self.backend, batch_mean=batch_mean)
+
+        return loss, pattern
+
+def _test_hungarian():
+    torch.manual_seed(111)
+
+    batch_size, n_sources = 4, 6
+    cost = torch.randn(batch_size, n_sources, n_sources)
+
+    patterns = torch.Tensor(list(permutations(range(n_sources)))).long()
+    possible_cost = cost[:, torch.arange(n_sources), patterns].sum(dim=-1) # (batch_size, P)
+    pattern_exhaustive = patterns[torch.argmin(possible_cost, dim=1)]
+
+    for backend in ['scipy', 'torch']:
+        pattern = hungarian(cost, backend=backend)
+        print(backend, torch.equal(pattern, pattern_exhaustive))
+
+def _test_hungarian_loss():
+    torch.manual_seed(111)
+
+    batch_size, C, T = 4, 10, 1024
+    input = torch.randn((batch_size, C, T), dtype=torch.float)
+    target = input[:, torch.randperm(C)] + 0.1 * torch.randn((batch_size, C, T), dtype=torch.float)
+
+    criterion = NegSISDR()
+    hungarian_criterion = HungarianLoss(criterion, n_sources=C)
+    loss, pattern = hungarian_criterion(input, target, batch_mean=False)
+
+    print(loss)
+    print(pattern)
+
+if __name__ == '__main__':
+    from itertools import permutations
+
+    from criterion.sdr import NegSISDR
+
+    print('='*10, "Hungarian algorithm", '='*10)
+    _test_hungarian()
+    print()
+
+    print('='*10, "Hungarian loss", '='*10)
+    _test_hungarian_loss()
@@ -1,9 +1,157 @@
+import itertools
+
+import torch
+import torch.nn as nn
+
 """
 "Unsupervised Sound Separation Using Mixture Invariant Training"
+See https://arxiv.org/abs/2006.12701
 """
-def mixit(input, target):
-    raise NotImplementedError
+def mixit(criterion, input, target, patterns=None, assignment=None, batch_mean=True):
+    """
+    Mixture invariant training.
+    Args:
+        criterion <callable>
+        input (batch_size, n_sources, *): Estimated sources
+        target (batch_size, n_mixtures, *): Reference mixtures
+        patterns (P, n_sources) <torch.LongTensor>: Assignments of sources to mixtures. If None, all of n_mixtures**n_sources assignments are used.
+        assignment (P * n_mixtures, n_sources): Assignment matrices built from `patterns` in advance. If None, they are built from `patterns`.
+    Returns:
+        loss (batch_size,): minimum loss for each data
+        pattern (batch_size, n_sources): mixture indices assigned to each source
+    """
+    n_sources, n_mixtures = input.size(1), target.size(1)
+
+    if patterns is None:
+        patterns = build_assignment_patterns(n_sources, n_mixtures=n_mixtures).to(input.device)
+        assignment = None
+
+    if assignment is None:
+        assignment = build_assignment_matrix(patterns, n_mixtures=n_mixtures) # (P, n_mixtures, n_sources)
+        assignment = assignment.view(-1, n_sources)
+
+    batch_size = input.size(0)
+    P = patterns.size(0)
+    input_size, target_size = input.size()[2:], target.size()[2:]
+
+    # Remix all assignments by single matmul.
+    assignment = assignment.to(input.device, input.dtype) # (P * n_mixtures, n_sources)
+    input = input.reshape(batch_size, n_sources, -1) # (batch_size, n_sources, *)
+    remixture = torch.matmul(assignment, input) # (batch_size, P * n_mixtures, *)
+    remixture = remixture.view(batch_size * P, n_mixtures, *input_size)
+    target = target.unsqueeze(dim=1).expand(batch_size, P, n_mixtures, *target_size)
+    target = target.reshape(batch_size * P, n_mixtures, *target_size)
+
+    possible_loss = criterion(remixture, target, batch_mean=False)
+    possible_loss = possible_loss.view(batch_size, P)
+
+    if hasattr(criterion, "maximize") and criterion.maximize:
+        loss, indices = torch.max(possible_loss, dim=1) # loss (batch_size,), indices (batch_size,)
+    else:
+        loss, indices = torch.min(possible_loss, dim=1) # loss (batch_size,), indices (batch_size,)
+
+    if batch_mean:
+        loss = loss.mean(dim=0)
+
+    return loss, patterns[indices]
+
+def build_assignment_patterns(n_sources, n_mixtures=2):
+    """
+    Returns:
+        patterns (n_mixtures**n_sources, n_sources) <torch.LongTensor>: patterns[:, i] is mixture index assigned to i-th source.
+    """
+    patterns = list(itertools.product(range(n_mixtures), repeat=n_sources))
+    patterns = torch.Tensor(patterns).long()
+
+    return patterns
+
+def build_assignment_matrix(patterns, n_mixtures=2):
+    """
+    Args:
+        patterns (P, n_sources) <torch.LongTensor>
+    Returns:
+        assignment (P, n_mixtures, n_sources): Binary matrices, each column of which is one-hot.
+    """
+    assignment = torch.nn.functional.one_hot(patterns, num_classes=n_mixtures) # (P, n_sources, n_mixtures)
+    assignment = assignment.permute(0, 2, 1).contiguous().float()
+
+    return assignment
+
+class MixIT(nn.Module):
+    def __init__(self, criterion, n_sources, n_mixtures=2):
+        """
+        Args:
+            criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+            n_sources <int>: Number of estimated sources
+            n_mixtures <int>: Number of reference mixtures
+        """
+        super().__init__()
+
+        self.criterion = criterion
+
+        # Not saved in state_dict, but moved by .to() or .cuda().
+        patterns = build_assignment_patterns(n_sources, n_mixtures=n_mixtures)
+        assignment = build_assignment_matrix(patterns, n_mixtures=n_mixtures).view(-1, n_sources)
+        self.register_buffer('patterns', patterns, persistent=False)
+        self.register_buffer('assignment', assignment, persistent=False)
+
+    def forward(self, input, target, batch_mean=True):
+        """
+        Args:
+            input (batch_size, n_sources, *): Estimated sources
+            target (batch_size, n_mixtures, *): Reference mixtures
+        Returns:
+            loss (batch_size,): minimum loss for each data
+            pattern (batch_size, n_sources): mixture indices assigned to each source
+        """
+        loss, pattern = mixit(self.criterion, input, target, patterns=self.patterns, assignment=self.assignment, batch_mean=batch_mean)
+
+        return loss, pattern
+
+def _test_mixit():
+    torch.manual_seed(111)
+
+    batch_size, n_sources, n_mixtures, T = 4, 8, 2, 16000
+    input = torch.randn(batch_size, n_sources, T)
+    patterns = torch.randint(n_mixtures, (batch_size, n_sources))
+    target = torch.stack([
+        torch.stack([input[batch_idx, patterns[batch_idx] == mixture_idx].sum(dim=0) for mixture_idx in range(n_mixtures)], dim=0) for batch_idx in range(batch_size)
+    ], dim=0)
+    target = target + 1e-2 * torch.randn_like(target)
+
+    print('-'*10, "Negative SDR", '-'*10)
+    criterion = NegSDR()
+    mixit_criterion = MixIT(criterion, n_sources=n_sources, n_mixtures=n_mixtures)
+
+    start = time.perf_counter()
+    loss, pattern = mixit_criterion(input, target, batch_mean=False)
+    end = time.perf_counter()
+
+    print(loss)
+    print(pattern)
+    print(torch.equal(pattern, patterns))
+    print("{:.4f}[sec]".format(end - start))
+    print()
+
+    print('-'*10, "SI-SDR", '-'*10)
+    criterion = SISDR()
+    mixit_criterion = MixIT(criterion, n_sources=n_sources, n_mixtures=n_mixtures)
+    loss, pattern = mixit_criterion(input, target, batch_mean=False)
+
+    print(loss)
+    print(torch.equal(pattern, patterns))
+    print()
+
+    print('-'*10, "Assignment built on the fly", '-'*10)
+    loss_on_the_fly, pattern_on_the_fly = mixit(criterion, input, target, batch_mean=False)
+
+    print(torch.allclose(loss, loss_on_the_fly), torch.equal(pattern, pattern_on_the_fly))
+    print(list(mixit_criterion.state_dict().keys()), [name for name, _ in mixit_criterion.named_buffers()])
+
+if __name__ == '__main__':
+    import time
+
+    from criterion.sdr import SISDR, NegSDR
 
-class MixIT:
-    def __init__(self):
-        pass
\ No newline at end of file
+    print('='*10, "Mixture invariant training", '='*10)
+    _test_mixit()
@@ -6,32 +6,48 @@ import torch.nn as nn
 """
     Permutation invariant training
 """
-def pit(criterion, input, target, n_sources=None, patterns=None, batch_mean=True):
+def pit(criterion, input, target, n_sources=None, patterns=None, pairwise=False, solver='exhaustive', mask=None, batch_mean=True):
     """
     Args:
         criterion <callable>
         input (batch_size, n_sources, *)
         output (batch_size, n_sources, *)
+        pairwise <bool>: If True, pairwise loss matrix is computed by a single criterion call, and loss of each permutation is gathered from it.
+            Criterion is expected to be averaged (or summed) over sources, e.g. SI-SDR.
+        solver <str>: 'exhaustive' or 'hungarian'. 'hungarian' solves linear assignment problem on the pairwise loss matrix, so `pairwise=True` is required.
+        mask (batch_size, T) <torch.BoolTensor>: Valid samples of zero-padded input and target, which is passed to criterion as `mask`. If None, criterion is called without `mask`.
     Returns:
         loss (batch_size,): minimum loss for each data
         pattern (batch_size,): permutation indices
     """
+    if not solver in ['exhaustive', 'hungarian']:
+        raise ValueError("Not support solver {}.".format(solver))
+
+    if solver == 'hungarian':
+        assert pairwise, "Hungarian solver requires pairwise=True."
+
+        return hungarian_pit(criterion, input, target, n_sources=n_sources, mask=mask, batch_mean=batch_mean)
+
     if patterns is None:
         if n_sources is None:
             n_sources = input.size(1)
         patterns = list(itertools.permutations(range(n_sources)))
         patterns = torch.Tensor(patterns).long()
     
-    P = len(patterns)
-    possible_loss = None
-    
-    for idx in range(P):
-        pattern = patterns[idx]
-        loss = criterion(input, target[:, pattern], batch_mean=False)
-        if possible_loss is None:
-            possible_loss = loss.unsqueeze(dim=1)
-        else:
-            possible_loss = torch.cat([possible_loss, loss.unsqueeze(dim=1)], dim=1)
+    if pairwise:
+        pairwise_loss = compute_pairwise_loss(criterion, input, target, n_sources=n_sources, mask=mask) # (batch_size, n_sources, n_sources)
+        possible_loss = gather_permutation_loss(pairwise_loss, patterns, reduction=_get_reduction(criterion)) # (batch_size, P)
+    else:
+        P = len(patterns)
+        possible_loss = []
+        kwargs = {} if mask is None else {'mask': mask}
+        
+        for idx in range(P):
+            pattern = patterns[idx]
+            loss = criterion(input, target[:, pattern], batch_mean=False, **kwargs)
+            possible_loss.append(loss)
+        
+        possible_loss = torch.stack(possible_loss, dim=1)
     
     # possible_loss (batch_size, P)
     if hasattr(criterion, "maximize") and criterion.maximize:
@@ -42,48 +58,150 @@ def pit(criterion, input, target, n_sources=None, patterns=None, batch_mean=True
     if batch_mean:
         loss = loss.mean(dim=0)
          
-    return loss, patterns[indices]
+    return loss, patterns[indices.to(patterns.device)]
+
+def compute_pairwise_loss(criterion, input, target, n_sources=None, mask=None):
+    """
+    Args:
+        criterion <callable>
+        input (batch_size, n_sources, *)
+        target (batch_size, n_sources, *)
+        mask (batch_size, T) <torch.BoolTensor>: Valid samples, which is passed to criterion as `mask`.
+    Returns:
+        pairwise_loss (batch_size, n_sources, n_sources): pairwise_loss[:, i, j] is loss between input[:, i] and target[:, j].
+    """
+    if n_sources is None:
+        n_sources = input.size(1)
+
+    batch_size = input.size(0)
+    input_size, target_size = input.size()[2:], target.size()[2:]
+
+    input = input.unsqueeze(dim=2).expand(batch_size, n_sources, n_sources, *input_size)
+    target = target.unsqueeze(dim=1).expand(batch_size, n_sources, n_sources, *target_size)
+    input, target = input.reshape(batch_size * n_sources * n_sources, *input_size), target.reshape(batch_size * n_sources * n_sources, *target_size)
+
+    if mask is None:
+        pairwise_loss = criterion(input, target, batch_mean=False)
+    else:
+        mask = mask.unsqueeze(dim=1).expand(batch_size, n_sources * n_sources, mask.size(-1))
+        mask = mask.reshape(batch_size * n_sources * n_sources, mask.size(-1))
+        pairwise_loss = criterion(input, target, batch_mean=False, mask=mask)
+    
+    pairwise_loss = pairwise_loss.view(batch_size, n_sources, n_sources)
+
+    return pairwise_loss
+
+def gather_permutation_loss(pairwise_loss, patterns, reduction='mean'):
+    """
+    Args:
+        pairwise_loss (batch_size, n_sources, n_sources)
+        patterns (P, n_sources) <torch.LongTensor>: Permutation indices
+        reduction <str>: 'mean' or 'sum' over sources
+    Returns:
+        possible_loss (batch_size, P)
+    """
+    n_sources = pairwise_loss.size(-1)
+    patterns = patterns.to(pairwise_loss.device)
+    source_indices = torch.arange(n_sources, device=pairwise_loss.device)
+
+    possible_loss = pairwise_loss[:, source_indices, patterns] # (batch_size, P, n_sources)
+
+    if reduction == 'mean':
+        possible_loss = possible_loss.mean(dim=-1)
+    elif reduction == 'sum':
+        possible_loss = possible_loss.sum(dim=-1)
+    else:
+        raise ValueError("Invalid reduction type")
+
+    return possible_loss
+
+def hungarian_pit(criterion, input, target, n_sources=None, backend=None, mask=None, batch_mean=True):
+    """
+    Solve linear assignment problem on the pairwise loss matrix by Hungarian algorithm, which costs O(n_sources^3) instead of O(n_sources!).
+    Args:
+        criterion <callable>
+        input (batch_size, n_sources, *)
+        target (batch_size, n_sources, *)
+        backend <str>: 'scipy' or 'torch'. See `criterion.hungarian.hungarian`.
+        mask (batch_size, T) <torch.BoolTensor>: Valid samples, which is passed to criterion as `mask`.
+    Returns:
+        loss (batch_size,): minimum loss for each data
+        pattern (batch_size, n_sources): permutation indices
+    """
+    from criterion.hungarian import hungarian
+
+    pairwise_loss = compute_pairwise_loss(criterion, input, target, n_sources=n_sources, mask=mask) # (batch_size, n_sources, n_sources)
+    maximize = hasattr(criterion, "maximize") and criterion.maximize
+
+    pattern = hungarian(pairwise_loss, maximize=maximize, backend=backend) # (batch_size, n_sources)
+    loss = torch.gather(pairwise_loss, dim=2, index=pattern.unsqueeze(dim=2).to(pairwise_loss.device)).squeeze(dim=2) # (batch_size, n_sources)
+
+    if _get_reduction(criterion) == 'sum':
+        loss = loss.sum(dim=1)
+    else:
+        loss = loss.mean(dim=1)
+
+    if batch_mean:
+        loss = loss.mean(dim=0)
+
+    return loss, pattern
+
+def _get_reduction(criterion):
+    reduction = getattr(criterion, "reduction", 'mean')
+
+    if reduction is None:
+        reduction = 'mean'
+
+    return reduction
 
 class PIT(nn.Module):
-    def __init__(self, criterion, n_sources):
+    def __init__(self, criterion, n_sources, pairwise=False, solver='exhaustive'):
         """
         Args:
             criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
+            pairwise <bool>: If True, loss of each permutation is gathered from pairwise loss matrix. See `pit`.
+            solver <str>: 'exhaustive' or 'hungarian'.
         """
         super().__init__()
 
         self.criterion = criterion
-        patterns = list(itertools.permutations(range(n_sources)))
-        self.patterns = torch.Tensor(patterns).long()
+        self.pairwise, self.solver = pairwise, solver
+
+        if solver == 'exhaustive':
+            patterns = list(itertools.permutations(range(n_sources)))
+            self.patterns = torch.Tensor(patterns).long()
+        else:
+            self.patterns = None
     
-    def forward(self, input, target, batch_mean=True):
+    def forward(self, input, target, batch_mean=True, mask=None):
         """
         Args:
             input (batch_size, n_sources, *)
             target (batch_size, n_sources, *)
+            mask (batch_size, T) <torch.BoolTensor>: Valid samples of zero-padded input and target. If None, all samples are valid.
         Returns:
             loss (batch_size,): minimum loss for each data
             pattern (batch_size,): permutation indices
         """
-        loss, pattern = pit(self.criterion, input, target, patterns=self.patterns, batch_mean=batch_mean)
+        loss, pattern = pit(self.criterion, input, target, patterns=self.patterns, pairwise=self.pairwise, solver=self.solver, mask=mask, batch_mean=batch_mean)
              
         return loss, pattern
 
 class PIT1d(PIT):
-    def __init__(self, criterion, n_sources):
+    def __init__(self, criterion, n_sources, pairwise=False, solver='exhaustive'):
         """
         Args:
             criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
         """
-        super().__init__(criterion, n_sources)
+        super().__init__(criterion, n_sources, pairwise=pairwise, solver=solver)
 
 class PIT2d(PIT):
-    def __init__(self, criterion, n_sources):
+    def __init__(self, criterion, n_sources, pairwise=False, solver='exhaustive'):
         """
         Args:
             criterion <callable>: criterion is expected acceptable (input, target, batch_mean) when called.
         """
-        super().__init__(criterion, n_sources)
+        super().__init__(criterion, n_sources, pairwise=pairwise, solver=solver)
 
 class ORPIT(nn.Module):
     """
@@ -111,50 +229,34 @@ class ORPIT(nn.Module):
         criterion = self.criterion
 
         if type(target) is torch.Tensor:
-            batch_size = target.size(0)
-            lens_unpacked = [target.size(1)] * batch_size
+            batch_size, max_n_sources = target.size()[:2]
+            n_sources = torch.full((batch_size,), max_n_sources, dtype=torch.long)
         else:
-            target, lens_unpacked = nn.utils.rnn.pad_packed_sequence(target, batch_first=True)
-
-        # TODO: batch process
-
-        batch_size = input.size(0)
-        batch_loss, batch_indices = None, None
-
-        for batch_idx in range(batch_size):
-            n_sources = lens_unpacked[batch_idx] # <int>
-            _input, _target = input[batch_idx: batch_idx+1], target[batch_idx: batch_idx+1, : n_sources] # (1, 2, *), (1, n_sources, *)
-            input_one, input_rest = _input[:, 0], _input[:, 1] # (1, *), (1, *)
-
-            possible_loss = None
-    
-            for idx in range(n_sources):
-                mask_one = torch.zeros_like(_target)
-                mask_one[:, idx] = 1.0
-                mask_rest = torch.ones_like(_target) - mask_one
-                target_one = torch.sum(mask_one * _target, dim=1) # (1, *)
-                target_rest = torch.sum(mask_rest * _target, dim=1) # (1, *)
-                
-                loss_one = criterion(input_one, target_one, batch_mean=False)
-                loss_rest = criterion(input_rest, target_rest, batch_mean=False)
-                loss = loss_one + loss_rest / (n_sources - 1)
-
-                if possible_loss is None:
-                    possible_loss = loss
-                else:
-                    possible_loss = torch.cat([possible_loss, loss], dim=0)
-            
-            if hasattr(criterion, "maximize") and criterion.maximize:
-                loss, indices = torch.max(possible_loss, dim=0, keepdim=True) # loss (1,), indices (1,)
-            else:
-                loss, indices = torch.min(possible_loss, dim=0, keepdim=True) # loss (1,), indices (1,)
-            
-            if batch_loss is None:
-                batch_loss = loss
-                batch_indices = indices
-            else:
-                batch_loss = torch.cat([batch_loss, loss], dim=0)
-                batch_indices = torch.cat([batch_indices, indices], dim=0)
+            target, n_sources = nn.utils.rnn.pad_packed_sequence(target, batch_first=True) # target is padded by 0
+            batch_size, max_n_sources = target.size()[:2]
+        
+        n_sources = n_sources.to(target.device)
+        mask = torch.arange(max_n_sources, device=target.device) < n_sources.unsqueeze(dim=1) # (batch_size, max_n_sources)
+
+        # Padded sources are zero, so sum over all sources is the mixture of valid sources.
+        target_rest = torch.sum(target, dim=1, keepdim=True) - target # (batch_size, max_n_sources, *)
+        input_one, input_rest = input[:, 0:1], input[:, 1:2] # (batch_size, 1, *), (batch_size, 1, *)
+        input_one, input_rest = input_one.expand_as(target), input_rest.expand_as(target) # (batch_size, max_n_sources, *)
+
+        # Only valid (batch, source) pairs are evaluated, in a single call per criterion.
+        loss_one = criterion(input_one[mask], target[mask], batch_mean=False) # (n_valid,)
+        loss_rest = criterion(input_rest[mask], target_rest[mask], batch_mean=False) # (n_valid,)
+        n_rest = (n_sources.unsqueeze(dim=1).expand_as(mask)[mask] - 1).to(loss_rest.dtype) # (n_valid,)
+        loss = loss_one + loss_rest / n_rest
+
+        if hasattr(criterion, "maximize") and criterion.maximize:
+            possible_loss = loss.new_full((batch_size, max_n_sources), - float('inf'))
+            possible_loss = possible_loss.masked_scatter(mask, loss)
+            batch_loss, batch_indices = torch.max(possible_loss, dim=1) # (batch_size,), (batch_size,)
+        else:
+            possible_loss = loss.new_full((batch_size, max_n_sources), float('inf'))
+            possible_loss = possible_loss.masked_scatter(mask, loss)
+            batch_loss, batch_indices = torch.min(possible_loss, dim=1) # (batch_size,), (batch_size,)
          
         if batch_mean:
             batch_loss = batch_loss.mean(dim=0)
@@ -162,16 +264,7 @@ class ORPIT(nn.Module):
         return batch_loss, batch_indices
 
 def sinkpit(criterion, input, target, n_sources=None, coldness=1e+0, iteration=10, batch_mean=True):    
-    if n_sources is None:
-        n_sources = input.size(1)
-
-    batch_size = input.size(0)
-
-    input_size, target_size = input.size()[2:], target.size()[2:]
-    input, target = input.unsqueeze(dim=2).expand(-1, -1, n_sources, -1).contiguous(), target.unsqueeze(dim=1).expand(-1, n_sources, -1, -1).contiguous()
-    input, target = input.view(batch_size * n_sources * n_sources, *input_size), target.view(batch_size * n_sources * n_sources, *target_size)
-    possible_loss = criterion(input, target, batch_mean=False)
-    possible_loss = possible_loss.view(batch_size, n_sources, n_sources)
+    possible_loss = compute_pairwise_loss(criterion, input, target, n_sources=n_sources)
 
     if hasattr(criterion, "maximize") and criterion.maximize:
         possible_loss = - possible_loss
@@ -265,6 +358,27 @@ def _test_pit():
     print(loss)
     print(pattern)
 
+def _test_pairwise_pit():
+    torch.manual_seed(111)
+
+    batch_size, C, T = 4, 5, 1024
+    input = torch.randn((batch_size, C, T), dtype=torch.float)
+    target = torch.randn((batch_size, C, T), dtype=torch.float)
+    criterion = NegSISDR()
+
+    for pairwise, solver in [(False, 'exhaustive'), (True, 'exhaustive'), (True, 'hungarian')]:
+        print('-'*10, "pairwise={}, solver={}".format(pairwise, solver), '-'*10)
+        pit_criterion = PIT1d(criterion, n_sources=C, pairwise=pairwise, solver=solver)
+
+        start = time.perf_counter()
+        loss, pattern = pit_criterion(input, target, batch_mean=False)
+        end = time.perf_counter()
+
+        print(loss)
+        print(pattern)
+        print("{:.4f}[sec]".format(end - start))
+        print()
+
 def _test_orpit():
     torch.manual_seed(111)
 
@@ -360,6 +474,7 @@ def _test_sinkpit():
 
 if __name__ == '__main__':
     import random
+    import time
     from itertools import permutations
 
     from criterion.sdr import SISDR, NegSISDR
@@ -369,6 +484,10 @@ if __name__ == '__main__':
     _test_pit()
     print()
 
+    print('='*10, "Permutation invariant training (pairwise)", '='*10)
+    _test_pairwise_pit()
+    print()
+
     print('='*10, "One-and-Rest permutation invariant training", '='*10)
     _test_orpit()
     print()
@@ -1,14 +1,36 @@
 import torch
 import torch.nn as nn
 
+from utils.utils_precision import autocast_fp32
+
 EPS = 1e-12
 
-def sdr(input, target, eps=EPS):
+def apply_length_mask(input, target, mask=None):
+    """
+    Zero out padded samples, which then don't contribute to sums over time.
+    Args:
+        input (batch_size, *, T)
+        target (batch_size, *, T)
+        mask (batch_size, T) <torch.BoolTensor>
+    Returns:
+        input (batch_size, *, T)
+        target (batch_size, *, T)
+    """
+    if mask is None:
+        return input, target
+
+    mask = mask.view(mask.size(0), *[1] * (input.dim() - 2), mask.size(-1)).to(input.dtype)
+
+    return input * mask, target * mask
+
+@autocast_fp32
+def sdr(input, target, mask=None, eps=EPS):
     """
     Scale-invariant-SDR (source-to-distortion ratio)
     Args:
         input (batch_size, T) or (batch_size, n_sources, T), or (batch_size, n_sources, n_mics, T)
         target (batch_size, T) or (batch_size, n_sources, T) or (batch_size, n_sources, n_mics, T)
+        mask (batch_size, T) <torch.BoolTensor>: Valid samples of zero-padded input and target. If None, all samples are valid.
     Returns:
         loss (batch_size,) or (batch_size, n_sources) or (batch_size, n_sources, n_mics)
     """
@@ -16,6 +38,8 @@ def sdr(input, target, eps=EPS):
     
     assert n_dims in [2, 3, 4], "Only 2D or 3D or 4D tensor is acceptable, but given {}D tensor.".format(n_dims)
 
+    input, target = apply_length_mask(input, target, mask=mask)
+
     loss = (torch.sum(target**2, dim=n_dims-1) + eps) / (torch.sum((target - input)**2, dim=n_dims-1) + eps)
     loss = 10 * torch.log10(loss)
 
@@ -32,11 +56,12 @@ class SDR(nn.Module):
         
         self.eps = eps
         
-    def forward(self, input, target, batch_mean=True):
+    def forward(self, input, target, batch_mean=True, mask=None):
         """
         Args:
             input (batch_size, T) or (batch_size, n_sources, T), or (batch_size, n_sources, n_mics, T)
             target (batch_size, T) or (batch_size, n_sources, T) or (batch_size, n_sources, n_mics, T)
+            mask (batch_size, T) <torch.BoolTensor>: Valid samples. If None, all samples are valid.
         Returns:
             loss (batch_size,) or (batch_size, n_sources) or (batch_size, n_sources, n_mics)
         """
@@ -44,7 +69,7 @@ class SDR(nn.Module):
         
         assert n_dims in [2, 3, 4], "Only 2D or 3D or 4D tensor is acceptable, but given {}D tensor.".format(n_dims)
         
-        loss = sdr(input, target, eps=self.eps)
+        loss = sdr(input, target, mask=mask, eps=self.eps)
         
         if self.reduction:
             if n_dims == 3:
@@ -78,11 +103,12 @@ class NegSDR(nn.Module):
         
         self.eps = eps
         
-    def forward(self, input, target, batch_mean=True):
+    def forward(self, input, target, batch_mean=True, mask=None):
         """
         Args:
             input (batch_size, T) or (batch_size, C, T)
             target (batch_size, T) or (batch_size, C, T)
+            mask (batch_size, T) <torch.BoolTensor>: Valid samples. If None, all samples are valid.
         Returns:
             loss (batch_size,)
         """
@@ -90,7 +116,7 @@ class NegSDR(nn.Module):
         
         assert n_dims in [2, 3, 4], "Only 2D or 3D or 4D tensor is acceptable, but given {}D tensor.".format(n_dims)
         
-        loss = - sdr(input, target, eps=self.eps)
+        loss = - sdr(input, target, mask=mask, eps=self.eps)
 
         if self.reduction:
             if n_dims == 3:
@@ -119,12 +145,14 @@ class NegSDR(nn.Module):
     https://arxiv.org/abs/1811.02508
 """
 
-def sisdr(input, target, eps=EPS):
+@autocast_fp32
+def sisdr(input, target, mask=None, eps=EPS):
     """
     Scale-invariant-SDR (source-to-distortion ratio)
     Args:
         input (batch_size, T) or (batch_size, n_sources, T), or (batch_size, n_sources, n_mics, T)
         target (batch_size, T) or (batch_size, n_sources, T) or (batch_size, n_sources, n_mics, T)
+        mask (batch_size, T) <torch.BoolTensor>: Valid samples of zero-padded input and target. If None, all samples are valid.
     Returns:
         loss (batch_size,) or (batch_size, n_sources) or (batch_size, n_sources, n_mics)
     """
@@ -132,6 +160,8 @@ def sisdr(input, target, eps=EPS):
     
     assert n_dims in [2, 3, 4], "Only 2D or 3D or 4D tensor is acceptable, but given {}D tensor.".format(n_dims)
 
+    input, target = apply_length_mask(input, target, mask=mask)
+
     alpha = torch.sum(input * target, dim=n_dims-1, keepdim=True) / (torch.sum(target**2, dim=n_dims-1, keepdim=True) + eps)
     loss = (torch.sum((alpha * target)**2, dim=n_dims-1) + eps) / (torch.sum((alpha * target - input)**2, dim=n_dims-1) + eps)
     loss = 10 * torch.log10(loss)
@@ -149,11 +179,12 @@ class SISDR(nn.Module):
         
         self.eps = eps
         
-    def forward(self, input, target, batch_mean=True):
+    def forward(self, input, target, batch_mean=True, mask=None):
         """
         Args:
             input (batch_size, T) or (batch_size, n_sources, T), or (batch_size, n_sources, n_mics, T)
             target (batch_size, T) or (batch_size, n_sources, T) or (batch_size, n_sources, n_mics, T)
+            mask (batch_size, T) <torch.BoolTensor>: Valid samples. If None, all samples are valid.
         Returns:
             loss (batch_size,) or (batch_size, n_sources) or (batch_size, n_sources, n_mics)
         """
@@ -161,7 +192,7 @@ class SISDR(nn.Module):
         
         assert n_dims in [2, 3, 4], "Only 2D or 3D or 4D tensor is acceptable, but given {}D tensor.".format(n_dims)
         
-        loss = sisdr(input, target, eps=self.eps)
+        loss = sisdr(input, target, mask=mask, eps=self.eps)
         
         if self.reduction:
             if n_dims == 3:
@@ -195,11 +226,12 @@ class NegSISDR(nn.Module):
         
         self.eps = eps
         
-    def forward(self, input, target, batch_mean=True):
+    def forward(self, input, target, batch_mean=True, mask=None):
         """
         Args:
             input (batch_size, T) or (batch_size, C, T)
             target (batch_size, T) or (batch_size, C, T)
+            mask (batch_size, T) <torch.BoolTensor>: Valid samples. If None, all samples are valid.
         Returns:
             loss (batch_size,)
         """
@@ -207,7 +239,7 @@ class NegSISDR(nn.Module):
         
         assert n_dims in [2, 3, 4], "Only 2D or 3D or 4D tensor is acceptable, but given {}D tensor.".format(n_dims)
         
-        loss = - sisdr(input, target, eps=self.eps)
+        loss = - sisdr(input, target, mask=mask, eps=self.eps)
 
         if self.reduction:
             if n_dims == 3:
@@ -234,6 +266,7 @@ class NegSISDR(nn.Module):
     Weighted SDR (signal-to-distortion ratio)
     See "Phase-Aware Speech Enhancement with Deep Complex U-Net"
 """
+@autocast_fp32
 def weighted_sdr(mixture, input, target, eps=EPS):
     """
     Args:
@@ -128,6 +128,96 @@ class ConvTasNet(nn.Module):
         
         return output, latent
     
+    def init_state(self, batch_size=1):
+        """
+        Initialize state for streaming inference by `forward_chunk`. Only causal model is supported.
+        Returns:
+            state <dict>:
+                encoder (batch_size, C_in, kernel_size - stride): Past samples of input
+                separator <dict>: State of separator
+                decoder (batch_size * n_sources, C_in, kernel_size - stride): Overlapping samples of output, which are not completed yet
+        """
+        n_sources = self.n_sources
+        in_channels = self.in_channels
+        kernel_size, stride = self.kernel_size, self.stride
+        
+        assert self.causal, "Only causal model supports streaming."
+        assert self.enc_basis != 'trainableGated', "Gated encoder doesn't support streaming, because input is normalized by its whole energy."
+        
+        weight = self.separator.mask_conv1d.weight
+        
+        state = {
+            'encoder': weight.new_zeros(batch_size, in_channels, kernel_size - stride),
+            'separator': self.separator.init_state(batch_size),
+            'decoder': weight.new_zeros(batch_size * n_sources, in_channels, kernel_size - stride)
+        }
+        
+        return state
+    
+    def forward_chunk(self, input, state):
+        """
+        Separate chunk of stream. Output is delayed by kernel_size - stride samples,
+        i.e. concatenated outputs are equivalent to `forward` of input with kernel_size - stride zeros padded on the left.
+        Args:
+            input (batch_size, C_in, T) or (batch_size, 1, C_in, T): T is expected divisible by stride.
+            state <dict>: State returned by `init_state` or previous `forward_chunk`.
+        Returns:
+            output (batch_size, n_sources, T) or (batch_size, n_sources, C_in, T)
+            state <dict>: Updated state
+        """
+        n_sources = self.n_sources
+        n_basis = self.n_basis
+        stride = self.stride
+        
+        n_dims = input.dim()
+
+        if n_dims == 3:
+            batch_size, C_in, T = input.size()
+            assert C_in == 1, "input.size() is expected (?, 1, ?), but given {}".format(input.size())
+        elif n_dims == 4:
+            batch_size, C_in, n_mics, T = input.size()
+            assert C_in == 1, "input.size() is expected (?, 1, ?, ?), but given {}".format(input.size())
+            input = input.view(batch_size, n_mics, T)
+        else:
+            raise ValueError("Not support {} dimension input".format(n_dims))
+        
+        assert T % stride == 0, "Length of chunk is expected divisible by stride, but given {}.".format(T)
+        
+        buffer = state['encoder']
+        x = torch.cat([buffer, input], dim=2)
+        w = self.encoder(x)
+
+        if torch.is_complex(w):
+            amplitude, phase = torch.abs(w), torch.angle(w)
+            mask, separator_state = self.separator.forward_chunk(amplitude, state['separator'])
+            amplitude, phase = amplitude.unsqueeze(dim=1), phase.unsqueeze(dim=1)
+            w_hat = amplitude * mask * torch.exp(1j * phase)
+        else:
+            mask, separator_state = self.separator.forward_chunk(w, state['separator'])
+            w = w.unsqueeze(dim=1)
+            w_hat = w * mask
+        
+        w_hat = w_hat.view(batch_size*n_sources, n_basis, -1)
+        x_hat = self.decoder(w_hat)
+        
+        # Overlap-add with the tail of the previous chunk
+        overlap = state['decoder']
+        x_hat = torch.cat([x_hat[:, :, :overlap.size(2)] + overlap, x_hat[:, :, overlap.size(2):]], dim=2)
+        x_hat, overlap = torch.split(x_hat, [T, x_hat.size(2) - T], dim=2)
+        
+        if n_dims == 3:
+            output = x_hat.reshape(batch_size, n_sources, T)
+        else: # n_dims == 4
+            output = x_hat.reshape(batch_size, n_sources, n_mics, T)
+        
+        state = {
+            'encoder': x[:, :, x.size(2) - buffer.size(2):],
+            'separator': separator_state,
+            'decoder': overlap
+        }
+        
+        return output, state
+    
     def get_config(self):
         config = {
             'in_channels': self.in_channels,
@@ -258,6 +348,42 @@ class Separator(nn.Module):
         output = x.view(batch_size, n_sources, num_features, n_frames)
         
         return output
+    
+    def init_state(self, batch_size=1):
+        state = {
+            'norm': self.norm1d.init_state(batch_size),
+            'tcn': self.tcn.init_state(batch_size)
+        }
+        
+        return state
+    
+    def forward_chunk(self, input, state):
+        """
+        Args:
+            input (batch_size, num_features, n_frames): n_frames is number of frames in chunk.
+            state <dict>: State returned by `init_state` or previous `forward_chunk`.
+        Returns:
+            output (batch_size, n_sources, n_basis, n_frames)
+            state <dict>: Updated state
+        """
+        num_features, n_sources = self.num_features, self.n_sources
+
+        batch_size, _, n_frames = input.size()
+
+        x, norm_state = self.norm1d.forward_chunk(input, state['norm'])
+        x = self.bottleneck_conv1d(x)
+        x, tcn_state = self.tcn.forward_chunk(x, state['tcn'])
+        x = self.prelu(x)
+        x = self.mask_conv1d(x)
+        x = self.mask_nonlinear(x)
+        output = x.view(batch_size, n_sources, num_features, n_frames)
+        
+        state = {
+            'norm': norm_state,
+            'tcn': tcn_state
+        }
+        
+        return output, state
 
 def _test_conv_tasnet():
     batch_size = 4
@@ -433,7 +559,61 @@ def _test_conv_tasnet_paper():
     plt.savefig('data/conv-tasnet/basis_enc-trainable.png', bbox_inches='tight')
     plt.close()
 
+def _test_conv_tasnet_streaming():
+    batch_size = 2
+    C = 1
+    sr = 8000
+    T, chunk_size = 4 * sr, 256
+
+    L, stride = 16, 8
+    N = 512
+    H, B, Sc = 512, 128, 128
+    P = 3
+    R, X = 3, 8
+    sep_norm = True
+
+    enc_basis, dec_basis = 'trainable', 'trainable'
+    enc_nonlinear = None
+    causal = True
+    mask_nonlinear = 'sigmoid'
+    n_sources = 2
+
+    model = ConvTasNet(
+        N, kernel_size=L, stride=stride, enc_basis=enc_basis, dec_basis=dec_basis, enc_nonlinear=enc_nonlinear,
+        sep_hidden_channels=H, sep_bottleneck_channels=B, sep_skip_channels=Sc, sep_kernel_size=P, sep_num_blocks=R, sep_num_layers=X,
+        causal=causal, sep_norm=sep_norm, mask_nonlinear=mask_nonlinear,
+        n_sources=n_sources
+    )
+    model.eval()
+
+    input = torch.randn((batch_size, C, T), dtype=torch.float)
+
+    with torch.no_grad():
+        # Offline separation of delayed input
+        output_offline = model(F.pad(input, (L - stride, 0)))
+        output_offline = output_offline[:, :, :T]
+
+        # Streaming separation
+        state = model.init_state(batch_size)
+        output_streaming = []
+
+        start = time.perf_counter()
+
+        for idx in range(0, T, chunk_size):
+            output, state = model.forward_chunk(input[:, :, idx: idx + chunk_size], state)
+            output_streaming.append(output)
+
+        end = time.perf_counter()
+
+    output_streaming = torch.cat(output_streaming, dim=2)
+
+    print(input.size(), output_streaming.size())
+    print("Max absolute error: {:.3e}".format(torch.abs(output_streaming - output_offline).max().item()))
+    print("Real time factor: {:.4f}".format((end - start) / (batch_size * T / sr)))
+
 if __name__ == '__main__':
+    import time
+
     import numpy as np
     import matplotlib.pyplot as plt
     from matplotlib.colors import Normalize
@@ -450,4 +630,8 @@ if __name__ == '__main__':
 
     print("="*10, "Conv-TasNet (same configuration in the paper)", "="*10)
     _test_conv_tasnet_paper()
+    print()
+
+    print("="*10, "Conv-TasNet (streaming)", "="*10)
+    _test_conv_tasnet_streaming()
     print()
\ No newline at end of file
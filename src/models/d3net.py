@@ -5,6 +5,7 @@ import torch.nn.functional as F
 from torch.nn.modules.utils import _pair
 
 from utils.utils_d3net import choose_layer_norm
+from utils.utils_parallel import forward_targets
 from models.transform import BandSplit
 from models.glu import GLU2d
 from models.d2net import D2Block, D2BlockFixedDilation
@@ -44,11 +45,17 @@ class ParallelD3Net(nn.Module):
 
         self.in_channels = in_channels
 
-    def forward(self, input, target=None):
-        if type(target) is not str:
-            raise TypeError("`target` is expected str, but given {}".format(type(target)))
-        
-        output = self.net[target](input)
+    def forward(self, input, target=None, batch_size=None, n_threads=1):
+        """
+        Args:
+            input (batch_size, in_channels, n_bins, n_frames): Amplitude of mixture, e.g. patches of a song
+            target <str> or <list<str>>: Target(s) to be estimated. If None, all targets are estimated.
+            batch_size <int>: Number of patches fed to each network at once. If None, all patches are fed at once.
+            n_threads <int>: Number of threads to run networks of targets concurrently. Valid only on CPU.
+        Returns:
+            output (batch_size, in_channels, n_bins, n_frames) if target is str, otherwise (batch_size, n_targets, in_channels, n_bins, n_frames)
+        """
+        output = forward_targets(self.net, input, target=target, batch_size=batch_size, n_threads=n_threads)
 
         return output
     
@@ -915,7 +922,58 @@ def _test_d3net():
     print(model)
     print(input.size(), output.size())
 
+def _test_parallel_d3net():
+    batch_size = 8
+    in_channels, n_bins, n_frames = 2, 64, 32
+    bands, sections = ['low', 'middle'], [32, 32]
+    sources = ['drums', 'bass', 'other', 'vocals']
+
+    config = {
+        'num_features': 16,
+        'growth_rate': [2, 3, 4, 3, 2],
+        'kernel_size': 3,
+        'scale': (2, 2),
+        'num_d2blocks': [2, 2, 2, 2, 2],
+        'dilated': [True, True, True, True, True],
+        'norm': [True, True, True, True, True],
+        'nonlinear': ['relu', 'relu', 'relu', 'relu', 'relu'],
+        'depth': [2, 2, 2, 2, 2]
+    }
+    kwargs = {
+        key: {band: value for band in bands + [FULL]} for key, value in config.items()
+    }
+
+    input = torch.randn(batch_size, in_channels, n_bins, n_frames)
+
+    modules = {
+        source: D3Net(in_channels, bands=bands, sections=sections, growth_rate_final=4, kernel_size_final=3, depth_final=2, **kwargs) for source in sources
+    }
+    model = ParallelD3Net(modules)
+    model.eval()
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        output_serial = []
+
+        for _input in input:
+            _output = [model(_input.unsqueeze(dim=0), target=source) for source in sources]
+            output_serial.append(torch.stack(_output, dim=1))
+        
+        output_serial = torch.cat(output_serial, dim=0)
+        end = time.perf_counter()
+        print("Serial: {:.3f}[sec]".format(end - start))
+
+        start = time.perf_counter()
+        output = model(input, target=sources, batch_size=4, n_threads=len(sources))
+        end = time.perf_counter()
+        print("Batched: {:.3f}[sec]".format(end - start))
+
+    print(input.size(), output.size())
+    print(torch.abs(output - output_serial).max().item())
+
 if __name__ == '__main__':
+    import time
+
     torch.manual_seed(111)
 
     print('='*10, "D3Block", '='*10)
@@ -943,4 +1001,8 @@ if __name__ == '__main__':
     print()
 
     print('='*10, "D3Net", '='*10)
-    _test_d3net()
\ No newline at end of file
+    _test_d3net()
+    print()
+
+    print('='*10, "ParallelD3Net", '='*10)
+    _test_parallel_d3net()
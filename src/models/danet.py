@@ -1,12 +1,12 @@
 import torch
 import torch.nn as nn
 
-from algorithm.clustering import Kmeans
+from algorithm.clustering import BatchKmeans
 
 EPS=1e-12
 
 class DANet(nn.Module):
-    def __init__(self, n_bins, embed_dim=20, hidden_channels=300, num_blocks=4, causal=False, mask_nonlinear='sigmoid', iter_clustering=10, eps=EPS, **kwargs):
+    def __init__(self, n_bins, embed_dim=20, hidden_channels=300, num_blocks=4, causal=False, mask_nonlinear='sigmoid', iter_clustering=10, tol_clustering=1e-4, eps=EPS, **kwargs):
         super().__init__()
         
         self.n_bins = n_bins
@@ -35,6 +35,7 @@ class DANet(nn.Module):
             raise NotImplementedError("")
         
         self.iter_clustering = iter_clustering
+        self.tol_clustering = tol_clustering
         self.eps = eps
     
     def forward(self, input, assignment=None, threshold_weight=None, n_sources=None, iter_clustering=None):
@@ -87,11 +88,10 @@ class DANet(nn.Module):
             # TODO: test threshold
             if self.training:
                 raise ValueError("assignment is required.")
-            latent_kmeans = latent.squeeze(dim=0) # -> (embed_dim, n_bins*n_frames)
-            latent_kmeans = latent_kmeans.permute(1, 0) # -> (n_bins*n_frames, embed_dim)
-            kmeans = Kmeans(latent_kmeans, K=n_sources)
-            _, centroids = kmeans(iteration=iter_clustering) # (n_bins*n_frames, n_sources), (n_sources, embed_dim)
-            attractor = centroids.unsqueeze(dim=0) # (batch_size, n_sources, embed_dim)
+            latent_kmeans = latent.permute(0, 2, 1) # -> (batch_size, n_bins*n_frames, embed_dim)
+            kmeans = BatchKmeans(latent_kmeans, K=n_sources)
+            _, centroids = kmeans(iteration=iter_clustering, tol=self.tol_clustering) # (batch_size, n_bins*n_frames, n_sources), (batch_size, n_sources, embed_dim)
+            attractor = centroids # (batch_size, n_sources, embed_dim)
         else:
             threshold_weight = threshold_weight.view(batch_size, 1, n_bins*n_frames)
             assignment = assignment.view(batch_size, n_sources, n_bins*n_frames) # -> (batch_size, n_sources, n_bins*n_frames)
@@ -114,6 +114,7 @@ class DANet(nn.Module):
             'causal': self.causal,
             'mask_nonlinear': self.mask_nonlinear,
             'iter_clustering': self.iter_clustering,
+            'tol_clustering': self.tol_clustering,
             'eps': self.eps
         }
         
@@ -131,10 +132,11 @@ class DANet(nn.Module):
         causal = config['causal']
         mask_nonlinear = config['mask_nonlinear']
         iter_clustering = config['iter_clustering']
+        tol_clustering = config.get('tol_clustering')
         
         eps = config['eps']
         
-        model = cls(n_bins, embed_dim=embed_dim, hidden_channels=hidden_channels, num_blocks=num_blocks, causal=causal, mask_nonlinear=mask_nonlinear, iter_clustering=iter_clustering, eps=eps)
+        model = cls(n_bins, embed_dim=embed_dim, hidden_channels=hidden_channels, num_blocks=num_blocks, causal=causal, mask_nonlinear=mask_nonlinear, iter_clustering=iter_clustering, tol_clustering=tol_clustering, eps=eps)
 
         if load_state_dict:
             model.load_state_dict(config['state_dict'])
@@ -178,6 +180,14 @@ def _test_danet():
     
     print(input.size(), output.size())
 
+    # Inference by batched k-means
+    model.eval()
+
+    with torch.no_grad():
+        output = model(input, n_sources=n_sources)
+    
+    print(input.size(), output.size())
+
 def _test_danet_paper():
     torch.manual_seed(111)
 
@@ -6,6 +6,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from utils.utils_audio import build_window, build_optimal_window
+from utils.utils_precision import autocast_fp32
 
 EPS = 1e-12
 
@@ -46,22 +47,26 @@ class FourierEncoder(nn.Module):
         omega, n = self.frequency, self.time_seq
         window = self.window
 
-        omega_n = omega.unsqueeze(dim=1) * n.unsqueeze(dim=0)
-        if self.trainable_phase:
-            phi = self.phase
-            basis_real, basis_imag = torch.cos(-(omega_n + phi.unsqueeze(dim=1))), torch.sin(-(omega_n + phi.unsqueeze(dim=1)))
+        if self.use_fft:
+            output = self._forward_fft(input)
+            output = torch.view_as_real(output)
         else:
-            basis_real, basis_imag = torch.cos(-omega_n), torch.sin(-omega_n)
-        basis_real, basis_imag = basis_real.unsqueeze(dim=1), basis_imag.unsqueeze(dim=1)
+            omega_n = omega.unsqueeze(dim=1) * n.unsqueeze(dim=0)
+            if self.trainable_phase:
+                phi = self.phase
+                basis_real, basis_imag = torch.cos(-(omega_n + phi.unsqueeze(dim=1))), torch.sin(-(omega_n + phi.unsqueeze(dim=1)))
+            else:
+                basis_real, basis_imag = torch.cos(-omega_n), torch.sin(-omega_n)
+            basis_real, basis_imag = basis_real.unsqueeze(dim=1), basis_imag.unsqueeze(dim=1)
 
-        if not self.onesided:
-            _, basis_real_conj, _ = torch.split(basis_real, [1, n_basis // 2 - 1, 1], dim=0)
-            _, basis_imag_conj, _ = torch.split(basis_imag, [1, n_basis // 2 - 1, 1], dim=0)
-            basis_real_conj, basis_imag_conj = torch.flip(basis_real_conj, dims=(0,)), torch.flip(basis_imag_conj, dims=(0,))
-            basis_real, basis_imag = torch.cat([basis_real, basis_real_conj], dim=0), torch.cat([basis_imag, - basis_imag_conj], dim=0)
-        basis_real, basis_imag = window * basis_real, window * basis_imag
-        output_real, output_imag = F.conv1d(input, basis_real, stride=stride), F.conv1d(input, basis_imag, stride=stride)
-        output = torch.cat([output_real.unsqueeze(dim=-1), output_imag.unsqueeze(dim=-1)], dim=-1)
+            if not self.onesided:
+                _, basis_real_conj, _ = torch.split(basis_real, [1, n_basis // 2 - 1, 1], dim=0)
+                _, basis_imag_conj, _ = torch.split(basis_imag, [1, n_basis // 2 - 1, 1], dim=0)
+                basis_real_conj, basis_imag_conj = torch.flip(basis_real_conj, dims=(0,)), torch.flip(basis_imag_conj, dims=(0,))
+                basis_real, basis_imag = torch.cat([basis_real, basis_real_conj], dim=0), torch.cat([basis_imag, - basis_imag_conj], dim=0)
+            basis_real, basis_imag = window * basis_real, window * basis_imag
+            output_real, output_imag = F.conv1d(input, basis_real, stride=stride), F.conv1d(input, basis_imag, stride=stride)
+            output = torch.cat([output_real.unsqueeze(dim=-1), output_imag.unsqueeze(dim=-1)], dim=-1)
 
         if self.return_complex:
             output = torch.view_as_complex(output)
@@ -71,6 +76,42 @@ class FourierEncoder(nn.Module):
             output = output.view(batch_size, 2*n_bins, n_frames)
 
         return output
+    
+    @property
+    def use_fft(self):
+        """
+        FFT is used only when frequency and phase are fixed by configuration.
+        Trainable bases are applied by convolution even if frozen, because learned frequencies are off the DFT grid.
+        """
+        return not (self.trainable or self.trainable_phase)
+    
+    @autocast_fp32
+    def _forward_fft(self, input):
+        """
+        Args:
+            input <torch.Tensor>: (batch_size, 1, T)
+        Returns:
+            output <torch.Tensor>: Complex tensor with shape of (batch_size, n_bins, n_frames)
+        """
+        n_basis, kernel_size = self.n_basis, self.kernel_size
+
+        frames = input.squeeze(dim=1).unfold(-1, kernel_size, self.stride) # (batch_size, n_frames, kernel_size)
+        frames = self.window * frames
+
+        if kernel_size > n_basis:
+            # Samples apart by n_basis share the same phase.
+            padding = (n_basis - kernel_size % n_basis) % n_basis
+            frames = F.pad(frames, (0, padding))
+            frames = frames.view(*frames.size()[:-1], -1, n_basis).sum(dim=-2)
+        
+        if self.onesided:
+            output = torch.fft.rfft(frames, n=n_basis, dim=-1)
+        else:
+            output = torch.fft.fft(frames, n=n_basis, dim=-1)
+        
+        output = output.permute(0, 2, 1) # (batch_size, n_bins, n_frames)
+
+        return output
 
     def extra_repr(self):
         s = "{n_basis}, kernel_size={kernel_size}, stride={stride}, trainable={trainable}, onesided={onesided}, return_complex={return_complex}"
@@ -146,6 +187,11 @@ class FourierDecoder(nn.Module):
             n_bins = input.size(1)
             input_real, input_imag = torch.split(input, [n_bins // 2, n_bins // 2], dim=1)
         
+        if self.use_fft:
+            output = self._forward_fft(torch.complex(input_real, input_imag))
+
+            return output
+        
         omega_n = omega.unsqueeze(dim=1) * n.unsqueeze(dim=0)
         if self.trainable_phase:
             phi = self.phase
@@ -170,6 +216,42 @@ class FourierDecoder(nn.Module):
         output = F.conv_transpose1d(input_real, basis_real, stride=stride) - F.conv_transpose1d(input_imag, basis_imag, stride=stride)
 
         return output
+    
+    @property
+    def use_fft(self):
+        """
+        FFT is used only when frequency and phase are fixed by configuration.
+        Trainable bases are applied by transposed convolution even if frozen, because learned frequencies are off the DFT grid.
+        """
+        return not (self.trainable or self.trainable_phase)
+    
+    @autocast_fp32
+    def _forward_fft(self, input):
+        """
+        Args:
+            input <torch.Tensor>: Complex tensor with shape of (batch_size, n_bins, n_frames)
+        Returns:
+            output <torch.Tensor>: (batch_size, 1, T)
+        """
+        n_basis, kernel_size, stride = self.n_basis, self.kernel_size, self.stride
+        n_frames = input.size(-1)
+
+        if self.onesided:
+            frames = torch.fft.irfft(input, n=n_basis, dim=1) # (batch_size, n_basis, n_frames)
+        else:
+            frames = torch.fft.ifft(input, n=n_basis, dim=1).real # (batch_size, n_basis, n_frames)
+        
+        if kernel_size > n_basis:
+            # Inverse DFT is periodic with n_basis.
+            n_repeats = (kernel_size - 1) // n_basis + 1
+            frames = frames.repeat(1, n_repeats, 1)
+        
+        frames = frames[:, :kernel_size]
+        frames = self.optimal_window.unsqueeze(dim=1) * frames
+        output = F.fold(frames, output_size=(1, (n_frames - 1) * stride + kernel_size), kernel_size=(1, kernel_size), stride=(1, stride)) # Overlap-add
+        output = output.squeeze(dim=2)
+
+        return output
 
     def extra_repr(self):
         s = "{n_basis}, kernel_size={kernel_size}, stride={stride}, trainable={trainable}, onesided={onesided}"
@@ -476,6 +558,16 @@ def _test_fourier():
     plt.savefig('data/filterbank/spectrogram-stft.png', bbox_inches='tight')
     plt.close()
 
+    # Frozen trainable bases keep learned frequencies.
+    encoder = FourierEncoder(n_basis, kernel_size, stride=stride, window_fn='hann', trainable=True, onesided=onesided, return_complex=return_complex)
+
+    with torch.no_grad():
+        encoder.frequency.add_(0.1 * torch.randn_like(encoder.frequency))
+
+    spectrogram = encoder(input)
+    encoder.requires_grad_(False)
+    print(encoder.use_fft, torch.allclose(encoder(input), spectrogram))
+
     n_basis = kernel_size
     encoder = FourierEncoder(n_basis, kernel_size, stride=stride, window_fn='hann', onesided=onesided, return_complex=return_complex)
     decoder = FourierDecoder(n_basis, kernel_size, stride=stride, window_fn='hann', onesided=onesided)
@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from utils.utils_precision import autocast_fp32
+
 EPS = 1e-12
 
 class MetaTasNet(nn.Module):
@@ -633,6 +635,7 @@ class Spectrogram(nn.Module):
 
         return output
     
+    @autocast_fp32
     def compute_magnitude(self, wave):
         fft_size, hop_size = self.fft_size, self.hop_size
 
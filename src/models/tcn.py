@@ -41,6 +41,39 @@ class TemporalConvNet(nn.Module):
         output = skip_connection
         
         return output
+    
+    def init_state(self, batch_size=1):
+        """
+        Returns:
+            state <list>: States of blocks
+        """
+        state = [self.net[idx].init_state(batch_size) for idx in range(self.num_blocks)]
+        
+        return state
+    
+    def forward_chunk(self, input, state):
+        """
+        Args:
+            input (batch_size, num_features, T): T is number of frames in chunk.
+            state <list>: States returned by `init_state` or previous `forward_chunk`.
+        Returns:
+            output (batch_size, skip_channels, T)
+            state <list>: Updated states
+        """
+        num_blocks = self.num_blocks
+        
+        x = input
+        skip_connection = 0
+        next_state = []
+        
+        for idx in range(num_blocks):
+            x, skip, _state = self.net[idx].forward_chunk(x, state[idx])
+            skip_connection = skip_connection + skip
+            next_state.append(_state)
+
+        output = skip_connection
+        
+        return output, next_state
 
 class ConvBlock1d(nn.Module):
     def __init__(self, num_features, hidden_channels=256, skip_channels=256, kernel_size=3, num_layers=10, dilated=True, separable=False, causal=True, nonlinear=None, norm=True, dual_head=True, eps=EPS):
@@ -75,6 +108,25 @@ class ConvBlock1d(nn.Module):
             skip_connection = skip_connection + skip
 
         return x, skip_connection
+    
+    def init_state(self, batch_size=1):
+        state = [self.net[idx].init_state(batch_size) for idx in range(self.num_layers)]
+        
+        return state
+    
+    def forward_chunk(self, input, state):
+        num_layers = self.num_layers
+        
+        x = input
+        skip_connection = 0
+        next_state = []
+        
+        for idx in range(num_layers):
+            x, skip, _state = self.net[idx].forward_chunk(x, state[idx])
+            skip_connection = skip_connection + skip
+            next_state.append(_state)
+
+        return x, skip_connection, next_state
 
 class ResidualBlock1d(nn.Module):
     def __init__(self, num_features, hidden_channels=256, skip_channels=256, kernel_size=3, stride=2, dilation=1, separable=False, causal=True, nonlinear=None, norm=True, dual_head=True, eps=EPS):
@@ -146,6 +198,76 @@ class ResidualBlock1d(nn.Module):
             output = output + residual
             
         return output, skip
+    
+    def init_state(self, batch_size=1):
+        """
+        Returns:
+            state <dict>:
+                buffer (batch_size, hidden_channels, (kernel_size - 1) * dilation): Past frames of input of dilated convolution
+                norm <tuple>: Running statistics of cumulative layer normalization
+                separable <dict>: State of depthwise separable convolution
+        """
+        kernel_size, dilation = self.kernel_size, self.dilation
+        
+        assert self.causal, "Only causal model supports streaming."
+        assert self.stride == 1, "Only dilated model supports streaming."
+        
+        weight = self.bottleneck_conv1d.weight
+        hidden_channels = weight.size(0)
+        
+        state = {
+            'buffer': weight.new_zeros(batch_size, hidden_channels, (kernel_size - 1) * dilation)
+        }
+        
+        if self.norm:
+            state['norm'] = self.norm1d.init_state(batch_size)
+        if self.separable:
+            state['separable'] = self.separable_conv1d.init_state(batch_size)
+        
+        return state
+    
+    def forward_chunk(self, input, state):
+        """
+        Equivalent to `forward` of causal model, where past frames are cached in `state` instead of zero padding.
+        Args:
+            input (batch_size, num_features, T): T is number of frames in chunk.
+            state <dict>: State returned by `init_state` or previous `forward_chunk`.
+        Returns:
+            output (batch_size, num_features, T) or None
+            skip (batch_size, skip_channels, T)
+            state <dict>: Updated state
+        """
+        nonlinear, norm = self.nonlinear, self.norm
+        separable = self.separable
+        dual_head = self.dual_head
+        
+        next_state = {}
+        
+        residual = input
+        x = self.bottleneck_conv1d(input)
+        
+        if nonlinear:
+            x = self.nonlinear1d(x)
+        if norm:
+            x, next_state['norm'] = self.norm1d.forward_chunk(x, state['norm'])
+        
+        buffer = state['buffer']
+        x = torch.cat([buffer, x], dim=2)
+        next_state['buffer'] = x[:, :, x.size(2) - buffer.size(2):]
+        
+        if separable:
+            output, skip, next_state['separable'] = self.separable_conv1d.forward_chunk(x, state['separable']) # output may be None
+        else:
+            if dual_head:
+                output = self.output_conv1d(x)
+            else:
+                output = None
+            skip = self.skip_conv1d(x)
+        
+        if output is not None:
+            output = output + residual
+            
+        return output, skip, next_state
 
 class DepthwiseSeparableConv1d(nn.Module):
     def __init__(self, in_channels, out_channels=256, skip_channels=256, kernel_size=3, stride=2, dilation=1, causal=True, nonlinear=None, norm=True, dual_head=True, eps=EPS):
@@ -192,6 +314,43 @@ class DepthwiseSeparableConv1d(nn.Module):
         skip = self.skip_pointwise_conv1d(x)
         
         return output, skip
+    
+    def init_state(self, batch_size=1):
+        state = {}
+        
+        if self.norm:
+            state['norm'] = self.norm1d.init_state(batch_size)
+        
+        return state
+    
+    def forward_chunk(self, input, state):
+        """
+        Args:
+            input (batch_size, in_channels, T + (kernel_size - 1) * dilation): Chunk concatenated with past frames.
+            state <dict>: State returned by `init_state` or previous `forward_chunk`.
+        Returns:
+            output (batch_size, out_channels, T) or None
+            skip (batch_size, skip_channels, T)
+            state <dict>: Updated state
+        """
+        nonlinear, norm = self.nonlinear, self.norm
+        dual_head = self.dual_head
+        
+        next_state = {}
+        
+        x = self.depthwise_conv1d(input)
+        
+        if nonlinear:
+            x = self.nonlinear1d(x)
+        if norm:
+            x, next_state['norm'] = self.norm1d.forward_chunk(x, state['norm'])
+        if dual_head:
+            output = self.output_pointwise_conv1d(x)
+        else:
+            output = None
+        skip = self.skip_pointwise_conv1d(x)
+        
+        return output, skip, next_state
 
 def _test_tcn():
     batch_size = 4
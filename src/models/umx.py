@@ -2,6 +2,8 @@ import yaml
 import torch
 import torch.nn as nn
 
+from utils.utils_parallel import forward_targets
+
 __sources__ = ['drums', 'bass', 'other', 'vocals']
 EPS = 1e-12
 
@@ -36,11 +38,17 @@ class ParallelOpenUnmix(nn.Module):
 
         self.in_channels = in_channels
 
-    def forward(self, input, target=None):
-        if type(target) is not str:
-            raise TypeError("`target` is expected str, but given {}".format(type(target)))
-        
-        output = self.net[target](input)
+    def forward(self, input, target=None, batch_size=None, n_threads=1):
+        """
+        Args:
+            input (batch_size, in_channels, n_bins, n_frames): Amplitude of mixture, e.g. patches of a song
+            target <str> or <list<str>>: Target(s) to be estimated. If None, all targets are estimated.
+            batch_size <int>: Number of patches fed to each network at once. If None, all patches are fed at once.
+            n_threads <int>: Number of threads to run networks of targets concurrently. Valid only on CPU.
+        Returns:
+            output (batch_size, in_channels, n_bins, n_frames) if target is str, otherwise (batch_size, n_targets, in_channels, n_bins, n_frames)
+        """
+        output = forward_targets(self.net, input, target=target, batch_size=batch_size, n_threads=n_threads)
 
         return output
     
@@ -498,10 +506,51 @@ def _test_crossnet_openunmix():
     print(model)
     print(input.size(), output.size())
 
+def _test_parallel_openunmix():
+    batch_size = 8
+    in_channels = 2
+    n_bins, max_bin = 2049, 1487
+    n_frames = 64
+    sources = ['drums', 'bass', 'other', 'vocals']
+
+    input = torch.randn(batch_size, in_channels, n_bins, n_frames)
+
+    print('='*10, "ParallelOpenUnmix", '='*10)
+    modules = {
+        source: OpenUnmix(in_channels=in_channels, hidden_channels=128, n_bins=n_bins, max_bin=max_bin) for source in sources
+    }
+    model = ParallelOpenUnmix(modules)
+    model.eval()
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        output_serial = []
+
+        for _input in input:
+            _output = [model(_input.unsqueeze(dim=0), target=source) for source in sources]
+            output_serial.append(torch.stack(_output, dim=1))
+        
+        output_serial = torch.cat(output_serial, dim=0)
+        end = time.perf_counter()
+        print("Serial: {:.3f}[sec]".format(end - start))
+
+        start = time.perf_counter()
+        output = model(input, target=sources, batch_size=4, n_threads=len(sources))
+        end = time.perf_counter()
+        print("Batched: {:.3f}[sec]".format(end - start))
+
+    print(input.size(), output.size())
+    print(torch.abs(output - output_serial).max().item())
+
 if __name__ == '__main__':
+    import time
+
     torch.manual_seed(111)
 
     _test_openunmix()
     print()
 
-    _test_crossnet_openunmix()
\ No newline at end of file
+    _test_crossnet_openunmix()
+    print()
+
+    _test_parallel_openunmix()
\ No newline at end of file
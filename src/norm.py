@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 
+from utils.utils_precision import autocast_fp32
+
 EPS = 1e-12
 
 """
@@ -48,6 +50,8 @@ class CumulativeLayerNorm1d(nn.Module):
 
         self.gamma = nn.Parameter(torch.Tensor(1, num_features, 1))
         self.beta = nn.Parameter(torch.Tensor(1, num_features, 1))
+
+        self._cum_num = None # Cache of [C, 2*C, ..., T*C]
         
         self._reset_parameters()
         
@@ -62,6 +66,38 @@ class CumulativeLayerNorm1d(nn.Module):
         Returns:
             output (batch_size, C, T) or (batch_size, C, S, chunk_size): same shape as the input
         """
+        output, _ = self._forward(input)
+        
+        return output
+    
+    def init_state(self, batch_size=1):
+        """
+        Running statistics are kept in float64, so that they are accurate even for long stream.
+        Returns:
+            state <tuple>: (cum_sum, cum_squared_sum, cum_num), each of which is (batch_size,)
+        """
+        cum_sum = self.gamma.new_zeros(batch_size, dtype=torch.double)
+        cum_squared_sum = self.gamma.new_zeros(batch_size, dtype=torch.double)
+        cum_num = self.gamma.new_zeros(batch_size, dtype=torch.double)
+
+        return cum_sum, cum_squared_sum, cum_num
+
+    def forward_chunk(self, input, state):
+        """
+        Normalize chunk by statistics accumulated from the beginning of the stream, which costs O(T) instead of O(total length).
+        Args:
+            input (batch_size, C, T) or (batch_size, C, S, chunk_size): T (or S * chunk_size) is length of chunk.
+            state <tuple>: (cum_sum, cum_squared_sum, cum_num) returned by `init_state` or previous `forward_chunk`.
+        Returns:
+            output (batch_size, C, T) or (batch_size, C, S, chunk_size): same shape as the input
+            state <tuple>: Updated (cum_sum, cum_squared_sum, cum_num)
+        """
+        output, state = self._forward(input, state=state)
+
+        return output, state
+
+    @autocast_fp32
+    def _forward(self, input, state=None):
         eps = self.eps
 
         n_dim = input.dim()
@@ -80,21 +116,44 @@ class CumulativeLayerNorm1d(nn.Module):
         step_pow_sum = input_pow.sum(dim=1) # -> (batch_size, T)
         cum_sum = torch.cumsum(step_sum, dim=1) # -> (batch_size, T)
         cum_squared_sum = torch.cumsum(step_pow_sum, dim=1) # -> (batch_size, T)
+        cum_num = self._get_cum_num(T, input) # -> (T, ): [C, 2*C, ..., T*C]
+
+        if state is None:
+            next_state = None
+        else:
+            prev_cum_sum, prev_cum_squared_sum, prev_cum_num = state
+            cum_sum = cum_sum + prev_cum_sum.unsqueeze(dim=1)
+            cum_squared_sum = cum_squared_sum + prev_cum_squared_sum.unsqueeze(dim=1)
+            cum_num = cum_num + prev_cum_num.unsqueeze(dim=1) # -> (batch_size, T)
+            next_state = (cum_sum[:, -1], cum_squared_sum[:, -1], cum_num[:, -1])
         
-        cum_num = torch.arange(C, C*(T+1), C, dtype=torch.float) # -> (T, ): [C, 2*C, ..., T*C]
         cum_mean = cum_sum / cum_num # (batch_size, T)
         cum_squared_mean = cum_squared_sum / cum_num
         cum_var = cum_squared_mean - cum_mean**2
         
-        cum_mean = cum_mean.unsqueeze(dim=1)
-        cum_var = cum_var.unsqueeze(dim=1)
+        cum_mean = cum_mean.unsqueeze(dim=1).to(input.dtype)
+        cum_var = cum_var.unsqueeze(dim=1).to(input.dtype)
         
         output = (input - cum_mean) / (torch.sqrt(cum_var) + eps) * self.gamma + self.beta
 
         if n_dim == 4:
             output = output.view(batch_size, C, S, chunk_size)
         
-        return output
+        return output, next_state
+
+    def _get_cum_num(self, T, input):
+        """
+        Returns [C, 2*C, ..., T*C] on the same device as input.
+        The array is cached and reallocated only when longer one, another device or dtype is required.
+        """
+        C = self.num_features
+        cum_num = self._cum_num
+
+        if cum_num is None or cum_num.size(0) < T or cum_num.device != input.device or cum_num.dtype != input.dtype:
+            cum_num = torch.arange(C, C*(T+1), C, dtype=input.dtype, device=input.device)
+            self._cum_num = cum_num
+
+        return cum_num[:T]
     
     def __repr__(self):
         s = '{}'.format(self.__class__.__name__)
@@ -116,4 +175,20 @@ if __name__ == '__main__':
     input = torch.arange(batch_size*C*T, dtype=torch.float).view(batch_size, C, T)
     output = norm(input)
     print(input)
-    print(output)
\ No newline at end of file
+    print(output)
+
+    norm = CumulativeLayerNorm1d(C)
+    print(norm)
+
+    input = torch.randn(batch_size, C, 4*T)
+    output = norm(input)
+
+    state = norm.init_state(batch_size)
+    output_chunk = []
+
+    for idx in range(0, 4*T, T):
+        _output, state = norm.forward_chunk(input[:, :, idx: idx + T], state)
+        output_chunk.append(_output)
+
+    output_chunk = torch.cat(output_chunk, dim=2)
+    print(torch.abs(output - output_chunk).max().item())
\ No newline at end of file
@@ -1,6 +1,6 @@
 import random
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import torch
 
 def set_seed(seed):
@@ -9,22 +9,23 @@ def set_seed(seed):
     torch.manual_seed(seed)
 
 def draw_loss_curve(train_loss, valid_loss=None, save_path='./loss.png'):
-    plt.figure()
+    # Figure is used instead of pyplot, so that the curve can be drawn on background thread.
+    fig = Figure()
+    ax = fig.add_subplot()
 
     epochs = range(1, len(train_loss) + 1)
 
     if isinstance(train_loss, torch.Tensor):
         train_loss = train_loss.numpy()
 
-    plt.plot(epochs, train_loss, label='train')
+    ax.plot(epochs, train_loss, label='train')
 
     if valid_loss is not None:
         if isinstance(valid_loss, torch.Tensor):
             valid_loss = valid_loss.numpy()
-        plt.plot(epochs, valid_loss, label='valid')
+        ax.plot(epochs, valid_loss, label='valid')
 
-    plt.xlabel('Epochs')
-    plt.ylabel('Loss')
-    plt.legend()
-    plt.savefig(save_path, bbox_inches='tight')
-    plt.close()
+    ax.set_xlabel('Epochs')
+    ax.set_ylabel('Loss')
+    ax.legend()
+    fig.savefig(save_path, bbox_inches='tight')
@@ -33,12 +33,12 @@ def build_Fourier_bases(fft_size, normalize=False):
         fft_size <int>:
         normalize <bool>:
     """
-    k = torch.arange(0, fft_size, dtype=torch.float)
-    n = torch.arange(0, fft_size, dtype=torch.float)
-    k, n = torch.meshgrid(k, n)
+    k = torch.arange(0, fft_size)
+    n = torch.arange(0, fft_size)
+    k_n = torch.outer(k, n) % fft_size # Reduce phase into [0, 2*pi) to keep precision
 
-    cos_bases = torch.cos(2*math.pi*k*n/fft_size)
-    sin_bases = torch.sin(2*math.pi*k*n/fft_size)
+    cos_bases = torch.cos(2*math.pi*k_n/fft_size)
+    sin_bases = torch.sin(2*math.pi*k_n/fft_size)
     
     if normalize:
         norm = math.sqrt(fft_size)
@@ -0,0 +1,197 @@
+import atexit
+import os
+import queue
+import threading
+
+import torch
+
+class CheckpointWriter:
+    """
+    Save checkpoints and run other jobs (e.g. drawing loss curve) on background thread, so that training is not blocked by disk I/O.
+    Tensors are copied to CPU when `save` is called, so parameters can be updated while the copy is written.
+    Jobs are processed in order of submission.
+    """
+    def __init__(self, max_to_keep=1, max_pending=2):
+        """
+        Args:
+            max_to_keep <int>: Number of checkpoints kept for each path. Older ones are renamed to <path>.1, <path>.2, ...
+            max_pending <int>: Max number of jobs waiting to be processed. `save` blocks when it is reached, which bounds memory for CPU copies.
+        """
+        if max_to_keep < 1:
+            raise ValueError("max_to_keep is expected positive, but given {}.".format(max_to_keep))
+
+        self.max_to_keep = max_to_keep
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        # Pending checkpoints are written even if training stops by exception.
+        atexit.register(self.close)
+
+    def save(self, obj, path):
+        """
+        Same interface as `torch.save`, but the file is written on background thread and replaced atomically.
+        Args:
+            obj <dict>: Checkpoint, which can include tensors on GPU.
+            path <str>: Path to checkpoint
+        """
+        self._raise_error()
+
+        obj = to_cpu(obj)
+        self.queue.put((save_atomic, (obj, path), {'max_to_keep': self.max_to_keep}))
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` on background thread. Arguments should not be modified after submission.
+        """
+        self._raise_error()
+
+        self.queue.put((func, args, kwargs))
+
+    def flush(self):
+        """
+        Wait until all submitted jobs finish.
+        """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread is None:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+
+            try:
+                if job is None:
+                    return
+
+                func, args, kwargs = job
+                func(*args, **kwargs)
+            except Exception as e:
+                # Reported by the next call on the main thread. The first error is kept.
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+def save_atomic(obj, path, max_to_keep=1):
+    """
+    Write to temporary file in the same directory and rename it, so that `path` is never left half-written.
+    Args:
+        obj <dict>: Checkpoint
+        path <str>: Path to checkpoint
+        max_to_keep <int>: Number of checkpoints kept for `path`. Older ones are renamed to <path>.1, <path>.2, ...
+    """
+    tmp_path = "{}.tmp".format(path)
+
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    for idx in range(max_to_keep - 1, 0, -1):
+        src_path = path if idx == 1 else "{}.{}".format(path, idx - 1)
+
+        if os.path.exists(src_path):
+            os.replace(src_path, "{}.{}".format(path, idx))
+
+    os.replace(tmp_path, path)
+
+def to_cpu(obj):
+    """
+    Copy tensors in nested dict, list or tuple to CPU. Tensors already on CPU are copied as well, because they may be updated in-place.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+
+    if isinstance(obj, dict):
+        return obj.__class__((key, to_cpu(value)) for key, value in obj.items())
+
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(to_cpu(value) for value in obj)
+
+    return obj
+
+def _test_checkpoint_writer():
+    import tempfile
+    import time
+
+    import torch.nn as nn
+
+    torch.manual_seed(111)
+
+    model = nn.Sequential(nn.Linear(2048, 2048), nn.Linear(2048, 2048))
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+
+    loss = model(torch.randn(4, 2048)).sum()
+    loss.backward()
+    optimizer.step()
+
+    def build_config():
+        return {
+            'state_dict': model.state_dict(),
+            'optim_dict': optimizer.state_dict(),
+            'epoch': 1
+        }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, "last.pth")
+
+        start = time.perf_counter()
+        torch.save(build_config(), model_path)
+        end = time.perf_counter()
+        print("torch.save: {:.4f}[sec]".format(end - start))
+
+        writer = CheckpointWriter(max_to_keep=3)
+        weights = []
+
+        for epoch in range(4):
+            weights.append(model[0].weight.detach().clone())
+
+            start = time.perf_counter()
+            writer.save(build_config(), model_path)
+            end = time.perf_counter()
+
+            if epoch == 0:
+                print("CheckpointWriter.save: {:.4f}[sec]".format(end - start))
+
+            # Update parameters while the checkpoint is written.
+            with torch.no_grad():
+                model[0].weight.add_(1)
+
+        writer.submit(lambda path: open(path, 'w').close(), os.path.join(tmp_dir, "loss.png"))
+        writer.flush()
+
+        print(sorted(os.listdir(tmp_dir)))
+
+        for idx, path in enumerate([model_path, model_path + ".1", model_path + ".2"]):
+            config = torch.load(path)
+            print(path[len(tmp_dir) + 1:], torch.equal(config['state_dict']['0.weight'], weights[-1 - idx]))
+
+        writer.submit(lambda: 1 / 0)
+
+        try:
+            writer.flush()
+        except ZeroDivisionError as e:
+            print("Error on background thread:", repr(e))
+
+        writer.close()
+
+if __name__ == '__main__':
+    _test_checkpoint_writer()
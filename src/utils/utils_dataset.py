@@ -0,0 +1,886 @@
+import os
+import json
+import hashlib
+import time
+import warnings
+import uuid
+
+import numpy as np
+import torch
+import torchaudio
+
+INDEX_VERSION = 1
+PACKED_AUDIO_FILENAME = 'audio.bin'
+PACKED_INDEX_FILENAME = 'index.json'
+MAX_AMPLITUDE = 0.9
+EPS = 1e-12
+
+def build_n_frames_index(wav_root, list_path, sub_dir='mix', cache=True):
+    """
+    Build index of the number of frames of each utterance in `list_path`.
+    Only headers are read by `torchaudio.info`, so audio is not decoded.
+    The index is cached next to `list_path` and each entry is invalidated when mtime or size of the wav file is changed.
+    Args:
+        wav_root <str>: Root directory of wav files
+        list_path <str>: Path to list, each line of which is an utterance ID
+        sub_dir <str>: Sub-directory of wav files under `wav_root`, e.g. 'mix' or 'mix_both'
+        cache <bool>: If True, the index is loaded from and saved to the cache file.
+    Returns:
+        index <list<tuple<str, int>>>: (ID, n_frames) in order of `list_path`
+    """
+    wav_dir = os.path.join(os.path.abspath(wav_root), sub_dir)
+    list_path = os.path.abspath(list_path)
+    cache_path = _get_cache_path(wav_dir, list_path)
+
+    cached_entries = {}
+
+    if cache and os.path.exists(cache_path):
+        cached_entries = _load_cache(cache_path, wav_dir)
+
+    entries = {}
+    index = []
+    updated = False
+
+    with open(list_path) as f:
+        for line in f:
+            ID = line.strip()
+
+            if not ID:
+                continue
+
+            wav_path = os.path.join(wav_dir, '{}.wav'.format(ID))
+            stat = os.stat(wav_path)
+            entry = cached_entries.get(ID)
+
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                entry = {
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'n_frames': torchaudio.info(wav_path).num_frames
+                }
+                updated = True
+
+            entries[ID] = entry
+            index.append((ID, entry['n_frames']))
+
+    if cache and (updated or len(entries) != len(cached_entries)):
+        _save_cache(cache_path, wav_dir, entries)
+
+    return index
+
+def _get_cache_path(wav_dir, list_path):
+    # The same list is shared among sampling rates and min/max, so key the cache by wav directory.
+    digest = hashlib.md5(wav_dir.encode()).hexdigest()[:10]
+    list_dir, list_name = os.path.split(list_path)
+
+    return os.path.join(list_dir, '{}.{}.index.json'.format(list_name, digest))
+
+def _load_cache(cache_path, wav_dir):
+    try:
+        with open(cache_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if data.get('version') != INDEX_VERSION or data.get('wav_dir') != wav_dir:
+        return {}
+
+    return data['entries']
+
+def _save_cache(cache_path, wav_dir, entries):
+    data = {
+        'version': INDEX_VERSION,
+        'wav_dir': wav_dir,
+        'entries': entries
+    }
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        warnings.warn("Failed to save index to {}: {}".format(cache_path, e))
+
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def pack_audio(paths, pack_dir, root=None, dtype='float32'):
+    """
+    Pack audio files into a single contiguous array, which is memory-mapped by `PackedAudio`.
+    Each file is stored as (n_channels, n_frames) block.
+    Args:
+        paths <list<str>>: Paths to audio files
+        pack_dir <str>: Output directory, which contains `audio.bin` and `index.json`.
+        root <str>: If given, paths are relative to `root` and stored as keys as they are.
+        dtype <str>: 'float32' or 'int16'. 'int16' halves the size, but loaded audio is copied for conversion.
+    """
+    assert dtype in ['float32', 'int16'], "dtype is expected 'float32' or 'int16', but given {}.".format(dtype)
+
+    os.makedirs(pack_dir, exist_ok=True)
+
+    entries = {}
+    total = 0
+
+    for path in paths:
+        key = _get_packed_key(path, root=root)
+
+        if key in entries:
+            continue
+
+        stat = os.stat(_get_packed_path(key, root=root))
+        info = torchaudio.info(_get_packed_path(key, root=root))
+        entries[key] = {
+            'offset': total,
+            'n_channels': info.num_channels,
+            'n_frames': info.num_frames,
+            'sample_rate': info.sample_rate,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size
+        }
+        total += info.num_channels * info.num_frames
+
+    audio_path = os.path.join(pack_dir, PACKED_AUDIO_FILENAME)
+    audio = np.memmap(audio_path, dtype=dtype, mode='w+', shape=(max(total, 1),))
+
+    for key, entry in entries.items():
+        wave, _ = torchaudio.load(_get_packed_path(key, root=root))
+        n_channels, n_frames = wave.size()
+
+        assert n_channels == entry['n_channels'] and n_frames == entry['n_frames'], "Header of {} is inconsistent with its data.".format(key)
+
+        if dtype == 'int16':
+            wave = torch.clamp(torch.round(wave * 32768), -32768, 32767)
+
+        start, end = entry['offset'], entry['offset'] + n_channels * n_frames
+        audio[start: end] = wave.numpy().reshape(-1).astype(dtype)
+
+    audio.flush()
+    del audio
+
+    data = {
+        'version': INDEX_VERSION,
+        'dtype': dtype,
+        'size': total,
+        'entries': entries
+    }
+
+    with open(os.path.join(pack_dir, PACKED_INDEX_FILENAME), 'w') as f:
+        json.dump(data, f)
+
+class PackedAudio:
+    """
+    Audio store packed by `pack_audio`.
+    The array is memory-mapped lazily, so that each worker of DataLoader maps it by itself.
+    """
+    def __init__(self, pack_dir, root=None):
+        self.pack_dir = os.path.abspath(pack_dir)
+        self.root = root
+
+        with open(os.path.join(self.pack_dir, PACKED_INDEX_FILENAME)) as f:
+            data = json.load(f)
+
+        self.dtype = data['dtype']
+        self.size = data['size']
+        self.entries = data['entries']
+
+        self.audio = None
+
+    def __contains__(self, path):
+        return _get_packed_key(path, root=self.root) in self.entries
+
+    def is_stale(self, path):
+        """
+        Returns True if `path` is not packed, or mtime or size of the file is changed after packing.
+        """
+        key = _get_packed_key(path, root=self.root)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return True
+
+        stat = os.stat(_get_packed_path(key, root=self.root))
+
+        return entry.get('mtime') != stat.st_mtime_ns or entry.get('size') != stat.st_size
+
+    def __getstate__(self):
+        # Don't pickle memory-mapped array itself.
+        state = self.__dict__.copy()
+        state['audio'] = None
+
+        return state
+
+    def load(self, path, frame_offset=0, num_frames=-1):
+        """
+        Same interface as `torchaudio.load`.
+        Args:
+            path <str>: Path to audio file, which is packed.
+        Returns:
+            wave (n_channels, num_frames) <torch.Tensor>: View of memory-mapped array if dtype is float32.
+            sample_rate <int>
+        """
+        if self.audio is None:
+            # Copy-on-write mode, because torch.from_numpy warns non-writable array.
+            self.audio = np.memmap(os.path.join(self.pack_dir, PACKED_AUDIO_FILENAME), dtype=self.dtype, mode='c', shape=(max(self.size, 1),))
+
+        entry = self.entries[_get_packed_key(path, root=self.root)]
+        offset, n_channels, n_frames = entry['offset'], entry['n_channels'], entry['n_frames']
+
+        if num_frames < 0:
+            num_frames = n_frames - frame_offset
+
+        wave = self.audio[offset: offset + n_channels * n_frames].reshape(n_channels, n_frames)
+        wave = torch.from_numpy(wave[:, frame_offset: frame_offset + num_frames])
+
+        if self.dtype == 'int16':
+            wave = wave.float() / 32768
+
+        return wave, entry['sample_rate']
+
+def build_packed_audio(paths, pack_dir, root=None, dtype='float32'):
+    """
+    Returns `PackedAudio` in `pack_dir`. Audio files are packed again if `pack_dir` doesn't contain all of them, or any of them is changed after packing.
+    """
+    index_path = os.path.join(pack_dir, PACKED_INDEX_FILENAME)
+
+    if os.path.exists(index_path):
+        packed_audio = PackedAudio(pack_dir, root=root)
+
+        if packed_audio.dtype == dtype and not any([packed_audio.is_stale(path) for path in paths]):
+            return packed_audio
+
+    pack_audio(paths, pack_dir, root=root, dtype=dtype)
+
+    return PackedAudio(pack_dir, root=root)
+
+def _get_packed_key(path, root=None):
+    if root is None:
+        return os.path.abspath(path)
+
+    root = os.path.abspath(root)
+
+    return os.path.relpath(os.path.join(root, path), root)
+
+def _get_packed_path(key, root=None):
+    if root is None:
+        return key
+
+    return os.path.join(root, key)
+
+class FeatureCache:
+    """
+    On-disk cache of complex spectrograms.
+    Each feature is saved as .npy file in one of `n_shards` sub-directories, and memory-mapped when loaded.
+    When total size exceeds `max_bytes`, least recently used features are evicted.
+    The cache is shared among workers of DataLoader via file system, so each worker can be given the same instance.
+    Each worker checks the cap with on-disk size scanned after it writes `scan_bytes`, so total size can exceed `max_bytes` by `n_workers * scan_bytes` at most.
+    """
+    def __init__(self, cache_dir, max_bytes=None, dtype='complex64', n_shards=16, touch_interval=60, scan_bytes=None):
+        """
+        Args:
+            cache_dir <str>: Directory of cache
+            max_bytes <int>: Size cap in bytes. If None, cache is never evicted.
+            dtype <str>: 'complex64' or 'float16'. 'float16' stores magnitude and phase as float16, which halves the size but loses precision.
+            n_shards <int>: Number of sub-directories
+            touch_interval <float>: Feature is marked as recently used only if it was not marked in last `touch_interval` seconds.
+            scan_bytes <int>: Bytes written by each worker between scans of on-disk size. Default: max_bytes // 16.
+        """
+        assert dtype in ['complex64', 'float16'], "dtype is expected 'complex64' or 'float16', but given {}.".format(dtype)
+
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.n_shards = n_shards
+        self.touch_interval = touch_interval
+
+        if scan_bytes is None and max_bytes is not None:
+            scan_bytes = max_bytes // 16
+
+        self.scan_bytes = scan_bytes
+
+        for shard_idx in range(n_shards):
+            os.makedirs(self._get_shard_dir(shard_idx), exist_ok=True)
+        
+        self.size = None # On-disk size at last scan + bytes written by this process since then
+        self.written = 0 # Bytes written by this process since last scan
+
+    def get(self, key):
+        """
+        Args:
+            key <tuple>: Hashable description of feature, e.g. (path, start, end, fft_size, hop_size, window_fn, normalize)
+        Returns:
+            feature <torch.Tensor>: Complex tensor. Returns None if `key` is not cached.
+        """
+        path = self._get_path(key)
+
+        try:
+            # Copy-on-write mode, because torch.from_numpy warns non-writable array.
+            feature = np.load(path, mmap_mode='c')
+
+            # Mark as recently used. mtime is updated only once in `touch_interval`, because it is a write to file system.
+            if os.stat(path).st_mtime < time.time() - self.touch_interval:
+                os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        if self.dtype == 'float16':
+            amplitude, phase = torch.from_numpy(feature[0]).float(), torch.from_numpy(feature[1]).float()
+            feature = torch.polar(amplitude, phase)
+        else:
+            feature = torch.from_numpy(feature)
+
+        return feature
+
+    def put(self, key, feature):
+        """
+        Args:
+            key <tuple>: Hashable description of feature
+            feature <torch.Tensor>: Complex tensor
+        """
+        path = self._get_path(key)
+        feature = feature.detach().cpu()
+
+        if self.dtype == 'float16':
+            feature = torch.stack([torch.abs(feature), torch.angle(feature)], dim=0).half()
+        else:
+            feature = feature.to(torch.complex64)
+        
+        feature = feature.numpy()
+        tmp_path = '{}.{}.tmp.npy'.format(path[:-len('.npy')], uuid.uuid4().hex)
+
+        try:
+            np.save(tmp_path, feature)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            warnings.warn("Failed to save feature to {}: {}".format(path, e))
+
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            
+            return
+
+        if self.max_bytes is None:
+            return
+
+        self.written += feature.nbytes
+
+        if self.size is None or self.written >= self.scan_bytes:
+            # Other workers also write to the cache.
+            self.size = sum([size for _, _, size in self._scan()])
+            self.written = 0
+        else:
+            self.size += feature.nbytes
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self, ratio=0.9):
+        """
+        Remove least recently used features until total size is less than `ratio * max_bytes`.
+        """
+        entries = sorted(self._scan(), key=lambda entry: entry[1])
+        size = sum([size for _, _, size in entries])
+
+        for path, _, entry_size in entries:
+            if size <= ratio * self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                # Removed by another worker
+                pass
+
+            size -= entry_size
+
+        self.size = size
+        self.written = 0
+
+    def _scan(self):
+        entries = []
+
+        for shard_idx in range(self.n_shards):
+            with os.scandir(self._get_shard_dir(shard_idx)) as it:
+                for entry in it:
+                    if not entry.name.endswith('.npy') or '.tmp' in entry.name:
+                        continue
+
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+
+        return entries
+
+    def _get_path(self, key):
+        digest = hashlib.md5(repr((self.dtype,) + tuple(key)).encode()).hexdigest()
+        shard_idx = int(digest[:8], 16) % self.n_shards
+
+        return os.path.join(self._get_shard_dir(shard_idx), '{}.npy'.format(digest))
+
+    def _get_shard_dir(self, shard_idx):
+        return os.path.join(self.cache_dir, 'shard-{:03d}'.format(shard_idx))
+
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler which groups utterances of similar length.
+    Utterances are sorted by length and packed greedily, so that padded size of each batch (batch_size * max length) doesn't exceed `max_samples`.
+    Utterance longer than `max_samples` forms a batch by itself.
+    """
+    def __init__(self, lengths, max_samples, max_batch_size=None, shuffle=False, generator=None):
+        """
+        Args:
+            lengths <list<int>>: Number of samples of each utterance, e.g. end - start of segment index.
+            max_samples <int>: Budget of total samples per batch including padding.
+            max_batch_size <int>: Max number of utterances per batch. If None, only `max_samples` is considered.
+            shuffle <bool>: If True, order of batches and utterances of the same length are shuffled every epoch.
+            generator <torch.Generator>: Generator used for shuffling.
+        """
+        self.lengths = [int(length) for length in lengths]
+        self.max_samples = max_samples
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.generator = generator
+
+        # Sizes of batches depend only on sorted lengths, which are independent of shuffling.
+        self.batch_sizes = [len(batch) for batch in self._pack(sorted(range(len(self.lengths)), key=lambda idx: self.lengths[idx]))]
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = torch.randperm(len(self.lengths), generator=self.generator).tolist()
+        else:
+            indices = list(range(len(self.lengths)))
+
+        # Stable sort keeps random order among utterances of the same length.
+        indices = sorted(indices, key=lambda idx: self.lengths[idx])
+        batches = self._pack(indices)
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=self.generator).tolist()
+            batches = [batches[idx] for idx in order]
+
+        for batch in batches:
+            yield batch
+
+    def __len__(self):
+        return len(self.batch_sizes)
+
+    def _pack(self, indices):
+        batches = []
+        batch, max_length = [], 0
+
+        for idx in indices:
+            length = max(max_length, self.lengths[idx])
+            exceeded = (len(batch) + 1) * length > self.max_samples
+            exceeded = exceeded or (self.max_batch_size is not None and len(batch) >= self.max_batch_size)
+
+            if len(batch) > 0 and exceeded:
+                batches.append(batch)
+                batch, length = [], self.lengths[idx]
+
+            batch.append(idx)
+            max_length = length
+
+        if len(batch) > 0:
+            batches.append(batch)
+
+        return batches
+
+def padded_collate_fn(batch):
+    """
+    Pad variable-length utterances with zeros at the end.
+    Args:
+        batch <list<tuple>>: (mixture, sources) or (mixture, sources, segment_ID), where mixture is (*, T_i) and sources is (n_sources, *, T_i).
+    Returns:
+        mixture (batch_size, *, T_max) <torch.Tensor>
+        sources (batch_size, n_sources, *, T_max) <torch.Tensor>
+        segment_IDs <list<str>>: Returned only if given.
+        mask (batch_size, T_max) <torch.BoolTensor>: True for valid samples.
+    """
+    lengths = torch.tensor([item[0].size(-1) for item in batch], dtype=torch.long)
+    max_length = lengths.max().item()
+
+    batched_mixture = torch.stack([torch.nn.functional.pad(item[0], (0, max_length - item[0].size(-1))) for item in batch], dim=0)
+    batched_sources = torch.stack([torch.nn.functional.pad(item[1], (0, max_length - item[1].size(-1))) for item in batch], dim=0)
+    mask = torch.arange(max_length) < lengths.unsqueeze(dim=1)
+
+    if len(batch[0]) > 2:
+        batched_segment_ID = [item[2] for item in batch]
+
+        return batched_mixture, batched_sources, batched_segment_ID, mask
+
+    return batched_mixture, batched_sources, mask
+
+class SourcePool:
+    """
+    In-memory pool of utterances for dynamic mixing.
+    Each file is loaded only once into a single int16 tensor in shared memory, so that workers of DataLoader read it without copy or disk I/O.
+    Only the first channel is stored.
+    """
+    def __init__(self, paths, speaker_IDs=None, root=None):
+        """
+        Args:
+            paths <list<str>>: Paths to audio files
+            speaker_IDs <list<str>>: Speaker ID of each file. If None, each file is regarded as a different speaker.
+            root <str>: If given, paths are relative to `root`.
+        """
+        if speaker_IDs is None:
+            speaker_IDs = list(range(len(paths)))
+
+        assert len(paths) == len(speaker_IDs), "Lengths of paths and speaker_IDs are different."
+
+        n_frames = []
+        sample_rate = None
+
+        for path in paths:
+            info = torchaudio.info(_get_packed_path(path, root=root))
+
+            if sample_rate is None:
+                sample_rate = info.sample_rate
+            elif info.sample_rate != sample_rate:
+                raise ValueError("Sampling rate of {} is {}, but {} is expected.".format(path, info.sample_rate, sample_rate))
+
+            n_frames.append(info.num_frames)
+
+        offsets = np.cumsum([0] + n_frames).tolist()
+        audio = torch.empty(offsets[-1], dtype=torch.int16)
+
+        for idx, path in enumerate(paths):
+            wave, _ = torchaudio.load(_get_packed_path(path, root=root))
+
+            assert wave.size(-1) == n_frames[idx], "Header of {} is inconsistent with its data.".format(path)
+
+            wave = torch.clamp(torch.round(wave[0] * 32768), -32768, 32767)
+            audio[offsets[idx]: offsets[idx + 1]] = wave.to(torch.int16)
+
+        self.audio = audio.share_memory_()
+        self.offsets = offsets[:-1]
+        self.n_frames = n_frames
+        self.sample_rate = sample_rate
+
+        self.speakers = {}
+
+        for idx, speaker_ID in enumerate(speaker_IDs):
+            if speaker_ID not in self.speakers:
+                self.speakers[speaker_ID] = []
+
+            self.speakers[speaker_ID].append(idx)
+
+        self.speaker_IDs = list(self.speakers.keys())
+
+    def __len__(self):
+        return len(self.n_frames)
+
+    def load(self, idx, frame_offset=0, num_frames=-1):
+        """
+        Args:
+            idx <int>: Index of utterance
+        Returns:
+            wave (1, num_frames) <torch.Tensor>
+        """
+        if num_frames < 0:
+            num_frames = self.n_frames[idx] - frame_offset
+
+        start = self.offsets[idx] + frame_offset
+        wave = self.audio[start: start + num_frames].float() / 32768
+
+        return wave.unsqueeze(dim=0)
+
+class DynamicMixingDataset(torch.utils.data.Dataset):
+    """
+    Dataset which synthesizes new mixture for every item from `SourcePool`, instead of replaying fixed mixtures.
+    Speakers, utterances, offsets and gains are drawn from torch's default generator, which DataLoader seeds differently for each worker and epoch.
+    """
+    def __init__(self, source_pool, n_mixtures, samples=32000, n_sources=2, max_gain=2.5, noise_pool=None, snr_range=(-6, 3)):
+        """
+        Args:
+            source_pool <SourcePool>: Pool of clean utterances
+            n_mixtures <int>: Number of mixtures per epoch
+            samples <int>: Length of mixture. Shorter utterance is zero-padded at random position.
+            n_sources <int>: Number of sources, each of which is uttered by different speaker.
+            max_gain <float>: Gain [dB] of each source normalized by RMS is drawn from [-max_gain, max_gain], i.e. relative level of 2 sources is in [-5, 5] dB by default as WSJ0-2mix.
+            noise_pool <SourcePool>: If given, noise randomly chosen from the pool is added to mixture, e.g. WHAM! noise.
+            snr_range <tuple<float>>: Range of SNR [dB] of speech mixture to noise. Default: (-6, 3) as WHAM!
+        """
+        super().__init__()
+
+        if len(source_pool.speaker_IDs) < n_sources:
+            raise ValueError("Source pool includes {} speakers, but n_sources={}.".format(len(source_pool.speaker_IDs), n_sources))
+
+        if noise_pool is not None and noise_pool.sample_rate != source_pool.sample_rate:
+            raise ValueError("Sampling rate of noise is {}, but {} is expected.".format(noise_pool.sample_rate, source_pool.sample_rate))
+
+        self.source_pool = source_pool
+        self.noise_pool = noise_pool
+
+        self.n_mixtures = n_mixtures
+        self.samples = samples
+        self.n_sources = n_sources
+        self.max_gain = max_gain
+        self.snr_range = snr_range
+
+    def __getitem__(self, idx):
+        """
+        Returns:
+            mixture (1, T) <torch.Tensor>
+            sources (n_sources, T) <torch.Tensor>
+        """
+        source_pool = self.source_pool
+        speaker_indices = torch.randperm(len(source_pool.speaker_IDs))[:self.n_sources].tolist()
+        sources = []
+
+        for speaker_idx in speaker_indices:
+            utterance_indices = source_pool.speakers[source_pool.speaker_IDs[speaker_idx]]
+            utterance_idx = utterance_indices[torch.randint(len(utterance_indices), ()).item()]
+            gain = self.max_gain * (2 * torch.rand(()).item() - 1)
+
+            source = self._load_segment(source_pool, utterance_idx)
+            source = 10**(gain / 20) * source
+            sources.append(source)
+
+        sources = torch.cat(sources, dim=0)
+        mixture = sources.sum(dim=0, keepdim=True)
+
+        if self.noise_pool is not None:
+            low, high = self.snr_range
+            snr = low + (high - low) * torch.rand(()).item()
+
+            noise = self._load_segment(self.noise_pool, torch.randint(len(self.noise_pool), ()).item())
+            noise = 10**(- snr / 20) * _compute_rms(mixture) * noise
+            mixture = mixture + noise
+
+        # Avoid clipping when mixture is saved or quantized.
+        max_amplitude = max(torch.abs(mixture).max().item(), torch.abs(sources).max().item())
+
+        if max_amplitude > MAX_AMPLITUDE:
+            scale = MAX_AMPLITUDE / max_amplitude
+            mixture, sources = scale * mixture, scale * sources
+
+        return mixture, sources
+
+    def __len__(self):
+        return self.n_mixtures
+
+    def _load_segment(self, pool, idx):
+        """
+        Returns:
+            wave (1, samples) <torch.Tensor>: Random segment normalized by RMS of valid samples
+        """
+        samples = self.samples
+        n_frames = pool.n_frames[idx]
+
+        if n_frames >= samples:
+            start = torch.randint(n_frames - samples + 1, ()).item()
+            wave = pool.load(idx, frame_offset=start, num_frames=samples)
+            wave = wave / _compute_rms(wave)
+        else:
+            start = torch.randint(samples - n_frames + 1, ()).item()
+            wave = pool.load(idx)
+            wave = wave / _compute_rms(wave)
+            wave = torch.nn.functional.pad(wave, (start, samples - n_frames - start))
+
+        return wave
+
+def _compute_rms(input, eps=EPS):
+    return torch.sqrt(torch.mean(input**2)) + eps
+
+def _test_n_frames_index():
+    import tempfile
+    import time
+
+    import torch
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_root = os.path.join(tmp_dir, 'wav')
+        os.makedirs(os.path.join(wav_root, 'mix'))
+        list_path = os.path.join(tmp_dir, 'mix_list')
+
+        IDs = ['utt-{}'.format(idx) for idx in range(3)]
+
+        with open(list_path, 'w') as f:
+            for idx, ID in enumerate(IDs):
+                torchaudio.save(os.path.join(wav_root, 'mix', '{}.wav'.format(ID)), torch.zeros(1, 8000 * (idx + 1)), 8000)
+                f.write('{}\n'.format(ID))
+
+        start = time.time()
+        index = build_n_frames_index(wav_root, list_path)
+        print(index, "{:.4f}[sec]".format(time.time() - start))
+
+        start = time.time()
+        index = build_n_frames_index(wav_root, list_path)
+        print(index, "{:.4f}[sec]".format(time.time() - start))
+
+        torchaudio.save(os.path.join(wav_root, 'mix', '{}.wav'.format(IDs[0])), torch.zeros(1, 100), 8000)
+        index = build_n_frames_index(wav_root, list_path)
+        print(index)
+
+def _test_packed_audio():
+    import tempfile
+
+    torch.manual_seed(111)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+
+        for idx in range(3):
+            path = os.path.join(tmp_dir, 'utt-{}.wav'.format(idx))
+            torchaudio.save(path, 0.1 * torch.randn(2, 1000 * (idx + 1)), 8000)
+            paths.append(path)
+
+        for dtype in ['float32', 'int16']:
+            pack_dir = os.path.join(tmp_dir, dtype)
+            packed_audio = build_packed_audio(paths, pack_dir, root=tmp_dir, dtype=dtype)
+
+            for path in paths:
+                wave, sr = packed_audio.load(path, frame_offset=100, num_frames=500)
+                target, _ = torchaudio.load(path, frame_offset=100, num_frames=500)
+                print(dtype, wave.size(), sr, torch.abs(wave - target).max().item())
+
+        # Changed file is packed again.
+        pack_dir = os.path.join(tmp_dir, 'float32')
+        torchaudio.save(paths[0], 0.1 * torch.randn(2, 1500), 8000)
+        packed_audio = build_packed_audio(paths, pack_dir, root=tmp_dir)
+        wave, _ = packed_audio.load(paths[0])
+        target, _ = torchaudio.load(paths[0])
+        print(wave.size(), torch.abs(wave - target).max().item())
+
+def _test_feature_cache():
+    import tempfile
+    import time
+
+    torch.manual_seed(111)
+
+    fft_size, hop_size = 512, 128
+    window = torch.hann_window(fft_size, periodic=True)
+    input = torch.randn(4, 3, 16000)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for dtype in ['complex64', 'float16']:
+            cache = FeatureCache(os.path.join(tmp_dir, dtype), max_bytes=None, dtype=dtype)
+
+            start = time.perf_counter()
+
+            for idx in range(len(input)):
+                feature = torch.stft(input[idx], n_fft=fft_size, hop_length=hop_size, window=window, return_complex=True)
+                cache.put(('utt-{}'.format(idx), 0, 16000, fft_size, hop_size, 'hann', False), feature)
+
+            end = time.perf_counter()
+            print(dtype, "put: {:.4f}[sec]".format(end - start))
+
+            start = time.perf_counter()
+
+            for idx in range(len(input)):
+                feature = cache.get(('utt-{}'.format(idx), 0, 16000, fft_size, hop_size, 'hann', False))
+
+            end = time.perf_counter()
+            print(dtype, "get: {:.4f}[sec]".format(end - start))
+
+            target = torch.stft(input[-1], n_fft=fft_size, hop_length=hop_size, window=window, return_complex=True)
+            print(dtype, torch.abs(feature - target).max().item())
+
+        # Eviction
+        cache = FeatureCache(os.path.join(tmp_dir, 'lru'), max_bytes=2.5 * target.numel() * 8, dtype='complex64', n_shards=2, touch_interval=0)
+
+        for idx in range(len(input)):
+            cache.put(('utt-{}'.format(idx),), target)
+            time.sleep(0.01)
+            cache.get(('utt-0',))
+
+        print([cache.get(('utt-{}'.format(idx),)) is not None for idx in range(len(input))])
+
+        # Workers sharing the cache
+        nbytes = target.numel() * 8
+        max_bytes, scan_bytes = 4 * nbytes, nbytes
+        caches = [FeatureCache(os.path.join(tmp_dir, 'shared'), max_bytes=max_bytes, n_shards=2, scan_bytes=scan_bytes) for _ in range(2)]
+        max_size = 0
+
+        for idx in range(16):
+            caches[idx % 2].put(('utt-{}'.format(idx),), target)
+            max_size = max(max_size, sum([size for _, _, size in caches[0]._scan()]))
+
+        print(max_size <= max_bytes + len(caches) * scan_bytes)
+
+        # Feature is not touched within touch_interval.
+        path = caches[0]._get_path(('utt-15',))
+        mtime = os.stat(path).st_mtime_ns
+        caches[0].get(('utt-15',))
+        print(os.stat(path).st_mtime_ns == mtime)
+
+def _test_length_bucket_batch_sampler():
+    torch.manual_seed(111)
+
+    lengths = torch.randint(8000, 40000, (100,)).tolist()
+    max_samples = 160000
+
+    sampler = LengthBucketBatchSampler(lengths, max_samples=max_samples, shuffle=True)
+    batches = list(sampler)
+    padded = sum([len(batch) * max([lengths[idx] for idx in batch]) for batch in batches])
+
+    print(len(batches), len(sampler), sorted(sum(batches, [])) == list(range(len(lengths))))
+    print(all([len(batch) * max([lengths[idx] for idx in batch]) <= max_samples for batch in batches]))
+    print("Padding: {:.2f}%".format(100 * (padded / sum(lengths) - 1)))
+
+    batch = [(torch.randn(1, T), torch.randn(2, T), 'utt-{}'.format(T)) for T in [5, 3]]
+    mixture, sources, segment_IDs, mask = padded_collate_fn(batch)
+    print(mixture.size(), sources.size(), segment_IDs, mask.sum(dim=1).tolist())
+
+def _test_dynamic_mixing():
+    import tempfile
+    import time
+
+    torch.manual_seed(111)
+
+    sr = 8000
+    n_speakers, n_utterances = 4, 3
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, speaker_IDs = [], []
+
+        for speaker_idx in range(n_speakers):
+            for utterance_idx in range(n_utterances):
+                path = 'spk{}-utt{}.wav'.format(speaker_idx, utterance_idx)
+                T = torch.randint(sr, 3 * sr, ()).item()
+                torchaudio.save(os.path.join(tmp_dir, path), 0.1 * torch.randn(1, T), sr)
+                paths.append(path)
+                speaker_IDs.append('spk{}'.format(speaker_idx))
+
+        noise_path = os.path.join(tmp_dir, 'noise.wav')
+        torchaudio.save(noise_path, 0.1 * torch.randn(2, 4 * sr), sr)
+
+        source_pool = SourcePool(paths, speaker_IDs=speaker_IDs, root=tmp_dir)
+        wave, _ = torchaudio.load(os.path.join(tmp_dir, paths[-1]))
+        print(len(source_pool), source_pool.speaker_IDs, torch.abs(source_pool.load(len(paths) - 1) - wave).max().item())
+
+        noise_pool = SourcePool([noise_path])
+
+        for pool in [None, noise_pool]:
+            dataset = DynamicMixingDataset(source_pool, n_mixtures=100, samples=2 * sr, n_sources=2, noise_pool=pool)
+            loader = torch.utils.data.DataLoader(dataset, batch_size=4, shuffle=True, num_workers=1)
+
+            start = time.perf_counter()
+
+            for mixture, sources in loader:
+                pass
+
+            end = time.perf_counter()
+
+            # Residual is noise if noise pool is given, otherwise zero.
+            residual = mixture - sources.sum(dim=1, keepdim=True)
+            print(mixture.size(), sources.size(), "max amplitude: {:.3f}, residual: {:.3f}, {:.4f}[sec]".format(torch.abs(mixture).max().item(), torch.abs(residual).max().item(), end - start))
+
+if __name__ == '__main__':
+    _test_n_frames_index()
+    print()
+
+    _test_packed_audio()
+    print()
+
+    _test_feature_cache()
+    print()
+
+    _test_length_bucket_batch_sampler()
+    print()
+
+    _test_dynamic_mixing()
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+def forward_in_mini_batch(module, input, batch_size=None):
+    """
+    Args:
+        module <nn.Module>: Network without cross-sample state, e.g. in eval mode
+        input (batch_size, *): Input
+        batch_size <int>: Number of samples fed to `module` at once. If None, all samples are fed at once.
+    Returns:
+        output (batch_size, *): Output
+    """
+    if batch_size is None or batch_size >= input.size(0):
+        return module(input)
+
+    output = [module(_input) for _input in torch.split(input, batch_size, dim=0)]
+    output = torch.cat(output, dim=0)
+
+    return output
+
+def forward_targets(modules, input, target=None, batch_size=None, n_threads=1):
+    """
+    Forward `input` to networks of targets, e.g. `ParallelD3Net.net` or `ParallelOpenUnmix.net`.
+    Args:
+        modules <nn.ModuleDict>: Network of each target
+        input (batch_size, *): Input
+        target <str> or <list<str>>: Target(s) to be estimated. If None, all targets are estimated.
+        batch_size <int>: Number of samples fed to each network at once. If None, all samples are fed at once.
+        n_threads <int>: Number of threads to run networks of targets concurrently. Valid only on CPU.
+    Returns:
+        output (batch_size, *) if target is str, otherwise (batch_size, n_targets, *)
+    """
+    if type(target) is str:
+        output = forward_in_mini_batch(modules[target], input, batch_size=batch_size)
+
+        return output
+
+    if target is None:
+        targets = list(modules.keys())
+    elif isinstance(target, (list, tuple)):
+        targets = target
+    else:
+        raise TypeError("`target` is expected str, list or None, but given {}".format(type(target)))
+
+    def _forward(_target):
+        return forward_in_mini_batch(modules[_target], input, batch_size=batch_size)
+
+    if n_threads > 1 and not input.is_cuda:
+        # Autocast and no_grad are thread-local, so they are taken over by each thread.
+        enabled, dtype = torch.is_autocast_cpu_enabled(), torch.get_autocast_cpu_dtype()
+        grad_enabled = torch.is_grad_enabled()
+
+        def _forward_in_thread(_target):
+            with torch.autocast('cpu', dtype=dtype, enabled=enabled), torch.set_grad_enabled(grad_enabled):
+                return _forward(_target)
+
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            output = list(executor.map(_forward_in_thread, targets))
+    else:
+        output = [_forward(_target) for _target in targets]
+
+    output = torch.stack(output, dim=1)
+
+    return output
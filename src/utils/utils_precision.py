@@ -0,0 +1,186 @@
+import contextlib
+import functools
+import time
+
+import torch
+
+PRECISIONS = ['fp32', 'bf16', 'fp16']
+AUTOCAST_DTYPES = {
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16
+}
+
+class MixedPrecision:
+    """
+    Autocast and gradient scaling for training in reduced precision.
+    Usage mirrors `torch.cuda.amp.GradScaler`, and every method is no-op for fp32.
+    """
+    def __init__(self, precision='fp32', use_cuda=False):
+        """
+        Args:
+            precision <str>: 'fp32', 'bf16' or 'fp16'
+            use_cuda <bool>: If True, autocast is applied to CUDA tensors, otherwise CPU tensors.
+        """
+        if not precision in PRECISIONS:
+            raise ValueError("Not support precision {}. Choose from {}.".format(precision, PRECISIONS))
+
+        device_type = 'cuda' if use_cuda else 'cpu'
+
+        if precision == 'fp16' and device_type == 'cpu':
+            raise ValueError("fp16 is supported only on GPU. Use bf16 on CPU.")
+
+        self.precision = precision
+        self.device_type = device_type
+        self.enabled = precision != 'fp32'
+
+        # bf16 has the same range as fp32, so gradients are scaled only for fp16.
+        self.scaler = torch.cuda.amp.GradScaler(enabled=(precision == 'fp16'))
+
+    def autocast(self):
+        if not self.enabled:
+            return contextlib.nullcontext()
+
+        return torch.autocast(self.device_type, dtype=AUTOCAST_DTYPES[self.precision])
+
+    def backward(self, loss):
+        self.scaler.scale(loss).backward()
+
+    def unscale_(self, optimizer):
+        """
+        Call before gradient clipping.
+        """
+        self.scaler.unscale_(optimizer)
+
+    def step(self, optimizer):
+        self.scaler.step(optimizer)
+        self.scaler.update()
+
+    def state_dict(self):
+        return self.scaler.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.scaler.load_state_dict(state_dict)
+
+    def measure_speedup(self, model, compute_loss, n_iterations=3):
+        """
+        Measure how many times forward and backward in `self.precision` is faster than in fp32.
+        Gradients are cleared and buffers (e.g. running statistics of batch normalization) are restored, so training is not affected.
+        Args:
+            model <nn.Module>
+            compute_loss <callable>: Returns scalar loss. Called without arguments.
+            n_iterations <int>: Number of timed iterations for each precision.
+        Returns:
+            speedup <float>: Time in fp32 divided by time in `self.precision`.
+        """
+        if not self.enabled:
+            return 1.0
+
+        buffers = [buffer.clone() for buffer in model.buffers()]
+        elapsed = {}
+
+        for enabled in [False, True]:
+            self.enabled = enabled
+
+            # The first iteration is excluded as warm-up.
+            for idx in range(n_iterations + 1):
+                if idx == 1:
+                    self._synchronize()
+                    start = time.perf_counter()
+
+                with self.autocast():
+                    loss = compute_loss()
+
+                loss.backward()
+                model.zero_grad()
+
+            self._synchronize()
+            elapsed[enabled] = time.perf_counter() - start
+
+        with torch.no_grad():
+            for buffer, saved in zip(model.buffers(), buffers):
+                buffer.copy_(saved)
+
+        return elapsed[False] / elapsed[True]
+
+    def _synchronize(self):
+        if self.device_type == 'cuda':
+            torch.cuda.synchronize()
+
+def autocast_fp32(func):
+    """
+    Decorator to run numerically sensitive function in fp32 even under autocast.
+    Floating point tensors in the arguments are cast to fp32, so the outputs are fp32.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with contextlib.ExitStack() as stack:
+            # Only enabled autocast is disabled, to avoid warning about unavailable device.
+            if torch.is_autocast_enabled():
+                stack.enter_context(torch.autocast('cuda', enabled=False))
+            if torch.is_autocast_cpu_enabled():
+                stack.enter_context(torch.autocast('cpu', enabled=False))
+
+            args = [to_fp32(arg) for arg in args]
+            kwargs = {key: to_fp32(value) for key, value in kwargs.items()}
+
+            return func(*args, **kwargs)
+
+    return wrapper
+
+def to_fp32(input):
+    """
+    Cast half precision tensor to fp32. Other objects, including complex tensors, are returned as they are.
+    """
+    if isinstance(input, torch.Tensor) and input.dtype in [torch.float16, torch.bfloat16]:
+        return input.float()
+
+    return input
+
+def _test_mixed_precision():
+    import torch.nn as nn
+
+    torch.manual_seed(111)
+
+    batch_size, C, T = 4, 64, 4000
+    model = nn.Sequential(
+        nn.Conv1d(1, C, kernel_size=16, stride=8),
+        nn.BatchNorm1d(C),
+        nn.PReLU(),
+        nn.Conv1d(C, C, kernel_size=3, padding=1),
+        nn.ConvTranspose1d(C, 1, kernel_size=16, stride=8)
+    )
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    input = torch.randn(batch_size, 1, T)
+
+    @autocast_fp32
+    def compute_mse(input, target):
+        return torch.mean((input - target)**2)
+
+    mixed_precision = MixedPrecision('bf16')
+
+    def compute_loss():
+        output = model(input)
+        return compute_mse(output, input)
+
+    running_mean = model[1].running_mean.clone()
+    speedup = mixed_precision.measure_speedup(model, compute_loss)
+    print("bf16: x{:.2f} faster than fp32".format(speedup))
+    print(torch.equal(running_mean, model[1].running_mean))
+
+    for idx in range(3):
+        with mixed_precision.autocast():
+            output = model(input)
+
+        print(output.dtype, end=' ')
+
+        loss = compute_mse(output, input)
+        print(loss.dtype, loss.item())
+
+        optimizer.zero_grad()
+        mixed_precision.backward(loss)
+        mixed_precision.unscale_(optimizer)
+        nn.utils.clip_grad_norm_(model.parameters(), 5)
+        mixed_precision.step(optimizer)
+
+if __name__ == '__main__':
+    _test_mixed_precision()
@@ -1,6 +1,8 @@
 import warnings
 
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from utils.utils_filterbank import choose_filterbank
 from norm import GlobalLayerNorm, CumulativeLayerNorm1d
@@ -29,4 +31,150 @@ def choose_layer_norm(name, num_features, causal=False, eps=EPS, **kwargs):
     else:
         raise NotImplementedError("Not support {} layer normalization.".format(name))
     
-    return layer_norm
\ No newline at end of file
+    return layer_norm
+
+def separate_long(model, input, window_size, hop_size=None, batch_size=4, n_sources=None):
+    """
+    Separate long audio by overlap-add of windowed separation.
+    Windows are fed to the model in mini-batches, so that peak memory is bounded by window_size and batch_size rather than length of input.
+    Permutation of each window is aligned to the previous window by correlation in overlapped region, and windows are cross-faded.
+    Args:
+        model <nn.Module>: Time-domain separation model, e.g. ConvTasNet, DPRNNTasNet, DPTNet, GALRNet, which returns (batch_size, n_sources, T) for (batch_size, 1, T).
+        input (n_batch, 1, T): Mixture. Each window is moved to the device of model and output is returned on the device of input.
+        window_size <int>: Number of samples in window
+        hop_size <int>: Hop size of window. If None, window_size // 2 is used. hop_size is expected smaller than window_size.
+        batch_size <int>: Number of windows fed to the model at once per mixture.
+        n_sources <int>: Number of sources. If None, model.n_sources is used.
+    Returns:
+        output (n_batch, n_sources, T): Separated sources
+    """
+    from criterion.hungarian import hungarian
+
+    if hop_size is None:
+        hop_size = window_size // 2
+    
+    if n_sources is None:
+        n_sources = model.module.n_sources if isinstance(model, nn.DataParallel) else model.n_sources
+
+    assert 0 < hop_size < window_size, "hop_size is expected in (0, window_size), but given {}.".format(hop_size)
+
+    device = next(model.parameters()).device
+    overlap = window_size - hop_size
+
+    n_batch, in_channels, T = input.size()
+
+    if T <= window_size:
+        padding = window_size - T
+    else:
+        padding = (hop_size - (T - window_size) % hop_size) % hop_size
+    
+    x = F.pad(input, (0, padding))
+    n_windows = (x.size(-1) - window_size) // hop_size + 1
+
+    # Windows are linearly cross-faded in overlapped region, and normalized by sum of weights.
+    ramp = torch.arange(1, overlap + 1, dtype=input.dtype, device=input.device) / (overlap + 1)
+    window = torch.ones(window_size, dtype=input.dtype, device=input.device)
+    window[:overlap] = torch.minimum(window[:overlap], ramp)
+    window[hop_size:] = torch.minimum(window[hop_size:], torch.flip(ramp, dims=(0,)))
+
+    output = input.new_zeros(n_batch, n_sources, x.size(-1))
+    normalization = input.new_zeros(x.size(-1))
+
+    pattern = torch.arange(n_sources).unsqueeze(dim=0).expand(n_batch, n_sources) # pattern[:, i] is index of i-th source in the previous window
+    previous = None # The previous window before alignment
+
+    with torch.no_grad():
+        for start_idx in range(0, n_windows, batch_size):
+            end_idx = min(start_idx + batch_size, n_windows)
+            n_chunks = end_idx - start_idx
+
+            chunk = x[:, :, start_idx * hop_size: (end_idx - 1) * hop_size + window_size]
+            chunk = chunk.unfold(-1, window_size, hop_size) # (n_batch, in_channels, n_chunks, window_size)
+            chunk = chunk.permute(0, 2, 1, 3).reshape(n_batch * n_chunks, in_channels, window_size)
+
+            estimated = model(chunk.to(device))
+            estimated = estimated.view(n_batch, n_chunks, n_sources, window_size).to(input.device)
+
+            # Permutation is resolved between adjacent windows, including the last window of the previous mini-batch.
+            if previous is None:
+                head, tail = estimated[:, :-1, :, hop_size:], estimated[:, 1:, :, :overlap]
+                patterns = [pattern]
+            else:
+                head = torch.cat([previous.unsqueeze(dim=1), estimated[:, :-1]], dim=1)[:, :, :, hop_size:]
+                tail = estimated[:, :, :, :overlap]
+                patterns = []
+
+            if tail.size(1) > 0:
+                head = head / (torch.norm(head, dim=-1, keepdim=True) + EPS)
+                tail = tail / (torch.norm(tail, dim=-1, keepdim=True) + EPS)
+                correlation = torch.matmul(head, tail.transpose(-2, -1)) # (n_batch, n_pairs, n_sources, n_sources)
+                relative_pattern = hungarian(correlation.view(-1, n_sources, n_sources), maximize=True)
+                relative_pattern = relative_pattern.view(n_batch, -1, n_sources)
+
+                for _relative_pattern in relative_pattern.unbind(dim=1):
+                    pattern = torch.gather(_relative_pattern, 1, pattern)
+                    patterns.append(pattern)
+
+            previous = estimated[:, -1]
+            patterns = torch.stack(patterns, dim=1).to(input.device) # (n_batch, n_chunks, n_sources)
+            estimated = torch.gather(estimated, 2, patterns.unsqueeze(dim=-1).expand(-1, -1, -1, window_size))
+
+            for chunk_idx in range(n_chunks):
+                start = (start_idx + chunk_idx) * hop_size
+                end = start + window_size
+                output[:, :, start: end] += window * estimated[:, chunk_idx]
+                normalization[start: end] += window
+    
+    output = output / normalization
+    output = output[:, :, :T]
+
+    return output
+
+def _test_separate_long():
+    class ShuffledBandSplit(nn.Module):
+        """
+        Separates low and high bands, and shuffles them randomly for each window.
+        """
+        def __init__(self, kernel_size=31):
+            super().__init__()
+
+            self.n_sources = 2
+            self.kernel_size = kernel_size
+            self.dummy = nn.Parameter(torch.zeros(1))
+
+        def forward(self, input):
+            kernel_size = self.kernel_size
+
+            lowpass = torch.ones(1, 1, kernel_size) / kernel_size
+            low = F.conv1d(F.pad(input, (kernel_size // 2, kernel_size // 2), mode='reflect'), lowpass)
+            high = input - low
+            output = torch.cat([low, high], dim=1)
+            flip = torch.rand(input.size(0)) < 0.5
+            output[flip] = torch.flip(output[flip], dims=(1,))
+
+            return output
+
+    torch.manual_seed(111)
+
+    n_batch, T = 2, 16000
+    window_size, hop_size = 4000, 1000
+
+    t = torch.arange(T) / 8000
+    low, high = torch.sin(2 * math.pi * 50 * t), 0.5 * torch.sin(2 * math.pi * 2000 * t)
+    input = (low + high).expand(n_batch, 1, T)
+
+    model = ShuffledBandSplit()
+    output = separate_long(model, input, window_size, hop_size=hop_size, batch_size=3)
+    print(input.size(), output.size())
+
+    target = model(input)[:, :, 100: -100]
+    output = output[:, :, 100: -100]
+
+    # Global permutation is also ambiguous.
+    error = torch.minimum(torch.abs(output - target).amax(dim=(1, 2)), torch.abs(output - torch.flip(target, dims=(1,))).amax(dim=(1, 2)))
+    print(error)
+
+if __name__ == '__main__':
+    import math
+
+    _test_separate_long()